@@ -0,0 +1,62 @@
+"""
+Benchmark of the fixed weight greedy selection of ``FixedWeightStrategy``.
+
+Compares ``OptimalWeights``, which masks the selected rows and updates the distances of all the rows with one
+product per step, with the previous implementation (reproduced below), which recomputed the distance of every
+remaining row from scratch and deleted the selected row from the gradient matrix on every step.
+
+Usage::
+
+    python benchmarks/SL/optimal_weights.py --n 5000 20000 50000 --d 500 --nnz_frac 0.02
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import OptimalWeights
+
+
+def row_deletion(A, b, nnz):
+    sum_sel_grad = torch.zeros_like(b)
+    w = 1.0
+    final_indices = []
+    remainList = [i for i in range(A.shape[0])]
+    b_norm = b.norm()
+    for i in range(nnz):
+        projection = (A + sum_sel_grad - w * b).norm(dim=1)
+        index = torch.argmin(projection).item()
+        sum_sel_grad += A[index]
+        w = torch.dot(A[index], sum_sel_grad) / b_norm
+        actual_idx = remainList[index]
+        final_indices.append(actual_idx)
+        remainList.remove(actual_idx)
+        A = torch.cat((A[:index], A[index + 1:]), dim=0)
+    return final_indices, [w for _ in range(nnz)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n', type=int, nargs='+', default=[5000, 20000, 50000])
+    parser.add_argument('--d', type=int, default=500)
+    parser.add_argument('--nnz_frac', type=float, default=0.02)
+    args = parser.parse_args()
+
+    print("{:>7s} {:>6s} {:>13s} {:>10s} {:>8s} {:>6s}".format("n", "nnz", "deletion (s)", "masked (s)", "speedup",
+                                                               "same"))
+    for n in args.n:
+        g = torch.Generator().manual_seed(0)
+        A = torch.randn(n, args.d, generator=g)
+        b = 0.1 * A[:n // 3].sum(dim=0)
+        nnz = max(1, int(args.nnz_frac * n))
+        start = time.perf_counter()
+        old_indices, _ = row_deletion(A, b, nnz)
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        indices, _ = OptimalWeights(A, b, nnz=nnz)
+        new_time = time.perf_counter() - start
+        print("{:>7d} {:>6d} {:>13.3f} {:>10.3f} {:>8.1f} {:>6s}".format(n, nnz, old_time, new_time,
+                                                                        old_time / new_time,
+                                                                        str(indices == old_indices)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+End-to-end benchmark of the subset selection overhead of the adaptive dataloaders on CPU.
+
+Trains a small model of ``cords.utils.models`` on a synthetic dataset for a few epochs with every ``dss_args.type``
+of ``train_sl.py`` given in ``--types`` (GradMatch, GradMatchPB, GLISTER, CRAIG, CRAIGPB, Random, SELCON) and with
+``Full``, following the training loop of ``train_sl.py``, and reports the time of every phase of an epoch:
+
+- ``gradients``: the per-element gradient passes of the selection strategy (``compute_gradients``,
+  ``compute_class_gradients``, GLISTER's ``_compute_train_gradients`` and ``_compute_val_gradients``, and the
+  gradient part of CRAIG's ``compute_score``)
+- ``solver``: the rest of the subset selection (OMP, greedy selection, distances and facility location, ...)
+- ``loader``: the rebuild of the subset DataLoader after a selection
+- ``training``: the rest of the epoch, i.e., the forward and backward passes on the subset
+- ``evaluation``: the loss and accuracy on the test set after every epoch
+
+The phases are timed by wrapping the methods of the dataloader and of its strategy; the time of a method called
+from another timed method is only counted in its own phase. ``setup`` is the construction of the dataloader,
+which for SELCON includes its precomputation. The epoch time is the sum of all the phases but evaluation, which
+is what ``train_sl.py`` reports as the timing of an epoch, and the speedup is the epoch time of ``Full`` over the
+epoch time of the strategy.
+
+The classification strategies run on ``--data tabular`` (gaussian classes of ``--features`` features and
+``TwoLayerNet``) or ``--data image`` (noisy 28x28 class templates and ``MnistNet``, 10 classes). SELCON selects
+subsets for linear regression, so it runs on a synthetic regression problem with ``RegressionNet`` and Adam, and is
+compared to ``Full`` on the same problem.
+
+Usage::
+
+    python benchmarks/SL/selection_overhead.py --data tabular --N 10000 --epochs 4 --select_every 1
+    python benchmarks/SL/selection_overhead.py --data image --N 5000 --types GradMatchPB CRAIGPB Random \\
+        --output overhead.json
+"""
+import argparse
+import json
+import logging
+import time
+from collections import defaultdict
+import numpy as np
+import torch
+from dotmap import DotMap
+from torch.utils.data import DataLoader, TensorDataset
+from cords.utils.data.data_utils import WeightedSubset
+from cords.utils.data.dataloader.SL.adaptive import GLISTERDataLoader, CRAIGDataLoader, GradMatchDataLoader, \
+    RandomDataLoader, SELCONDataLoader
+from cords.utils.data.datasets.SL.custom_dataset_selcon import CustomDataset_WithId_SELCON
+from cords.utils.models import MnistNet, RegressionNet, TwoLayerNet
+
+TYPES = ['GradMatch', 'GradMatchPB', 'GLISTER', 'CRAIG', 'CRAIGPB', 'Random', 'SELCON']
+PHASES = ['gradients', 'solver', 'loader', 'training', 'evaluation']
+GRADIENT_METHODS = ['compute_gradients', 'compute_class_gradients', '_compute_loader_gradients',
+                    '_compute_train_gradients', '_compute_val_gradients', 'compute_score']
+SOLVER_METHODS = ['distance', '_memmap_dist_mat']
+
+
+class PhaseTimer(object):
+    """
+    Accumulates the wall time of wrapped methods per phase. The time of a wrapped method called from another
+    wrapped method is only counted in the phase of the inner method.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.stack = []
+
+    def wrap(self, obj, name, phase):
+        fn = getattr(obj, name)
+
+        def wrapper(*args, **kwargs):
+            self.stack.append([phase, 0.0])
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                _, inner = self.stack.pop()
+                self.totals[phase] += elapsed - inner
+                if self.stack:
+                    self.stack[-1][1] += elapsed
+
+        setattr(obj, name, wrapper)
+
+    def snapshot(self):
+        return dict(self.totals)
+
+
+def classification_data(kind, N, features, num_classes, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    if kind == 'image':
+        templates = torch.randn(num_classes, 1, 28, 28, generator=g)
+    else:
+        templates = 2 * torch.randn(num_classes, features, generator=g)
+
+    def split(n):
+        labels = torch.randint(0, num_classes, (n,), generator=g)
+        return TensorDataset(templates[labels] + torch.randn((n,) + templates.shape[1:], generator=g), labels)
+
+    return split(N), split(max(num_classes, N // 10)), split(max(num_classes, N // 5))
+
+
+def regression_data(N, features, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    w = torch.randn(features, generator=g)
+
+    def split(n):
+        X = torch.randn(n, features, generator=g)
+        return CustomDataset_WithId_SELCON(X, torch.matmul(X, w) + 0.1 * torch.randn(n, generator=g))
+
+    return split(N), split(max(100, N // 10)), split(max(100, N // 5))
+
+
+def dss_args(dss_type, args, model, loss_nored, num_classes):
+    """
+    Data subset selection arguments of `dss_type`, as in the cifar10 and lawschool configs of `configs/SL`.
+    """
+    base = dict(fraction=args.fraction, select_every=args.select_every, kappa=0, device='cpu', model=model,
+                loss=loss_nored, num_classes=num_classes, num_epochs=args.epochs, collate_fn=None)
+    if dss_type.startswith('GradMatch'):
+        base.update(eta=args.lr, lam=0.5, v1=True, valid=False, eps=1e-100, linear_layer=True,
+                    selection_type='PerBatch' if dss_type == 'GradMatchPB' else 'PerClassPerGradient')
+    elif dss_type == 'GLISTER':
+        base.update(eta=args.lr, linear_layer=False, selection_type='Supervised', greedy='Stochastic')
+    elif dss_type.startswith('CRAIG'):
+        base.update(linear_layer=False, optimizer='lazy', if_convex=False,
+                    selection_type='PerBatch' if dss_type == 'CRAIGPB' else 'PerClass')
+    elif dss_type == 'SELCON':
+        base.update(delta=torch.tensor(0.04), linear_layer=False, lam=1e-5, lr=args.lr,
+                    batch_size=args.batch_size, selection_type='Supervised')
+    return DotMap(base)
+
+
+def evaluate(model, loader, loss, is_reg):
+    model.eval()
+    total_loss, correct, total = 0.0, 0, 0
+    with torch.no_grad():
+        for data in loader:
+            inputs, targets = data[0], data[1]
+            outputs = model(inputs)
+            if is_reg:
+                outputs = outputs.view(-1)
+            total_loss += loss(outputs, targets).sum().item()
+            if not is_reg:
+                correct += outputs.argmax(dim=1).eq(targets).sum().item()
+            total += len(targets)
+    return total_loss / total, (correct / total if not is_reg else None)
+
+
+def run(dss_type, args, logger, is_reg=False):
+    torch.manual_seed(args.seed)
+    np.random.seed(args.seed)
+    if is_reg:
+        trainset, validset, testset = regression_data(args.N, args.features, seed=args.seed)
+        model, num_classes = RegressionNet(args.features), 1
+        loss_nored = torch.nn.MSELoss(reduction='none')
+        # SELCON reads the moments of Adam and drops the last incomplete batch
+        optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+        loader_kwargs = dict(batch_size=args.batch_size, shuffle=False, drop_last=True)
+    else:
+        num_classes = 10 if args.data == 'image' else args.num_classes
+        trainset, validset, testset = classification_data(args.data, args.N, args.features, num_classes,
+                                                          seed=args.seed)
+        model = MnistNet() if args.data == 'image' else TwoLayerNet(args.features, num_classes, args.hidden)
+        loss_nored = torch.nn.CrossEntropyLoss(reduction='none')
+        optimizer = torch.optim.SGD(model.parameters(), lr=args.lr, momentum=0.9)
+        loader_kwargs = dict(batch_size=args.batch_size, shuffle=False)
+    trainloader = DataLoader(trainset, **loader_kwargs)
+    valloader = DataLoader(validset, **loader_kwargs)
+    testloader = DataLoader(testset, batch_size=args.batch_size, shuffle=False)
+
+    timer = PhaseTimer()
+    start = time.perf_counter()
+    if dss_type == 'Full':
+        dataloader = DataLoader(WeightedSubset(trainset, list(range(len(trainset))), [1] * len(trainset)),
+                                batch_size=args.batch_size, shuffle=True)
+    else:
+        dargs = dss_args(dss_type, args, model, loss_nored, num_classes)
+        if dss_type.startswith('GradMatch'):
+            dataloader = GradMatchDataLoader(trainloader, valloader, dargs, logger, batch_size=args.batch_size,
+                                             shuffle=True)
+        elif dss_type == 'GLISTER':
+            dataloader = GLISTERDataLoader(trainloader, valloader, dargs, logger, batch_size=args.batch_size,
+                                           shuffle=True)
+        elif dss_type.startswith('CRAIG'):
+            dataloader = CRAIGDataLoader(trainloader, valloader, dargs, logger, batch_size=args.batch_size,
+                                         shuffle=True)
+        elif dss_type == 'Random':
+            dataloader = RandomDataLoader(trainloader, dargs, logger, batch_size=args.batch_size, shuffle=True)
+        else:
+            dargs.optimizer = optimizer
+            dargs.criterion = torch.nn.MSELoss()
+            dataloader = SELCONDataLoader(trainset, validset, trainloader, valloader, dargs, logger,
+                                          batch_size=args.batch_size, shuffle=True)
+    setup = time.perf_counter() - start
+    if dss_type != 'Full':
+        timer.wrap(dataloader, '_resample_subset_indices', 'solver')
+        timer.wrap(dataloader, '_refresh_subset_loader', 'loader')
+        for name in GRADIENT_METHODS:
+            if hasattr(dataloader.strategy, name):
+                timer.wrap(dataloader.strategy, name, 'gradients')
+        for name in SOLVER_METHODS:
+            if hasattr(dataloader.strategy, name):
+                timer.wrap(dataloader.strategy, name, 'solver')
+
+    epochs = []
+    for epoch in range(args.epochs):
+        model.train()
+        before = timer.snapshot()
+        start = time.perf_counter()
+        for data in dataloader:
+            inputs, targets, weights = data[0], data[1], data[-1]
+            optimizer.zero_grad()
+            outputs = model(inputs)
+            if is_reg:
+                outputs = outputs.view(-1)
+            losses = loss_nored(outputs, targets)
+            loss = torch.dot(losses.view(-1), weights / weights.sum())
+            loss.backward()
+            optimizer.step()
+        loop = time.perf_counter() - start
+        phases = {phase: timer.totals[phase] - before.get(phase, 0.0) for phase in ['gradients', 'solver', 'loader']}
+        phases['training'] = loop - sum(phases.values())
+        start = time.perf_counter()
+        test_loss, test_acc = evaluate(model, testloader, loss_nored, is_reg)
+        phases['evaluation'] = time.perf_counter() - start
+        phases.update(epoch=epoch, test_loss=test_loss, test_acc=test_acc)
+        epochs.append(phases)
+    totals = {phase: sum(e[phase] for e in epochs) for phase in PHASES}
+    totals['epoch_time'] = sum(totals[phase] for phase in ['gradients', 'solver', 'loader', 'training'])
+    return {'type': dss_type, 'task': 'regression' if is_reg else 'classification', 'setup': setup,
+            'totals': totals, 'epochs': epochs, 'test_loss': epochs[-1]['test_loss'],
+            'test_acc': epochs[-1]['test_acc']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--types', nargs='+', choices=TYPES, default=TYPES)
+    parser.add_argument('--data', choices=['tabular', 'image'], default='tabular')
+    parser.add_argument('--N', type=int, default=10000)
+    parser.add_argument('--features', type=int, default=32)
+    parser.add_argument('--num_classes', type=int, default=10)
+    parser.add_argument('--hidden', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--lr', type=float, default=0.01)
+    parser.add_argument('--epochs', type=int, default=4)
+    parser.add_argument('--fraction', type=float, default=0.1)
+    parser.add_argument('--select_every', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help="JSON file of the per-epoch timings")
+    args = parser.parse_args()
+
+    torch.set_num_threads(args.threads)
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.WARNING)
+    results = []
+    full = {}
+    print("{:>12s} {:>8s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>10s} {:>8s} {:>9s}".format(
+        "type", "setup", "gradients", "solver", "loader", "training", "eval", "epoch", "selection", "speedup",
+        "test"))
+    tasks = [(False, [t for t in args.types if t != 'SELCON'])]
+    if 'SELCON' in args.types:
+        tasks.append((True, ['SELCON']))
+    for is_reg, types in tasks:
+        if not types:
+            continue
+        for dss_type in ['Full'] + types:
+            result = run(dss_type, args, logger, is_reg=is_reg)
+            totals = result['totals']
+            if dss_type == 'Full':
+                full[is_reg] = totals['epoch_time']
+            result['selection_fraction'] = (totals['gradients'] + totals['solver'] + totals['loader']) / \
+                totals['epoch_time']
+            result['speedup'] = full[is_reg] / totals['epoch_time']
+            results.append(result)
+            print("{:>12s} {:>8.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.1f}% {:>8.2f} {:>9.4f}"
+                  .format(dss_type + (' (reg)' if is_reg else ''), result['setup'], totals['gradients'],
+                          totals['solver'], totals['loader'], totals['training'], totals['evaluation'],
+                          totals['epoch_time'], 100 * result['selection_fraction'], result['speedup'],
+                          result['test_loss'] if is_reg else result['test_acc']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
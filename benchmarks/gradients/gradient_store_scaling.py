@@ -0,0 +1,67 @@
+"""
+Scaling benchmark for the per-sample gradient computation used by the data selection strategies.
+
+Compares the incremental ``torch.cat`` accumulation that ``compute_gradients`` used to do against
+the preallocated :class:`cords.selectionstrategies.helpers.GradientStore`. Synthetic last layer
+outputs and embeddings are used so that only the accumulation cost is measured.
+
+Usage::
+
+    python benchmarks/gradients/gradient_store_scaling.py --sizes 5000 10000 20000 40000 --num_classes 10 --embDim 64
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import GradientStore
+
+
+def cat_accumulate(batches, num_classes, embDim):
+    for batch_idx, (l0_grads, l1) in enumerate(batches):
+        batch_l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
+        batch_l1_grads = batch_l0_expand * l1.repeat(1, num_classes)
+        if batch_idx == 0:
+            all_l0_grads, all_l1_grads = l0_grads, batch_l1_grads
+        else:
+            all_l0_grads = torch.cat((all_l0_grads, l0_grads), dim=0)
+            all_l1_grads = torch.cat((all_l1_grads, batch_l1_grads), dim=0)
+    return torch.cat((all_l0_grads, all_l1_grads), dim=1)
+
+
+def store_accumulate(batches, num_rows, num_classes, embDim):
+    store = GradientStore(num_rows, num_classes, embDim, True, 'cpu')
+    for l0_grads, l1 in batches:
+        store.append(l0_grads, l1)
+    return store.gradients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 10000, 20000, 40000])
+    parser.add_argument('--num_classes', type=int, default=10)
+    parser.add_argument('--embDim', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=20)
+    args = parser.parse_args()
+
+    print("{:>10s} {:>12s} {:>12s} {:>14s} {:>14s}".format("N", "cat (s)", "store (s)", "cat us/row", "store us/row"))
+    for N in args.sizes:
+        g = torch.Generator().manual_seed(0)
+        batches = [(torch.randn(args.batch_size, args.num_classes, generator=g),
+                    torch.randn(args.batch_size, args.embDim, generator=g))
+                   for _ in range(N // args.batch_size)]
+        num_rows = len(batches) * args.batch_size
+
+        start = time.perf_counter()
+        dense = cat_accumulate(batches, args.num_classes, args.embDim)
+        cat_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stored = store_accumulate(batches, num_rows, args.num_classes, args.embDim)
+        store_time = time.perf_counter() - start
+
+        assert torch.equal(dense, stored)
+        print("{:>10d} {:>12.4f} {:>12.4f} {:>14.3f} {:>14.3f}".format(
+            num_rows, cat_time, store_time, 1e6 * cat_time / num_rows, 1e6 * store_time / num_rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Peak memory benchmark of GradMatch style OMP selection with in-memory and memory mapped gradients.
+
+Every configuration runs in a fresh subprocess, which fills a gradient store with synthetic last layer gradients
+(``GradientStore`` or ``MemmapGradientStore``) and runs ``OrthogonalMP_REG_Parallel_V1`` on it. The peak resident
+set size of the subprocess is read with ``resource.getrusage``. Only a tile of the memory mapped gradients is
+loaded at any time, so their peak RSS stays flat as N grows, while the in-memory gradients grow linearly.
+
+Usage::
+
+    python benchmarks/gradients/memmap_rss.py --sizes 10000 20000 40000 --num_classes 10 --embDim 256
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import torch
+from cords.selectionstrategies.helpers import GradientStore, MemmapGradientStore, OrthogonalMP_REG_Parallel_V1
+
+
+def run(mode, N, num_classes, embDim, budget, batch_size=256):
+    g = torch.Generator().manual_seed(0)
+    if mode == 'memory':
+        store = GradientStore(N, num_classes, embDim, True, 'cpu')
+    else:
+        store = MemmapGradientStore(N, num_classes, embDim, True, 'cpu',
+                                    dtype=torch.float16 if mode == 'memmap16' else torch.float32)
+    for start in range(0, N, batch_size):
+        l0 = torch.randn(min(batch_size, N - start), num_classes, generator=g)
+        l1 = torch.relu(torch.randn(l0.shape[0], embDim, generator=g))
+        store.append(l0, l1)
+    grads = store.gradients()
+    start = time.perf_counter()
+    reg = OrthogonalMP_REG_Parallel_V1(grads.t(), grads.sum(dim=0), nnz=budget, positive=True, lam=0.5)
+    omp_time = time.perf_counter() - start
+    return {'omp_time': omp_time, 'nnz': int((reg > 0).sum()),
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 20000, 40000])
+    parser.add_argument('--num_classes', type=int, default=10)
+    parser.add_argument('--embDim', type=int, default=256)
+    parser.add_argument('--budget', type=int, default=50)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run(args.child[0], int(args.child[1]), args.num_classes, args.embDim, args.budget)))
+        return
+
+    d = GradientStore.gradient_dim(args.num_classes, args.embDim, True)
+    print("{:>7s} {:>9s} {:>10s} {:>13s} {:>9s}".format("N", "mode", "grads (MB)", "peak RSS (MB)", "omp (s)"))
+    for N in args.sizes:
+        for mode in ['memory', 'memmap', 'memmap16']:
+            out = subprocess.run([sys.executable, __file__, '--child', mode, str(N),
+                                  '--num_classes', str(args.num_classes), '--embDim', str(args.embDim),
+                                  '--budget', str(args.budget)], check=True, capture_output=True, text=True)
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print("{:>7d} {:>9s} {:>10.1f} {:>13.1f} {:>9.3f}".format(N, mode, N * d * 4 / 2 ** 20,
+                                                                   result['peak_rss_mb'], result['omp_time']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark of the per-element gradient pass that precedes every selection round.
+
+Compares the previous pass (training batch size, autograd through the loss) against the pass with a
+``selection_batch_size`` and the closed-form cross entropy gradient, which runs the forward pass under
+``torch.inference_mode``. Both passes produce the same gradients up to floating point error.
+
+Usage::
+
+    python benchmarks/gradients/selection_pass.py --model mlp --N 50000 --selection_batch_size 20 256 1024
+    python benchmarks/gradients/selection_pass.py --model resnet18 --N 2000 --selection_batch_size 20 256
+"""
+import argparse
+import logging
+import time
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from cords.selectionstrategies.SL import DataSelectionStrategy
+from cords.utils.models import ResNet18, TwoLayerNet
+
+
+def autograd_pass(strategy, loader):
+    grads = []
+    for inputs, targets in loader:
+        out, l1 = strategy.model(inputs, last=True, freeze=True)
+        loss = strategy.loss(out, targets).sum()
+        l0_grads = torch.autograd.grad(loss, out)[0]
+        l0_expand = torch.repeat_interleave(l0_grads, l1.shape[1], dim=1)
+        grads.append(torch.cat((l0_grads, l0_expand * l1.repeat(1, out.shape[1])), dim=1))
+    return torch.cat(grads, dim=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=['mlp', 'resnet18'], default='mlp')
+    parser.add_argument('--N', type=int, default=50000)
+    parser.add_argument('--num_classes', type=int, default=10)
+    parser.add_argument('--batch_size', type=int, default=20)
+    parser.add_argument('--selection_batch_size', type=int, nargs='+', default=[20, 256, 1024])
+    args = parser.parse_args()
+
+    g = torch.Generator().manual_seed(0)
+    shape = (3, 32, 32) if args.model == 'resnet18' else (64,)
+    dataset = TensorDataset(torch.randn(args.N, *shape, generator=g),
+                            torch.randint(0, args.num_classes, (args.N,), generator=g))
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False)
+    torch.manual_seed(0)
+    if args.model == 'resnet18':
+        model = ResNet18(args.num_classes).eval()
+    else:
+        model = TwoLayerNet(64, args.num_classes, 256).eval()
+    loss = torch.nn.CrossEntropyLoss(reduction='none')
+    logger = logging.getLogger(__name__)
+
+    strategy = DataSelectionStrategy(loader, loader, model, args.num_classes, True, loss, 'cpu', logger)
+    start = time.perf_counter()
+    reference = autograd_pass(strategy, loader)
+    base_time = time.perf_counter() - start
+
+    print("{:>22s} {:>10s} {:>9s} {:>10s}".format("pass", "time (s)", "speedup", "max err"))
+    print("{:>22s} {:>10.3f} {:>9.2f} {:>10s}".format("autograd bs=%d" % args.batch_size, base_time, 1.0, "-"))
+    for selection_batch_size in args.selection_batch_size:
+        strategy = DataSelectionStrategy(loader, loader, model, args.num_classes, True, loss, 'cpu', logger,
+                                         selection_batch_size=selection_batch_size)
+        start = time.perf_counter()
+        strategy.compute_gradients()
+        pass_time = time.perf_counter() - start
+        err = (strategy.grads_per_elem - reference).abs().max().item()
+        print("{:>22s} {:>10.3f} {:>9.2f} {:>10.2e}".format("closed form bs=%d" % selection_batch_size,
+                                                          pass_time, base_time / pass_time, err))
+
+
+if __name__ == '__main__':
+    main()
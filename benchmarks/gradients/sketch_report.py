@@ -0,0 +1,76 @@
+"""
+Accuracy and speed report of gradient sketching against the unsketched gradients.
+
+Synthetic last layer gradients (softmax - onehot output gradients and non-negative embeddings with class
+dependent means) are generated for N elements, and GradMatch style OMP selection is run on the full gradients
+and on their sketches. For every sketch the report gives the time to sketch and to solve OMP, the relative
+gradient matching error of the selected weighted subset measured on the *full* gradients, and the overlap of
+the selected subset with the unsketched selection.
+
+Usage::
+
+    python benchmarks/gradients/sketch_report.py --N 4000 --num_classes 20 --embDim 128 --budget 200
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import GradientSketch, OrthogonalMP_REG_Parallel_V1
+
+
+def synthetic_gradients(N, num_classes, embDim, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    labels = torch.randint(0, num_classes, (N,), generator=g)
+    centers = torch.randn(num_classes, embDim, generator=g)
+    l1 = torch.relu(centers[labels] + 0.5 * torch.randn(N, embDim, generator=g))
+    logits = 2 * torch.randn(N, num_classes, generator=g)
+    l0 = torch.softmax(logits, dim=1) - torch.nn.functional.one_hot(labels, num_classes).float()
+    l0_expand = torch.repeat_interleave(l0, embDim, dim=1)
+    return torch.cat((l0, l0_expand * l1.repeat(1, num_classes)), dim=1)
+
+
+def omp_select(grads, target, budget, lam):
+    start = time.perf_counter()
+    reg = OrthogonalMP_REG_Parallel_V1(grads.t(), target, nnz=budget, positive=True, lam=lam, tol=1e-4)
+    return reg, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--N', type=int, default=4000)
+    parser.add_argument('--num_classes', type=int, default=20)
+    parser.add_argument('--embDim', type=int, default=128)
+    parser.add_argument('--budget', type=int, default=200)
+    parser.add_argument('--lam', type=float, default=0.5)
+    parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument('--sketch_dims', type=int, nargs='+', default=[64, 256, 1024])
+    parser.add_argument('--sketch_types', type=str, nargs='+', default=['gaussian', 'sparse', 'srht'])
+    args = parser.parse_args()
+
+    grads = synthetic_gradients(args.N, args.num_classes, args.embDim)
+    target = grads.sum(dim=0)
+    reg, omp_time = omp_select(grads, target, args.budget, args.lam)
+    full_support = set(torch.nonzero(reg).view(-1).tolist())
+    full_err = ((grads.t() @ reg - target).norm() / target.norm()).item()
+
+    print("N={} gradient dim={} budget={}".format(args.N, grads.shape[1], args.budget))
+    print("{:>9s} {:>6s} {:>10s} {:>10s} {:>10s} {:>9s}".format(
+        "sketch", "k", "sketch(s)", "omp(s)", "match err", "overlap"))
+    print("{:>9s} {:>6d} {:>10s} {:>10.3f} {:>10.4f} {:>9.2f}".format(
+        "none", grads.shape[1], "-", omp_time, full_err, 1.0))
+    for sketch_type in args.sketch_types:
+        for k in args.sketch_dims:
+            start = time.perf_counter()
+            sketch = GradientSketch(grads.shape[1], k, sketch_type=sketch_type, seed=0)
+            sketches = torch.cat([sketch.project(grads[i:i + args.batch_size])
+                                  for i in range(0, args.N, args.batch_size)], dim=0)
+            sketch_time = time.perf_counter() - start
+            reg_s, omp_time_s = omp_select(sketches, sketches.sum(dim=0), args.budget, args.lam)
+            support = set(torch.nonzero(reg_s).view(-1).tolist())
+            err = ((grads.t() @ reg_s - target).norm() / target.norm()).item()
+            overlap = len(support & full_support) / max(1, len(full_support))
+            print("{:>9s} {:>6d} {:>10.3f} {:>10.3f} {:>10.4f} {:>9.2f}".format(
+                sketch_type, k, sketch_time, omp_time_s, err, overlap))
+
+
+if __name__ == '__main__':
+    main()
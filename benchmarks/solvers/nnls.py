@@ -0,0 +1,68 @@
+"""
+Benchmark of the nonnegative least squares solvers used for the weights of a fixed subset (AdapWeights).
+
+Every round perturbs the gradients of the previous round and solves ``min_w |A w - b|, w >= 0`` for the d x k
+gradient matrix ``A`` of the subset three times: with ``scipy.optimize.nnls`` on the host (previously used by
+``AdapWeightsStrategy``), and with ``NonnegativeLS`` from 0 (cold) and from the weights of the previous round
+(warm). The factorizations column counts the Cholesky factorizations of ``NonnegativeLS``.
+
+Usage::
+
+    python benchmarks/solvers/nnls.py --d 2000 --k 250 500 1000 1500 --rounds 3 --drift 0.05
+"""
+import argparse
+import time
+import numpy as np
+import torch
+from scipy.optimize import nnls
+from cords.selectionstrategies.helpers import NonnegativeLS, omp_solvers
+
+_batched_cholesky = omp_solvers._batched_cholesky
+factorizations = [0]
+
+
+def _counting_cholesky(H):
+    factorizations[0] += 1
+    return _batched_cholesky(H)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--d', type=int, default=2000)
+    parser.add_argument('--k', type=int, nargs='+', default=[250, 500, 1000, 1500])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--drift', type=float, default=0.05)
+    args = parser.parse_args()
+
+    omp_solvers._batched_cholesky = _counting_cholesky
+    print("{:>5s} {:>6s} {:>10s} {:>9s} {:>9s} {:>8s} {:>14s} {:>12s}".format(
+        "k", "round", "scipy (s)", "cold (s)", "warm (s)", "speedup", "factorizations", "max |dres|"))
+    for k in args.k:
+        g = torch.Generator().manual_seed(0)
+        A = torch.randn(args.d, k, generator=g, dtype=torch.float64)
+        w = torch.relu(torch.randn(k, generator=g, dtype=torch.float64))
+        x0 = None
+        for r in range(args.rounds):
+            if r > 0:
+                A = A + args.drift * torch.randn(args.d, k, generator=g, dtype=torch.float64)
+            b = torch.matmul(A, w) + 0.1 * torch.randn(args.d, generator=g, dtype=torch.float64)
+            start = time.perf_counter()
+            _, resid_scipy = nnls(A.numpy(), b.numpy(), maxiter=30 * k)
+            scipy_time = time.perf_counter() - start
+            start = time.perf_counter()
+            Q, c = torch.matmul(A.t(), A), torch.matmul(A.t(), b)
+            x_cold = NonnegativeLS(Q, c)
+            cold_time = time.perf_counter() - start
+            factorizations[0] = 0
+            start = time.perf_counter()
+            Q, c = torch.matmul(A.t(), A), torch.matmul(A.t(), b)
+            x_warm = NonnegativeLS(Q, c, x0=x0)
+            warm_time = time.perf_counter() - start
+            x0 = x_warm
+            dres = max(abs((b - torch.matmul(A, x)).norm().item() - resid_scipy) for x in [x_cold, x_warm])
+            print("{:>5d} {:>6d} {:>10.3f} {:>9.3f} {:>9.3f} {:>8.1f} {:>14d} {:>12.2e}".format(
+                k, r, scipy_time, cold_time, warm_time, scipy_time / warm_time, factorizations[0], dres))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the batched OMP solver, which solves the per-class problems of GradMatch PerClass selection together,
+against calling the Cholesky OMP solver once per class.
+
+Every class has its own design matrix of ``--n`` gradients of dimension ``--d`` and its own budget. The sequential
+solver runs one small matrix-vector product, one triangular update and a handful of small kernels per atom and
+class, so with many small classes its time goes into launching these; the batched solver runs them for all the
+classes at once as batched products.
+
+Usage::
+
+    python benchmarks/solvers/omp_batched.py --classes 10 100 --d 129 --n 500 --nnz 50
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import OrthogonalMP_REG_Batched, OrthogonalMP_REG_Cholesky
+
+
+def problems(num_classes, d, n, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    out = []
+    for _ in range(num_classes):
+        A = torch.relu(torch.randn(d, n, generator=g))
+        A[:d // 2] -= 0.3
+        out.append((A, A[:, :n // 2].sum(dim=1)))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--classes', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--d', type=int, default=129)
+    parser.add_argument('--n', type=int, default=500)
+    parser.add_argument('--nnz', type=int, default=50)
+    parser.add_argument('--lam', type=float, default=0)
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+
+    print("{:>8s} {:>15s} {:>13s} {:>9s} {:>10s}".format("classes", "sequential (s)", "batched (s)", "speedup",
+                                                         "supports"))
+    for num_classes in args.classes:
+        probs = [(A.to(args.device), b.to(args.device)) for A, b in problems(num_classes, args.d, args.n)]
+        start = time.perf_counter()
+        xs_seq = [OrthogonalMP_REG_Cholesky(A, b, nnz=args.nnz, positive=True, lam=args.lam, device=args.device)
+                  for A, b in probs]
+        seq_time = time.perf_counter() - start
+        start = time.perf_counter()
+        xs_bat = OrthogonalMP_REG_Batched([A for A, _ in probs], [b for _, b in probs], [args.nnz] * num_classes,
+                                          positive=True, lam=args.lam, device=args.device)
+        bat_time = time.perf_counter() - start
+        same = sum(torch.equal(torch.nonzero(x), torch.nonzero(y)) for x, y in zip(xs_seq, xs_bat))
+        print("{:>8d} {:>15.3f} {:>13.3f} {:>9.1f} {:>10s}".format(num_classes, seq_time, bat_time,
+                                                                   seq_time / bat_time,
+                                                                   "{}/{}".format(same, num_classes)))
+
+
+if __name__ == '__main__':
+    main()
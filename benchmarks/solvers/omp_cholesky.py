@@ -0,0 +1,62 @@
+"""
+Benchmark of the incremental Cholesky OMP solver against the OMP solvers that solve the least squares problem of
+the support from scratch for every atom.
+
+``OrthogonalMP_REG`` (numpy, used by GradMatch on CPU) and ``OrthogonalMP_REG_Parallel_V1`` (torch) rebuild the
+support matrix, form its Gram matrix and call ``lstsq`` for every new atom, i.e., O(k^3) per atom. The Cholesky
+solver updates the factor of the Gram matrix in O(k d + k^2) per atom. The lstsq solvers are only run up to
+``--max_lstsq_nnz`` atoms, since their cost grows as O(k^4).
+
+Usage::
+
+    python benchmarks/solvers/omp_cholesky.py --d 1000 --n 10000 --nnz 100 500 1000 2000
+"""
+import argparse
+import time
+import numpy as np
+import torch
+from cords.selectionstrategies.helpers import OrthogonalMP_REG, OrthogonalMP_REG_Cholesky, \
+    OrthogonalMP_REG_Parallel_V1
+
+
+def problem(d, n, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    A = torch.relu(torch.randn(d, n, generator=g))
+    A[:d // 2] -= 0.3
+    return A, A[:, :n // 2].sum(dim=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--d', type=int, default=1000)
+    parser.add_argument('--n', type=int, default=10000)
+    parser.add_argument('--nnz', type=int, nargs='+', default=[100, 500, 1000, 2000])
+    parser.add_argument('--lam', type=float, default=0)
+    parser.add_argument('--max_lstsq_nnz', type=int, default=500)
+    args = parser.parse_args()
+
+    A, b = problem(args.d, args.n)
+    print("{:>6s} {:>14s} {:>14s} {:>14s} {:>9s} {:>8s}".format("nnz", "numpy (s)", "torch V1 (s)", "cholesky (s)",
+                                                             "speedup", "overlap"))
+    for nnz in args.nnz:
+        start = time.perf_counter()
+        x_chol = OrthogonalMP_REG_Cholesky(A, b, nnz=nnz, positive=True, lam=args.lam)
+        chol_time = time.perf_counter() - start
+        if nnz > args.max_lstsq_nnz:
+            print("{:>6d} {:>14s} {:>14s} {:>14.3f} {:>9s} {:>8s}".format(nnz, "-", "-", chol_time, "-", "-"))
+            continue
+        start = time.perf_counter()
+        x_np = OrthogonalMP_REG(A.numpy(), b.numpy(), nnz=nnz, positive=True, lam=args.lam)
+        np_time = time.perf_counter() - start
+        start = time.perf_counter()
+        OrthogonalMP_REG_Parallel_V1(A, b, nnz=nnz, positive=True, lam=args.lam)
+        v1_time = time.perf_counter() - start
+        support_np = set(np.nonzero(x_np)[0].tolist())
+        support_chol = set(torch.nonzero(x_chol).view(-1).tolist())
+        overlap = len(support_np & support_chol) / max(1, len(support_np | support_chol))
+        print("{:>6d} {:>14.3f} {:>14.3f} {:>14.3f} {:>9.1f} {:>8.3f}".format(nnz, np_time, v1_time, chol_time,
+                                                                            np_time / chol_time, overlap))
+
+
+if __name__ == '__main__':
+    main()
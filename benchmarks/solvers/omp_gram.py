@@ -0,0 +1,57 @@
+"""
+Benchmark of the Gram formulation of the OMP solvers against the direct one, across the ratio of the number of
+atoms n to the number of selected atoms nnz.
+
+The direct solvers compute the correlations A^T r in O(n d) per atom. The Gram formulation forms G = A^T A once in
+O(n^2 d) and then needs O(n k) per atom, which pays off when n is small compared to d and nnz, as in PerBatch
+selection where the atoms are mini-batch gradients. ``auto`` is the choice made by the solvers when ``gram=None``.
+
+Usage::
+
+    python benchmarks/solvers/omp_gram.py --d 5000 --n 250 500 1000 2000 4000 --nnz_frac 0.1 0.25
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import OrthogonalMP_REG_Cholesky, OrthogonalMP_REG_Parallel_V1
+from cords.selectionstrategies.helpers.omp_solvers import _use_gram
+
+
+def problem(d, n, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    A = torch.relu(torch.randn(d, n, generator=g))
+    A[:d // 2] -= 0.3
+    return A, A[:, :n // 2].sum(dim=1)
+
+
+def timed(solver, A, b, nnz, lam, gram):
+    start = time.perf_counter()
+    x = solver(A, b, nnz=nnz, positive=True, lam=lam, gram=gram)
+    return time.perf_counter() - start, x
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--d', type=int, default=5000)
+    parser.add_argument('--n', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000])
+    parser.add_argument('--nnz_frac', type=float, nargs='+', default=[0.1, 0.25])
+    parser.add_argument('--lam', type=float, default=0)
+    args = parser.parse_args()
+
+    solvers = [('V1', OrthogonalMP_REG_Parallel_V1), ('cholesky', OrthogonalMP_REG_Cholesky)]
+    print("{:>6s} {:>6s} {:>9s} {:>11s} {:>9s} {:>8s} {:>5s}".format("n", "nnz", "solver", "direct (s)",
+                                                                     "gram (s)", "speedup", "auto"))
+    for n in args.n:
+        A, b = problem(args.d, n)
+        for frac in args.nnz_frac:
+            nnz = max(1, int(frac * n))
+            for name, solver in solvers:
+                direct_time, x_direct = timed(solver, A, b, nnz, args.lam, False)
+                gram_time, x_gram = timed(solver, A, b, nnz, args.lam, True)
+                print("{:>6d} {:>6d} {:>9s} {:>11.3f} {:>9.3f} {:>8.2f} {:>5s}".format(
+                    n, nnz, name, direct_time, gram_time, direct_time / gram_time,
+                    "gram" if _use_gram(args.d, n, nnz) else "-"))
+
+
+if __name__ == '__main__':
+    main()
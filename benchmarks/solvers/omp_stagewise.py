@@ -0,0 +1,47 @@
+"""
+Benchmark of stagewise OMP, which adds several atoms per correlation with the residual.
+
+For every stage size s, ``OrthogonalMP_REG_Cholesky(..., stage_size=s)`` selects nnz atoms with about nnz / s
+products ``A^T r`` (s=1 is OMP, as used by ``GradMatchStrategy`` with ``omp_variant='cholesky'``). The table
+reports the time, the relative residual ``|b - A x| / |b|`` and the overlap (Jaccard) of the support with the
+one of OMP.
+
+Usage::
+
+    python benchmarks/solvers/omp_stagewise.py --d 2000 --n 20000 --nnz 1000 --stage_sizes 1 2 4 8 16 32 64
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import OrthogonalMP_REG_Cholesky
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--d', type=int, default=2000)
+    parser.add_argument('--n', type=int, default=20000)
+    parser.add_argument('--nnz', type=int, default=1000)
+    parser.add_argument('--stage_sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--lam', type=float, default=0)
+    args = parser.parse_args()
+
+    g = torch.Generator().manual_seed(0)
+    A = torch.relu(torch.randn(args.d, args.n, generator=g))
+    A[:args.d // 2] -= 0.3
+    b = A[:, :args.n // 2].sum(dim=1)
+    omp_support = None
+    print("{:>6s} {:>9s} {:>10s} {:>8s}".format("stage", "time (s)", "resid", "overlap"))
+    for s in args.stage_sizes:
+        start = time.perf_counter()
+        x = OrthogonalMP_REG_Cholesky(A, b, nnz=args.nnz, positive=True, lam=args.lam, gram=False, stage_size=s)
+        elapsed = time.perf_counter() - start
+        support = set(torch.nonzero(x).view(-1).tolist())
+        if omp_support is None:
+            omp_support = support
+        print("{:>6d} {:>9.3f} {:>10.4f} {:>8.3f}".format(
+            s, elapsed, ((b - torch.matmul(A, x)).norm() / b.norm()).item(),
+            len(support & omp_support) / len(support | omp_support)))
+
+
+if __name__ == '__main__':
+    main()
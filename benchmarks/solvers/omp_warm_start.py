@@ -0,0 +1,56 @@
+"""
+Benchmark of warm started OMP across selection rounds.
+
+Every round perturbs the gradients of the previous round, as a few epochs of training would, and solves the OMP
+problem of the round twice with ``OrthogonalMP_REG_Cholesky``: from an empty support (cold) and from the support
+of the previous round in decreasing order of its weights (warm, as ``GradMatchStrategy(warm_start=True)`` does).
+The warm start reuses the atoms that still correlate with the target without computing their correlations with
+the residual, which is where a cold solve spends its time.
+
+Usage::
+
+    python benchmarks/solvers/omp_warm_start.py --d 2000 --n 5000 --nnz 300 --rounds 5 --drift 0.05
+"""
+import argparse
+import time
+import torch
+from cords.selectionstrategies.helpers import OrthogonalMP_REG_Cholesky
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--d', type=int, default=2000)
+    parser.add_argument('--n', type=int, default=5000)
+    parser.add_argument('--nnz', type=int, default=300)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--drift', type=float, default=0.05)
+    parser.add_argument('--lam', type=float, default=0)
+    args = parser.parse_args()
+
+    g = torch.Generator().manual_seed(0)
+    A = torch.relu(torch.randn(args.d, args.n, generator=g))
+    A[:args.d // 2] -= 0.3
+    init = None
+    print("{:>6s} {:>9s} {:>9s} {:>8s} {:>7s} {:>12s} {:>12s}".format("round", "cold (s)", "warm (s)", "speedup",
+                                                                        "reused", "cold resid", "warm resid"))
+    for r in range(args.rounds):
+        if r > 0:
+            A = A + args.drift * torch.randn(args.d, args.n, generator=g)
+        b = A[:, :args.n // 2].sum(dim=1)
+        start = time.perf_counter()
+        x_cold = OrthogonalMP_REG_Cholesky(A, b, nnz=args.nnz, positive=True, lam=args.lam)
+        cold_time = time.perf_counter() - start
+        start = time.perf_counter()
+        x_warm = OrthogonalMP_REG_Cholesky(A, b, nnz=args.nnz, positive=True, lam=args.lam, init=init)
+        warm_time = time.perf_counter() - start
+        support = torch.nonzero(x_warm).view(-1)
+        reused = 0 if init is None else len(set(init).intersection(support.tolist()))
+        init = support[torch.argsort(x_warm[support], descending=True)].tolist()
+        print("{:>6d} {:>9.3f} {:>9.3f} {:>8.1f} {:>7d} {:>12.4f} {:>12.4f}".format(
+            r, cold_time, warm_time, cold_time / warm_time, reused,
+            ((b - torch.matmul(A, x_cold)).norm() / b.norm()).item(),
+            ((b - torch.matmul(A, x_warm)).norm() / b.norm()).item()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+Benchmark suite of the selection solvers on synthetic gradients, with machine readable output and a comparison
+against a stored baseline.
+
+The gradient matrix of ``--N`` elements of dimension ``--d`` is ``M[y] + U V + noise``: every element gets the
+mean ``M[y]`` of its class ``y`` (``--num_classes`` classes, assigned round robin), plus a shared variation of rank
+``--rank``, plus gaussian noise of standard deviation ``--noise``. The matrix has rank at most
+``num_classes + rank`` when the noise is 0. Every case selects ``--budget`` elements (split over the classes in
+proportion to their size for the per-class cases):
+
+- ``omp_numpy``, ``omp_parallel``, ``omp_v1``, ``omp_cholesky``, ``omp_stagewise``: the OMP solvers
+  ``OrthogonalMP_REG``, ``OrthogonalMP_REG_Parallel``, ``OrthogonalMP_REG_Parallel_V1`` and
+  ``OrthogonalMP_REG_Cholesky`` (with ``stage_size=8`` for stagewise) matching the sum of the gradients, as
+  GradMatch does. The residual is ``|A x - b| / |b|``.
+- ``omp_batched``: ``OrthogonalMP_REG_Batched`` on the per-class problems of GradMatch PerClass selection; the
+  residual is that of the concatenated per-class problems.
+- ``optimal_weights``: ``OptimalWeights`` matching the mean of the gradients with the sum of the subset, as
+  FixedWeight selection does. All the elements of the subset get the same weight, so the residual is that of the
+  best scaling of the sum ``s`` of the subset, ``min_c |c s - b| / |b|``.
+- ``glister_naive``, ``glister_stochastic``: ``GLISTERStrategy.greedy_algo`` (Supervised selection). GLISTER
+  needs the model to update the validation gradients, so its gradients are the last layer gradients of a random
+  two layer network on inputs of rank ``--rank``, with a hidden layer sized so that their dimension is close to
+  ``d``. The timed run includes the initialization of the validation gradients. The residual is the norm of the
+  validation gradient after the one step update with the subset, relative to its norm before.
+- ``craig_fl``: ``CRAIGStrategy.select`` (PerClass, convex, lazy greedy facility location) on the gradient
+  matrix used as the input features, which times the distance computation and the facility location. The residual
+  is the coverage gap ``1 - F(S) / F(V)`` of the facility location objective ``F``.
+
+Every case runs in a fresh subprocess, which reports the minimum and median wall time of ``--repeat`` runs of the
+solver, the peak resident set size read with ``resource.getrusage`` (``data_rss_mb`` before and ``peak_rss_mb``
+after the solver runs), the residual and the number of selected elements. With ``--profile DIR``, one more run of
+every case is profiled with ``cProfile`` and the stats are written to ``DIR``.
+
+Results are printed as a table and, with ``--output``, written as JSON. With ``--baseline``, the results are
+compared against a stored JSON output and the script exits with status 1 if a case is slower than the baseline by
+more than ``--time_tol`` (relative, ignoring differences below ``--min_time`` seconds), uses more peak memory by
+more than ``--rss_tol`` (relative), or has a residual larger by more than ``--residual_tol`` (absolute).
+``--compare FILE`` compares a stored output against the baseline without running the solvers.
+
+Usage::
+
+    python benchmarks/solvers/suite.py --N 2000 --d 500 --rank 50 --num_classes 10 --budget 100 \\
+        --output baseline.json
+    python benchmarks/solvers/suite.py --N 2000 --d 500 --rank 50 --num_classes 10 --budget 100 \\
+        --output new.json --baseline baseline.json
+"""
+import argparse
+import cProfile
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+CASES = ['omp_numpy', 'omp_parallel', 'omp_v1', 'omp_cholesky', 'omp_stagewise', 'omp_batched', 'optimal_weights',
+         'glister_naive', 'glister_stochastic', 'craig_fl']
+KEY = ['case', 'N', 'd', 'rank', 'num_classes', 'budget']
+
+
+def synthetic_gradients(N, d, rank, num_classes, noise=0.01, seed=0):
+    """
+    Synthetic gradients of shape (N, d): the mean of the class of every element, plus a shared variation of rank
+    `rank`, plus gaussian noise. Returns the gradients and the labels.
+    """
+    g = torch.Generator().manual_seed(seed)
+    labels = torch.arange(N) % num_classes
+    means = torch.randn(num_classes, d, generator=g)
+    variation = torch.matmul(torch.randn(N, rank, generator=g), torch.randn(rank, d, generator=g)) / math.sqrt(rank)
+    return means[labels] + variation + noise * torch.randn(N, d, generator=g), labels
+
+
+def class_budgets(labels, num_classes, budget):
+    return [(torch.where(labels == c)[0], math.ceil(budget * int((labels == c).sum()) / len(labels)))
+            for c in range(num_classes)]
+
+
+def relative_residual(A, x, b):
+    A, x, b = torch.as_tensor(A).double(), torch.as_tensor(x).double(), torch.as_tensor(b).double()
+    return ((torch.matmul(A, x) - b).norm() / b.norm()).item()
+
+
+def omp_case(case, grads, labels, spec):
+    from cords.selectionstrategies.helpers import OrthogonalMP_REG, OrthogonalMP_REG_Parallel, \
+        OrthogonalMP_REG_Parallel_V1, OrthogonalMP_REG_Cholesky, OrthogonalMP_REG_Batched
+    A, b, budget = grads.t().contiguous(), grads.sum(dim=0), spec['budget']
+    if case == 'omp_numpy':
+        run = lambda: torch.from_numpy(OrthogonalMP_REG(A.numpy(), b.numpy(), nnz=budget, positive=True, lam=0))
+    elif case == 'omp_parallel':
+        run = lambda: OrthogonalMP_REG_Parallel(A, b, nnz=budget, positive=True, lam=0)
+    elif case == 'omp_v1':
+        run = lambda: OrthogonalMP_REG_Parallel_V1(A, b, nnz=budget, positive=True, lam=0)
+    elif case == 'omp_cholesky':
+        run = lambda: OrthogonalMP_REG_Cholesky(A, b, nnz=budget, positive=True, lam=0)
+    elif case == 'omp_stagewise':
+        run = lambda: OrthogonalMP_REG_Cholesky(A, b, nnz=budget, positive=True, lam=0, stage_size=8)
+    else:
+        problems = [(grads[idxs].t().contiguous(), grads[idxs].sum(dim=0), bud)
+                    for idxs, bud in class_budgets(labels, spec['num_classes'], budget)]
+
+        def run():
+            return OrthogonalMP_REG_Batched([X for X, _, _ in problems], [Y for _, Y, _ in problems],
+                                            [bud for _, _, bud in problems], positive=True, lam=0)
+
+        def evaluate(xs):
+            residual = math.sqrt(sum(((torch.matmul(X.double(), x.double()) - Y.double()).norm() ** 2).item()
+                                     for (X, Y, _), x in zip(problems, xs)))
+            return residual / math.sqrt(sum((Y.double().norm() ** 2).item() for _, Y, _ in problems)), \
+                sum(int((x != 0).sum()) for x in xs)
+
+        return run, evaluate
+    return run, lambda x: (relative_residual(A, x, b), int((x != 0).sum()))
+
+
+def optimal_weights_case(grads, labels, spec):
+    from cords.selectionstrategies.helpers import OptimalWeights
+    b = grads.mean(dim=0)
+
+    def run():
+        return OptimalWeights(grads, b, nnz=spec['budget'])
+
+    def evaluate(out):
+        idxs = out[0]
+        s, target = grads[idxs].double().sum(dim=0), b.double()
+        c = torch.dot(s, target) / torch.dot(s, s)
+        return ((c * s - target).norm() / target.norm()).item(), len(idxs)
+
+    return run, evaluate
+
+
+def _loader(inputs, labels, batch_size=256):
+    return DataLoader(TensorDataset(inputs, labels), batch_size=batch_size, shuffle=False)
+
+
+def glister_case(case, grads, labels, spec):
+    from cords.selectionstrategies.SL import GLISTERStrategy
+    from cords.utils.models import TwoLayerNet
+    N, C = spec['N'], spec['num_classes']
+    g = torch.Generator().manual_seed(spec['seed'])
+    # last layer gradients have C + C * hidden entries
+    hidden = max(1, spec['d'] // C - 1)
+    projection = torch.randn(spec['rank'], 64, generator=g)
+    inputs = torch.matmul(torch.randn(N, spec['rank'], generator=g), projection)
+    val_labels = torch.arange(max(C, N // 10)) % C
+    val_inputs = torch.matmul(torch.randn(len(val_labels), spec['rank'], generator=g), projection)
+    torch.manual_seed(spec['seed'])
+    model = TwoLayerNet(64, C, hidden)
+    strategy = GLISTERStrategy(_loader(inputs, labels), _loader(val_inputs, val_labels), model,
+                               torch.nn.CrossEntropyLoss(reduction='none'), 0.01, 'cpu', C, True, 'Supervised',
+                               'Naive' if case == 'glister_naive' else 'Stochastic', logging.getLogger(__name__))
+    strategy.update_model(model.state_dict())
+    strategy._compute_train_gradients()
+    strategy._update_grads_val(first_init=True)
+    initial = strategy.grads_val_curr.norm().item()
+
+    def run():
+        strategy._update_grads_val(first_init=True)
+        return strategy.greedy_algo(spec['budget'])
+
+    def evaluate(out):
+        return strategy.grads_val_curr.norm().item() / initial, len(out[0])
+
+    return run, evaluate
+
+
+def craig_case(grads, labels, spec):
+    from cords.selectionstrategies.SL import CRAIGStrategy
+    from cords.utils.models import TwoLayerNet
+    C = spec['num_classes']
+    model = TwoLayerNet(spec['d'], C, 8)
+    strategy = CRAIGStrategy(_loader(grads, labels), _loader(grads[:C], labels[:C]), model,
+                             torch.nn.CrossEntropyLoss(reduction='none'), 'cpu', C, True, True, 'PerClass',
+                             logging.getLogger(__name__), optimizer='lazy')
+
+    def run():
+        return strategy.select(spec['budget'], model.state_dict())
+
+    def evaluate(out):
+        selected = set(int(i) for i in out[0])
+        covered, total = 0.0, 0.0
+        for c in range(C):
+            idxs = torch.where(labels == c)[0]
+            dist = torch.cdist(grads[idxs].double(), grads[idxs].double()) ** 2
+            sim = dist.max() - dist
+            in_subset = torch.tensor([int(i) in selected for i in idxs])
+            covered += sim[:, in_subset].max(dim=1).values.sum().item()
+            total += sim.max(dim=1).values.sum().item()
+        return 1 - covered / total, len(out[0])
+
+    return run, evaluate
+
+
+def run_case(spec):
+    torch.set_num_threads(spec['threads'])
+    grads, labels = synthetic_gradients(spec['N'], spec['d'], spec['rank'], spec['num_classes'],
+                                        noise=spec['noise'], seed=spec['seed'])
+    case = spec['case']
+    if case.startswith('omp_'):
+        run, evaluate = omp_case(case, grads, labels, spec)
+    elif case == 'optimal_weights':
+        run, evaluate = optimal_weights_case(grads, labels, spec)
+    elif case.startswith('glister_'):
+        run, evaluate = glister_case(case, grads, labels, spec)
+    else:
+        run, evaluate = craig_case(grads, labels, spec)
+    data_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    times = []
+    for _ in range(spec['repeat']):
+        random.seed(spec['seed'])
+        np.random.seed(spec['seed'])
+        torch.manual_seed(spec['seed'])
+        start = time.perf_counter()
+        out = run()
+        times.append(time.perf_counter() - start)
+    result = {'wall_time': min(times), 'median_time': float(np.median(times)),
+              'data_rss_mb': data_rss, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    result['residual'], result['selected'] = evaluate(out)
+    if spec['profile'] is not None:
+        os.makedirs(spec['profile'], exist_ok=True)
+        result['profile'] = os.path.join(spec['profile'], '{case}_N{N}_d{d}_r{rank}_c{num_classes}_k{budget}.prof'
+                                         .format(**spec))
+        cProfile.runctx('run()', globals(), {'run': run}, filename=result['profile'])
+    return result
+
+
+def key(result):
+    return tuple(result[k] for k in KEY)
+
+
+def compare(results, baseline, time_tol, rss_tol, residual_tol, min_time):
+    """
+    Compares the results against the baseline results. Returns the list of regressions, as (key, metric, value,
+    baseline value) tuples.
+    """
+    base = {key(r): r for r in baseline}
+    regressions = []
+    print("{:>18s} {:>6s} {:>5s} {:>5s} {:>4s} {:>6s} {:>10s} {:>10s} {:>11s} {:>11s} {:>10s} {:>10s}".format(
+        "case", "N", "d", "rank", "C", "budget", "time (s)", "base (s)", "RSS (MB)", "base (MB)", "residual",
+        "base"))
+    for r in results:
+        b = base.get(key(r))
+        if b is None:
+            print("{:>18s} {:>6d} {:>5d} {:>5d} {:>4d} {:>6d} not in the baseline".format(*key(r)))
+            continue
+        print("{:>18s} {:>6d} {:>5d} {:>5d} {:>4d} {:>6d} {:>10.3f} {:>10.3f} {:>11.1f} {:>11.1f} {:>10.4f} {:>10.4f}"
+              .format(*key(r), r['wall_time'], b['wall_time'], r['peak_rss_mb'], b['peak_rss_mb'], r['residual'],
+                      b['residual']))
+        if r['wall_time'] > b['wall_time'] * (1 + time_tol) and r['wall_time'] - b['wall_time'] > min_time:
+            regressions.append((key(r), 'wall_time', r['wall_time'], b['wall_time']))
+        if r['peak_rss_mb'] > b['peak_rss_mb'] * (1 + rss_tol):
+            regressions.append((key(r), 'peak_rss_mb', r['peak_rss_mb'], b['peak_rss_mb']))
+        if r['residual'] > b['residual'] + residual_tol:
+            regressions.append((key(r), 'residual', r['residual'], b['residual']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    parser.add_argument('--N', type=int, nargs='+', default=[2000])
+    parser.add_argument('--d', type=int, nargs='+', default=[500])
+    parser.add_argument('--rank', type=int, nargs='+', default=[50])
+    parser.add_argument('--num_classes', type=int, nargs='+', default=[10])
+    parser.add_argument('--budget', type=int, nargs='+', default=[100])
+    parser.add_argument('--noise', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())
+    parser.add_argument('--profile', type=str, default=None, help="directory of the cProfile stats")
+    parser.add_argument('--output', type=str, default=None, help="JSON file of the results")
+    parser.add_argument('--baseline', type=str, default=None, help="JSON file of the baseline results")
+    parser.add_argument('--compare', type=str, default=None,
+                        help="JSON file of results to compare against the baseline, without running the solvers")
+    parser.add_argument('--time_tol', type=float, default=0.25)
+    parser.add_argument('--min_time', type=float, default=0.05)
+    parser.add_argument('--rss_tol', type=float, default=0.1)
+    parser.add_argument('--residual_tol', type=float, default=1e-3)
+    parser.add_argument('--child', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_case(json.loads(args.child))))
+        return
+
+    if args.compare is not None:
+        if args.baseline is None:
+            parser.error("--compare needs a --baseline")
+        with open(args.compare) as f:
+            output = json.load(f)
+    else:
+        output = {'environment': {'python': platform.python_version(), 'torch': torch.__version__,
+                                  'numpy': np.__version__, 'machine': platform.machine(),
+                                  'processor': platform.processor(), 'threads': args.threads},
+                  'results': []}
+        print("{:>18s} {:>6s} {:>5s} {:>5s} {:>4s} {:>6s} {:>10s} {:>10s} {:>11s} {:>10s} {:>8s}".format(
+            "case", "N", "d", "rank", "C", "budget", "time (s)", "median (s)", "peak RSS (MB)", "residual",
+            "selected"))
+        for N, d, rank, num_classes, budget in itertools.product(args.N, args.d, args.rank, args.num_classes,
+                                                                 args.budget):
+            for case in args.cases:
+                spec = {'case': case, 'N': N, 'd': d, 'rank': rank, 'num_classes': num_classes, 'budget': budget,
+                        'noise': args.noise, 'seed': args.seed, 'repeat': args.repeat, 'threads': args.threads,
+                        'profile': args.profile}
+                out = subprocess.run([sys.executable, __file__, '--child', json.dumps(spec)], check=True,
+                                     capture_output=True, text=True)
+                result = dict(spec, **json.loads(out.stdout.strip().splitlines()[-1]))
+                output['results'].append(result)
+                print("{:>18s} {:>6d} {:>5d} {:>5d} {:>4d} {:>6d} {:>10.3f} {:>10.3f} {:>13.1f} {:>10.4f} {:>8d}"
+                      .format(*key(result), result['wall_time'], result['median_time'], result['peak_rss_mb'],
+                              result['residual'], result['selected']))
+        if args.output is not None:
+            with open(args.output, 'w') as f:
+                json.dump(output, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(output['results'], baseline['results'], args.time_tol, args.rss_tol,
+                              args.residual_tol, args.min_time)
+        for k, metric, value, base in regressions:
+            print("regression: {} {} {:.4f} (baseline {:.4f})".format(
+                ' '.join('{}={}'.format(n, v) for n, v in zip(KEY, k)), metric, value, base))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
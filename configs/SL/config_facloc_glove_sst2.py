@@ -1,15 +1,17 @@
 # Learning setting
+import os.path as osp
 from cords.utils.data.data_utils.collate import *
 
+datadir = "/home/ayush/Documents/abhishek/data/SST/"
+
 config = dict(setting="SL",
               is_reg = False,
               dataset=dict(name="sst2_facloc",
-                           datadir="/home/ayush/Documents/abhishek/data/SST/",
+                           datadir=datadir,
                            feature="dss",
                            type="text",
                            wordvec_dim=300,
-                           weight_path='/home/ayush/Documents/abhishek/glove.6B/',
-                           ss_path = '/home/ayush/Documents/abhishek/data/SST/facloc.pkl'),
+                           weight_path='/home/ayush/Documents/abhishek/glove.6B/'),
 
               dataloader=dict(shuffle=True,
                               batch_size=16,
@@ -46,7 +48,8 @@ config = dict(setting="SL",
                             select_every=5,
                             kappa=0,
                             collate_fn = collate_fn_pad_batch,
-                            size_chunk=8534),
+                            size_chunk=8534,
+                            cache_dir=osp.join(datadir, 'cache')),
 
               train_args=dict(num_epochs=20,
                               device="cuda",
@@ -5,7 +5,7 @@ import numpy as np
 from .dataselectionstrategy import DataSelectionStrategy
 # from ..helpers import OrthogonalMP_REG_Parallel, OrthogonalMP_REG, OrthogonalMP_REG_Parallel_V1
 from torch.utils.data import Subset, DataLoader
-from scipy.optimize import nnls
+from ..helpers import NonnegativeLS
 from sklearn.linear_model import LinearRegression
 
 class AdapWeightsStrategy(DataSelectionStrategy):
@@ -67,6 +67,7 @@ class AdapWeightsStrategy(DataSelectionStrategy):
         self.valid = valid
 
         self.ss_indices = ss_indices
+        self.gammas = None
 
     def select(self, budget, model_params):
         """
@@ -107,8 +108,13 @@ class AdapWeightsStrategy(DataSelectionStrategy):
         elif ss_grad.shape[1] > 0 and b_.shape[0] > 0:
             # reg_nnls = LinearRegression(positive=True)
             # gammas = reg_nnls.fit(np.nan_to_num(ss_grad.detach().cpu().numpy()), np.nan_to_num(b_.detach().cpu().numpy())).coef_
-            gammas, _ = nnls(np.nan_to_num(ss_grad.detach().cpu().numpy()), np.nan_to_num(b_.detach().cpu().numpy())\
-                , maxiter = int(30*ss_grad.shape[1]))
+            # the subset is fixed, so the weights of the previous round are a warm start of the NNLS problem
+            ss_grad = torch.nan_to_num(ss_grad.double())
+            b_ = torch.nan_to_num(b_.detach().double())
+            gammas = NonnegativeLS(torch.matmul(ss_grad.t(), ss_grad), torch.matmul(ss_grad.t(), b_),
+                                   x0=self.gammas)
+            self.gammas = gammas
+            gammas = gammas.float().cpu()
         else:
             gammas = list(np.random.ranint(1,10,ss_grad.shape[1]))
 
@@ -3,9 +3,32 @@ import apricot
 import numpy as np
 import time
 import torch
-from scipy.sparse import csr_matrix
 from torch.utils.data.sampler import SubsetRandomSampler
 from .dataselectionstrategy import DataSelectionStrategy
+from ..helpers import FactoredGradients, block_similarity_kernel, facility_location_greedy, knn_graph, nearest, \
+    nearest_selected, pairwise_distances, similarity_kernel
+from ..helpers.pairwise_distances import concat_rows
+from ..helpers.memmap_gradients import memmap_array
+
+
+class _DeadlineExpired(Exception):
+    pass
+
+
+class _DeadlineFacilityLocation(apricot.functions.facilityLocation.FacilityLocationSelection):
+    """
+    Facility location selection that stops once `deadline` (a `time.perf_counter` value) is over, keeping the
+    elements selected so far in `ranking`.
+    """
+
+    def __init__(self, deadline=None, **kwargs):
+        super().__init__(**kwargs)
+        self.deadline = deadline
+
+    def _select_next(self, X_pairwise, gain, idx):
+        super()._select_next(X_pairwise, gain, idx)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise _DeadlineExpired
 
 
 class CRAIGStrategy(DataSelectionStrategy):
@@ -54,35 +77,97 @@ class CRAIGStrategy(DataSelectionStrategy):
         Type of selection:
          - 'PerClass': PerClass Implementation where the facility location problem is solved for each class seperately for speed ups.
          - 'Supervised':  Supervised Implementation where the facility location problem is solved using a sparse similarity matrix by 
-                          assigning the similarity of a point with other points of different class to zero.
+                          assigning the similarity of a point with other points of different class to zero. Only the
+                          class blocks of the similarity matrix are stored.
          - 'PerBatch': PerBatch Implementation where the facility location problem tries to select subset of mini-batches.
     logger : class
         - logger object for logging the information
     optimizer: str
-        Type of Greedy Algorithm
+        Type of Greedy Algorithm. 'naive', 'lazy', 'stochastic' and 'two-stage' run on the torch greedy of
+        :func:`cords.selectionstrategies.helpers.facility_location_greedy`, the other optimizers of apricot on
+        apricot
+    factored_grads: bool, optional
+        If True, per-element gradients are kept in factored form and their distances are computed from inner
+        products and norms (default: False)
+    sketch_dim: int, optional
+        If given, distances are computed between random projections of the gradients of this dimension
+        (default: None)
+    sketch_type: str, optional
+        Type of random projection - 'gaussian' | 'sparse' | 'srht' (default: 'gaussian')
+    sketch_seed: int, optional
+        Seed of the random projection (default: 0)
+    selection_batch_size: int, optional
+        Batch size of the per-element gradient passes. If None, the batch size of the trainloader is used
+        (default: None)
+    memmap_grads: bool, optional
+        If True, the gradients are kept in a disk backed memmap and read tile by tile (default: False)
+    memmap_dir: str, optional
+        Directory of the memmap files. If None, the default temporary directory is used (default: None)
+    memmap_dtype: str, optional
+        Data type of the memmap files - 'float32' | 'float16' (default: 'float32')
+    time_limit: float, optional
+        Wall clock time in seconds of a selection round, including the gradient computation. Once it is over,
+        the facility location selection stops, and the subset is topped up with random elements (default: None)
+    max_iters: int, optional
+        Maximum number of elements selected by every facility location problem (default: None)
+    kernel_dtype: str, optional
+        Data type of the N x N similarity kernel - 'float32' | 'float16'. A float16 kernel takes half the memory
+        and is scaled to [0, 1]; the sparse kernel of 'Supervised' is float32, as scipy has no float16 sparse
+        matrices (default: 'float32')
+    similarity: str, optional
+        Similarity matrix of the facility location problems:
+         - 'dense': N x N similarity kernel
+         - 'knn': sparse graph of the `knn_k` nearest neighbours of every element, which takes O(N k) memory. With
+                  'Supervised', the neighbours are searched within the class of every element. Elements without a
+                  selected neighbour are weighted by their nearest selected element.
+        (default: 'dense')
+    knn_k: int, optional
+        Number of neighbours of every element of the 'knn' graph, itself included (default: 10)
+    knn_method: str, optional
+        Nearest neighbour search of the 'knn' graph - 'exact' | 'rp_tree' (default: 'exact')
     """
 
     def __init__(self, trainloader, valloader, model, loss,
                  device, num_classes, linear_layer, if_convex,
-                 selection_type, logger, optimizer='lazy'):
+                 selection_type, logger, optimizer='lazy', factored_grads=False,
+                 sketch_dim=None, sketch_type='gaussian', sketch_seed=0,
+                 selection_batch_size=None, memmap_grads=False, memmap_dir=None, memmap_dtype='float32',
+                 time_limit=None, max_iters=None, kernel_dtype='float32', similarity='dense', knn_k=10,
+                 knn_method='exact'):
         """
         Constructer method
         """
-        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device, logger)
+        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device, logger,
+                         factored_grads=factored_grads, sketch_dim=sketch_dim, sketch_type=sketch_type,
+                         sketch_seed=sketch_seed, selection_batch_size=selection_batch_size,
+                         memmap_grads=memmap_grads, memmap_dir=memmap_dir, memmap_dtype=memmap_dtype,
+                         time_limit=time_limit, max_iters=max_iters)
         self.if_convex = if_convex
         self.selection_type = selection_type
         self.logger = logger
         self.optimizer = optimizer
+        if kernel_dtype not in ['float32', 'float16']:
+            raise ValueError("kernel_dtype must be one of 'float32' or 'float16'")
+        self.kernel_dtype = kernel_dtype
+        if similarity not in ['dense', 'knn']:
+            raise ValueError("similarity must be one of 'dense' or 'knn'")
+        self.similarity = similarity
+        self.knn_k = knn_k
+        self.knn_method = knn_method
 
     def distance(self, x, y, exp=2):
         """
         Compute the distance.
 
+        The squared euclidean distance is expanded as :math:`\\|x^i\\|^2 + \\|y^j\\|^2 - 2 \\langle x^i, y^j \\rangle`
+        and computed tile by tile with matrix products, see
+        :func:`cords.selectionstrategies.helpers.pairwise_distances`.
+
         Parameters
         ----------
-        x: Tensor
+        x: Tensor or FactoredGradients
             First input tensor
-        y: Tensor
+        y: Tensor or FactoredGradients
             Second input tensor
         exp: float, optional
             The exponent value (default: 2)
@@ -92,15 +177,7 @@ class CRAIGStrategy(DataSelectionStrategy):
         dist: Tensor
             Output tensor
         """
-
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-        dist = torch.pow(x - y, exp).sum(2)
-        # dist = torch.exp(-1 * torch.pow(x - y, 2).sum(2))
-        return dist
+        return pairwise_distances(x, y, exp=exp)
 
     def compute_score(self, model_params, idxs):
         """
@@ -115,16 +192,24 @@ class CRAIGStrategy(DataSelectionStrategy):
         """
 
         trainset = self.trainloader.sampler.data_source
-        subset_loader = torch.utils.data.DataLoader(trainset, batch_size=self.trainloader.batch_size, shuffle=False,
-                                                    sampler=SubsetRandomSampler(idxs),
+        if self.selection_type == 'PerBatch' or self.selection_batch_size is None:
+            batch_size = self.trainloader.batch_size
+        else:
+            batch_size = self.selection_batch_size
+        # the rows of the 'Supervised' kernel are the training elements in order, as the selected rows are returned
+        sampler = idxs.tolist() if self.selection_type == 'Supervised' else SubsetRandomSampler(idxs)
+        subset_loader = torch.utils.data.DataLoader(trainset, batch_size=batch_size, shuffle=False,
+                                                    sampler=sampler,
                                                     pin_memory=True, collate_fn=self.trainloader.collate_fn)
         self.model.load_state_dict(model_params)
         self.N = 0
         g_is = []
+        lbls = []
 
         if self.if_convex:
             for batch_idx, (inputs, targets) in enumerate(subset_loader):
                 inputs, targets = inputs, targets
+                lbls.append(targets.cpu())
                 if self.selection_type == 'PerBatch':
                     self.N += 1
                     g_is.append(inputs.view(inputs.size()[0], -1).mean(dim=0).view(1, -1))
@@ -133,16 +218,31 @@ class CRAIGStrategy(DataSelectionStrategy):
                     g_is.append(inputs.view(inputs.size()[0], -1))
         else:
             embDim = self.model.get_embedding_dim()
+            store = None
+            if self.memmap_grads:
+                perBatch = self.selection_type == 'PerBatch'
+                store = self._gradient_store(len(subset_loader) if perBatch else len(idxs), perBatch=perBatch)
             for batch_idx, (inputs, targets) in enumerate(subset_loader):
                 inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
+                lbls.append(targets.cpu())
                 if self.selection_type == 'PerBatch':
                     self.N += 1
                 else:
                     self.N += inputs.size()[0]
-                out, l1 = self.model(inputs, freeze=True, last=True)
-                loss = self.loss(out, targets).sum()
-                l0_grads = torch.autograd.grad(loss, out)[0]
-                if self.linear_layer:
+                out, l1, l0_grads = self._output_gradients(inputs, targets)
+                if store is not None:
+                    store.append(l0_grads, l1)
+                elif self.sketch_dim is not None:
+                    g_i = l0_grads
+                    if self.linear_layer:
+                        l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
+                        g_i = torch.cat((l0_grads, l0_expand * l1.repeat(1, self.num_classes)), dim=1)
+                    if self.selection_type == 'PerBatch':
+                        g_i = g_i.mean(dim=0).view(1, -1)
+                    g_is.append(self._gradient_sketch().project(g_i))
+                elif self.linear_layer and self.factored_grads and self.selection_type != 'PerBatch':
+                    g_is.append(FactoredGradients(l0_grads, l1))
+                elif self.linear_layer:
                     l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
                     l1_grads = l0_expand * l1.repeat(1, self.num_classes)
                     if self.selection_type == 'PerBatch':
@@ -154,22 +254,37 @@ class CRAIGStrategy(DataSelectionStrategy):
                         g_is.append(l0_grads.mean(dim=0).view(1, -1))
                     else:
                         g_is.append(l0_grads)
+            if store is not None:
+                g_is = store.gradients()
+                if self.similarity == 'dense' and self.selection_type != 'Supervised':
+                    self._memmap_dist_mat(g_is)
+                    return
 
-        self.dist_mat = torch.zeros([self.N, self.N], dtype=torch.float32)
-        first_i = True
-        if self.selection_type == 'PerBatch':
-            g_is = torch.cat(g_is, dim=0)
-            self.dist_mat = self.distance(g_is, g_is).cpu()
+        if self.similarity == 'knn':
+            # the neighbours of an element are searched within its class for 'Supervised'
+            labels = torch.cat(lbls) if self.selection_type == 'Supervised' else None
+            self.knn_rows = concat_rows(g_is)
+            self.dist_mat, self.const = knn_graph(self.knn_rows, self.knn_k, labels=labels, method=self.knn_method)
+        elif self.selection_type == 'Supervised':
+            # similarities between elements of different classes are zero, so only the class blocks are stored
+            self.dist_mat, self.const = block_similarity_kernel(g_is, torch.cat(lbls))
         else:
-            for i, g_i in enumerate(g_is, 0):
-                if first_i:
-                    size_b = g_i.size(0)
-                    first_i = False
-                for j, g_j in enumerate(g_is, 0):
-                    self.dist_mat[i * size_b: i * size_b + g_i.size(0),
-                    j * size_b: j * size_b + g_j.size(0)] = self.distance(g_i, g_j).cpu()
-        self.const = torch.max(self.dist_mat).item()
-        self.dist_mat = (self.const - self.dist_mat).numpy()
+            self.dist_mat, self.const = similarity_kernel(g_is, dtype=self.kernel_dtype)
+
+    def _memmap_dist_mat(self, grads):
+        """
+        Computes `dist_mat` and `const` from memory mapped gradients. The similarities are computed one pair of
+        gradient tiles at a time and written into an N x N `np.memmap`, so that neither the gradients nor the
+        distances need to fit into memory.
+
+        Parameters
+        ----------
+        grads: MemmapGradients
+            Gradients of the elements (or mini-batches) to be selected from
+        """
+        N = len(grads)
+        out = memmap_array((N, N), dtype=self.kernel_dtype, memmap_dir=self.memmap_dir)
+        self.dist_mat, self.const = similarity_kernel(grads, out=out)
 
     def compute_gamma(self, idxs):
         """
@@ -186,18 +301,15 @@ class CRAIGStrategy(DataSelectionStrategy):
             Gradient values of the input indices
         """
 
-        if self.selection_type in ['PerClass', 'PerBatch']:
-            gamma = [0 for i in range(len(idxs))]
-            best = self.dist_mat[idxs]  # .to(self.device)
-            rep = np.argmax(best, axis=0)
-            for i in rep:
-                gamma[i] += 1
-        elif self.selection_type == 'Supervised':
-            gamma = [0 for i in range(len(idxs))]
-            best = self.dist_mat[idxs]  # .to(self.device)
-            rep = np.argmax(best, axis=0)
-            for i in range(rep.shape[1]):
-                gamma[rep[0, i]] += 1
+        rep, best = nearest_selected(self.dist_mat, idxs)
+        if self.similarity == 'knn':
+            # elements without a selected neighbour in the graph are assigned to their nearest selected element
+            uncovered = np.where(best <= 0)[0]
+            if len(uncovered) > 0:
+                rep[uncovered] = nearest(self.knn_rows[torch.from_numpy(uncovered)],
+                                         self.knn_rows[torch.as_tensor(idxs)]).numpy()
+        # the kernel of 'Supervised' is block diagonal, so elements are represented by selected elements of their class
+        gamma = np.bincount(rep[rep >= 0], minlength=len(idxs)).tolist()
         return gamma
 
     def get_similarity_kernel(self):
@@ -209,12 +321,8 @@ class CRAIGStrategy(DataSelectionStrategy):
         kernel: ndarray
             Array of kernel values
         """
-        for batch_idx, (inputs, targets) in enumerate(self.trainloader):
-            if batch_idx == 0:
-                labels = targets
-            else:
-                tmp_target_i = targets
-                labels = torch.cat((labels, tmp_target_i), dim=0)
+        self.get_labels()
+        labels = self.trn_lbls
         kernel = np.zeros((labels.shape[0], labels.shape[0]))
         for target in np.unique(labels):
             x = np.where(labels == target)[0]
@@ -223,6 +331,34 @@ class CRAIGStrategy(DataSelectionStrategy):
                 kernel[i, x] = 1
         return kernel
 
+    def _facility_location(self, X, n_samples):
+        """
+        Greedily selects `n_samples` elements of the similarity matrix `X` with facility location, stopping early at
+        the `time_limit` or `max_iters` of the selection round. The 'naive', 'lazy', 'stochastic' and 'two-stage'
+        optimizers run on :func:`cords.selectionstrategies.helpers.facility_location_greedy`, and the other ones on
+        apricot.
+
+        Returns
+        ----------
+        greedyList: list
+            Rows of `X` of the selected elements, in the order of selection
+        """
+        n_samples = self._solver_iters(n_samples)
+        if self.optimizer in ['naive', 'lazy', 'stochastic', 'two-stage']:
+            greedyList, gains = facility_location_greedy(X, n_samples, optimizer=self.optimizer,
+                                                         time_limit=self._time_left())
+            self._check_time_limit()
+            self.logger.debug("CRAIG facility location selected %d elements with a total gain of %.4f",
+                              len(greedyList), gains.sum().item())
+            return greedyList.tolist()
+        fl = _DeadlineFacilityLocation(deadline=self.selection_deadline, random_state=0, metric='precomputed',
+                                       n_samples=n_samples, optimizer=self.optimizer)
+        try:
+            fl.fit(X)
+        except _DeadlineExpired:
+            self.stopped_early = True
+        return list(fl.ranking)
+
     def select(self, budget, model_params):
         """
         Data selection method using different submodular optimization
@@ -247,12 +383,9 @@ class CRAIGStrategy(DataSelectionStrategy):
             List containing gradients of datapoints present in greedySet
         """
         start_time = time.time()
-        for batch_idx, (inputs, targets) in enumerate(self.trainloader):
-            if batch_idx == 0:
-                labels = targets
-            else:
-                tmp_target_i = targets
-                labels = torch.cat((labels, tmp_target_i), dim=0)
+        self._start_time_limit()
+        self.get_labels()
+        labels = self.trn_lbls
         # per_class_bud = int(budget / self.num_classes)
         total_greedy_list = []
         gammas = []
@@ -260,12 +393,7 @@ class CRAIGStrategy(DataSelectionStrategy):
             for i in range(self.num_classes):
                 idxs = torch.where(labels == i)[0]
                 self.compute_score(model_params, idxs)
-                fl = apricot.functions.facilityLocation.FacilityLocationSelection(random_state=0, metric='precomputed',
-                                                                                  n_samples=math.ceil(
-                                                                                      budget * len(idxs) / self.N_trn),
-                                                                                  optimizer=self.optimizer)
-                sim_sub = fl.fit_transform(self.dist_mat)
-                greedyList = list(np.argmax(sim_sub, axis=1))
+                greedyList = self._facility_location(self.dist_mat, math.ceil(budget * len(idxs) / self.N_trn))
                 gamma = self.compute_gamma(greedyList)
                 total_greedy_list.extend(idxs[greedyList])
                 gammas.extend(gamma)
@@ -274,35 +402,21 @@ class CRAIGStrategy(DataSelectionStrategy):
             gammas = list(np.array(gammas)[rand_indices])
         elif self.selection_type == 'Supervised':
             idxs = torch.arange(0, self.N_trn).long()
-            N = len(idxs)
             self.compute_score(model_params, idxs)
-            row = idxs.repeat_interleave(N)
-            col = idxs.repeat(N)
-            data = self.dist_mat.flatten()
-            sparse_simmat = csr_matrix((data, (row.numpy(), col.numpy())), shape=(self.N_trn, self.N_trn))
-            self.dist_mat = sparse_simmat
-            fl = apricot.functions.facilityLocation.FacilityLocationSelection(random_state=0, metric='precomputed',
-                                                                              n_samples=budget,
-                                                                              optimizer=self.optimizer)
-            sim_sub = fl.fit_transform(sparse_simmat)
-            total_greedy_list = list(np.array(np.argmax(sim_sub, axis=1)).reshape(-1))
+            total_greedy_list = self._facility_location(self.dist_mat, budget)
             gammas = self.compute_gamma(total_greedy_list)
         elif self.selection_type == 'PerBatch':
             idxs = torch.arange(self.N_trn)
             N = len(idxs)
             self.compute_score(model_params, idxs)
-            fl = apricot.functions.facilityLocation.FacilityLocationSelection(random_state=0, metric='precomputed',
-                                                                              n_samples=math.ceil(
-                                                                                  budget / self.trainloader.batch_size),
-                                                                              optimizer=self.optimizer)
-            sim_sub = fl.fit_transform(self.dist_mat)
-            temp_list = list(np.array(np.argmax(sim_sub, axis=1)).reshape(-1))
+            temp_list = self._facility_location(self.dist_mat, math.ceil(budget / self.trainloader.batch_size))
             gammas_temp = self.compute_gamma(temp_list)
             batch_wise_indices = list(self.trainloader.batch_sampler)
             for i in range(len(temp_list)):
                 tmp = batch_wise_indices[temp_list[i]]
                 total_greedy_list.extend(tmp)
                 gammas.extend([gammas_temp[i]] * len(tmp))
+        self._random_top_up(total_greedy_list, gammas, budget, "CRAIG")
         end_time = time.time()
         self.logger.debug("CRAIG strategy data selection time is: %.4f", end_time-start_time)
         return total_greedy_list, torch.FloatTensor(gammas)
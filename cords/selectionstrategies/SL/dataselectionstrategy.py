@@ -1,4 +1,10 @@
+import time
+import numpy as np
 import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from torch.utils.data.sampler import SequentialSampler
+from ..helpers import GradientStore, FactoredGradientStore, MemmapGradientStore, GradientSketch, LabelIndex
 
 
 class DataSelectionStrategy(object):
@@ -24,9 +30,43 @@ class DataSelectionStrategy(object):
             The device being utilized - cpu | cuda
         logger: class
             logger object for logging the information
+        factored_grads: bool, optional
+            If True, the per-element last layer gradients are kept in the factored form of
+            :class:`FactoredGradients` instead of the dense gradient matrix (default: False)
+        sketch_dim: int, optional
+            If given, the last layer gradients are projected batch by batch onto a fixed random subspace of
+            this dimension while they are computed, see :class:`GradientSketch`. Takes precedence over
+            `factored_grads` (default: None)
+        sketch_type: str, optional
+            Type of random projection used for sketching - 'gaussian' | 'sparse' | 'srht' (default: 'gaussian')
+        sketch_seed: int, optional
+            Seed of the random projection, which is drawn once and reused across selection rounds (default: 0)
+        selection_batch_size: int, optional
+            Batch size of the per-element gradient passes, independent of the batch size used for training.
+            Only used for sequential dataloaders, since the gradients must follow the order of the dataloader.
+            If None, the batch size of the dataloader is used (default: None)
+        memmap_grads: bool, optional
+            If True, dense (or sketched) gradients are written into a disk backed `np.memmap` as they are computed
+            and read tile by tile by the selection algorithms, see :class:`MemmapGradientStore`. This bounds the
+            memory needed for the gradients of datasets that do not fit into RAM. Takes precedence over
+            `factored_grads` (default: False)
+        memmap_dir: str, optional
+            Directory of the memmap files. If None, the default temporary directory is used (default: None)
+        memmap_dtype: str, optional
+            Data type of the memmap files - 'float32' | 'float16' (default: 'float32')
+        time_limit: float, optional
+            Wall clock time in seconds of a selection round, counted from the start of :func:`select`. Once it
+            is over, the solvers return the subset selected so far, which is topped up with random elements up
+            to the budget. If None, the solvers run to completion (default: None)
+        max_iters: int, optional
+            Maximum number of iterations of every solver call of a selection round; the subset is topped up in
+            the same way. If None, the solvers run to completion (default: None)
     """
 
-    def __init__(self, trainloader, valloader, model, num_classes, linear_layer, loss, device, logger):
+    def __init__(self, trainloader, valloader, model, num_classes, linear_layer, loss, device, logger,
+                 factored_grads=False, sketch_dim=None, sketch_type='gaussian', sketch_seed=0,
+                 selection_batch_size=None, memmap_grads=False, memmap_dir=None, memmap_dtype='float32',
+                 time_limit=None, max_iters=None):
         """
         Constructor method
         """
@@ -37,6 +77,8 @@ class DataSelectionStrategy(object):
         self.N_val = len(valloader.sampler)
         self.grads_per_elem = None
         self.val_grads_per_elem = None
+        self.all_grads_per_elem = None
+        self.all_val_grads_per_elem = None
         self.numSelected = 0
         self.linear_layer = linear_layer
         self.num_classes = num_classes
@@ -45,25 +87,114 @@ class DataSelectionStrategy(object):
         self.loss = loss
         self.device = device
         self.logger = logger
+        self.factored_grads = factored_grads
+        self.sketch_dim = sketch_dim
+        self.sketch_type = sketch_type
+        self.sketch_seed = sketch_seed
+        self.sketch = None
+        self.selection_batch_size = selection_batch_size
+        self.selection_loaders = {}
+        if memmap_dtype not in ['float32', 'float16']:
+            raise ValueError("memmap_dtype must be one of 'float32' or 'float16'")
+        self.memmap_grads = memmap_grads
+        self.memmap_dir = memmap_dir
+        self.memmap_dtype = memmap_dtype
+        if time_limit is not None and time_limit <= 0:
+            raise ValueError("time_limit must be positive")
+        if max_iters is not None and max_iters < 1:
+            raise ValueError("max_iters must be a positive integer")
+        self.time_limit = time_limit
+        self.max_iters = max_iters
+        self.selection_deadline = None
+        self.stopped_early = False
 
     def select(self, budget, model_params):
         pass
 
+    def _start_time_limit(self):
+        """
+        Starts the clock of the `time_limit` of a selection round.
+        """
+        self.stopped_early = False
+        if self.time_limit is None:
+            self.selection_deadline = None
+        else:
+            self.selection_deadline = time.perf_counter() + self.time_limit
+
+    def _time_left(self):
+        """
+        Seconds left of the `time_limit` of the current selection round, or None if there is no time limit.
+        """
+        if self.selection_deadline is None:
+            return None
+        return max(0.0, self.selection_deadline - time.perf_counter())
+
+    def _solver_iters(self, iters):
+        """
+        Number of iterations of a solver call that needs `iters` iterations to complete, capped at `max_iters`.
+        """
+        if self.max_iters is None or iters <= self.max_iters:
+            return iters
+        self.stopped_early = True
+        return self.max_iters
+
+    def _check_time_limit(self):
+        """
+        Records whether the `time_limit` of the current selection round is over, e.g., after a solver call that
+        may have stopped at it. Returns True if it is.
+        """
+        expired = self.selection_deadline is not None and time.perf_counter() > self.selection_deadline
+        if expired:
+            self.stopped_early = True
+        return expired
+
+    def _log_stopped_early(self, name, selected, budget):
+        """
+        Logs how far the solvers of a selection round that stopped early got.
+        """
+        self.logger.info("%s solvers stopped early (time limit: %s s, max_iters: %s) after selecting %d of the %d "
+                         "elements of the budget; the rest is selected at random", name, self.time_limit,
+                         self.max_iters, selected, budget)
+
+    def _random_top_up(self, idxs, gammas, budget, name):
+        """
+        If the solvers of the selection round stopped early, tops up the subset `idxs` with random training
+        elements of weight 1 up to the budget, as GradMatch does, and logs how far the solvers got.
+
+        Parameters
+        ----------
+        idxs: list
+            Indices of the selected elements, extended in place
+        gammas: list
+            Weights of the selected elements, extended in place
+        budget: int
+            The number of data points to be selected
+        name: str
+            Name of the strategy in the log
+        """
+        if not self.stopped_early:
+            return
+        self._log_stopped_early(name, len(idxs), budget)
+        diff = budget - len(idxs)
+        if diff > 0:
+            remainList = set(np.arange(self.N_trn)).difference(set(idxs))
+            new_idxs = np.random.choice(list(remainList), size=diff, replace=False)
+            idxs.extend(new_idxs)
+            gammas.extend([1 for _ in range(diff)])
+
     def get_labels(self, valid=False):
-        for batch_idx, (inputs, targets) in enumerate(self.trainloader):
-            if batch_idx == 0:
-                self.trn_lbls = targets.view(-1, 1)
-            else:
-                self.trn_lbls = torch.cat((self.trn_lbls, targets.view(-1, 1)), dim=0)
-        self.trn_lbls = self.trn_lbls.view(-1)
+        """
+        Sets `trn_lbls` (and `val_lbls`) to the labels of the training (and validation) elements, read from
+        the :class:`LabelIndex` of the dataloader, which is built only once across selection rounds.
 
+        Parameters
+        ----------
+        valid: bool
+            if True, the validation labels are also set
+        """
+        self.trn_lbls = LabelIndex.from_loader(self.trainloader).labels
         if valid:
-            for batch_idx, (inputs, targets) in enumerate(self.valloader):
-                if batch_idx == 0:
-                    self.val_lbls = targets.view(-1, 1)
-                else:
-                    self.val_lbls = torch.cat((self.val_lbls, targets.view(-1, 1)), dim=0)
-            self.val_lbls = self.val_lbls.view(-1)
+            self.val_lbls = LabelIndex.from_loader(self.valloader).labels
 
     def compute_gradients(self, valid=False, perBatch=False, perClass=False):
         """
@@ -104,7 +235,6 @@ class DataSelectionStrategy(object):
         if (perBatch and perClass):
             raise ValueError("batch and perClass are mutually exclusive. Only one of them can be true at a time")
 
-        embDim = self.model.get_embedding_dim()
         if perClass:
             trainloader = self.pctrainloader
             if valid:
@@ -113,77 +243,212 @@ class DataSelectionStrategy(object):
             trainloader = self.trainloader
             if valid:
                 valloader = self.valloader
-            
-        for batch_idx, (inputs, targets) in enumerate(trainloader):
-            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-            if batch_idx == 0:
-                out, l1 = self.model(inputs, last=True, freeze=True)
-                loss = self.loss(out, targets).sum()
-                l0_grads = torch.autograd.grad(loss, out)[0]
-                if self.linear_layer:
-                    l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                    l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                if perBatch:
-                    l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                    if self.linear_layer:
-                        l1_grads = l1_grads.mean(dim=0).view(1, -1)
-            else:
-                out, l1 = self.model(inputs, last=True, freeze=True)
-                loss = self.loss(out, targets).sum()
-                batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                if self.linear_layer:
-                    batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                    batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-
-                if perBatch:
-                    batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
-                    if self.linear_layer:
-                        batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
-                l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                if self.linear_layer:
-                    l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
 
+        self.grads_per_elem = self._compute_loader_gradients(trainloader, perBatch)
         torch.cuda.empty_cache()
 
-        if self.linear_layer:
-            self.grads_per_elem = torch.cat((l0_grads, l1_grads), dim=1)
-        else:
-            self.grads_per_elem = l0_grads
+        if valid:
+            self.val_grads_per_elem = self._compute_loader_gradients(valloader, perBatch)
+            torch.cuda.empty_cache()
+
+    def compute_class_gradients(self, valid=False, factor_store=None):
+        """
+        Computes the gradients of every training (and validation) element in a single pass over each loader and
+        records the label of every element. PerClass selection then takes the gradients of each class with
+        :func:`set_class_gradients` instead of running a separate pass over a per-class dataloader.
+
+        Parameters
+        ----------
+        valid: bool
+            if True, the function also computes the validation gradients
+        factor_store: FactoredGradientStore, optional
+            If given, the exact per-element training gradients are also written into it in factored form
+        """
+        trn_lbls = []
+        self.all_grads_per_elem = self._compute_loader_gradients(self.trainloader, factor_store=factor_store,
+                                                                 labels=trn_lbls)
+        self.trn_lbls = torch.cat(trn_lbls, dim=0)
+        torch.cuda.empty_cache()
 
         if valid:
-            for batch_idx, (inputs, targets) in enumerate(valloader):
-                inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-                if batch_idx == 0:
-                    out, l1 = self.model(inputs, last=True, freeze=True)
-                    loss = self.loss(out, targets).sum()
-                    l0_grads = torch.autograd.grad(loss, out)[0]
-                    if self.linear_layer:
-                        l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                        l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                    if perBatch:
-                        l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                        if self.linear_layer:
-                            l1_grads = l1_grads.mean(dim=0).view(1, -1)
-                else:
-                    out, l1 = self.model(inputs, last=True, freeze=True)
-                    loss = self.loss(out, targets).sum()
-                    batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                    if self.linear_layer:
-                        batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                        batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-
-                    if perBatch:
-                        batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
-                        if self.linear_layer:
-                            batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
-                    l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                    if self.linear_layer:
-                        l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
+            val_lbls = []
+            self.all_val_grads_per_elem = self._compute_loader_gradients(self.valloader, labels=val_lbls)
+            self.val_lbls = torch.cat(val_lbls, dim=0)
             torch.cuda.empty_cache()
-            if self.linear_layer:
-                self.val_grads_per_elem = torch.cat((l0_grads, l1_grads), dim=1)
+
+    def set_class_gradients(self, c, valid=False):
+        """
+        Sets `grads_per_elem` (and `val_grads_per_elem`) to the gradients of the elements of class `c`, taken
+        from the gradients computed by :func:`compute_class_gradients`.
+
+        Parameters
+        ----------
+        c: int
+            Class index
+        valid: bool
+            if True, the validation gradients of class `c` are also set
+
+        Returns
+        ----------
+        trn_subset_idx: list
+            Indices of the training elements of class `c`
+        """
+        trn_subset_idx = torch.where(self.trn_lbls == c)[0]
+        self.grads_per_elem = self.all_grads_per_elem[trn_subset_idx]
+        if valid:
+            val_subset_idx = torch.where(self.val_lbls == c)[0]
+            self.val_grads_per_elem = self.all_val_grads_per_elem[val_subset_idx]
+        return trn_subset_idx.tolist()
+
+    def _compute_loader_gradients(self, loader, perBatch=False, factor_store=None, labels=None):
+        """
+        Computes the last layer gradients of every element of the loader into a preallocated
+        :class:`GradientStore`.
+
+        Parameters
+        ----------
+        loader: class
+            PyTorch dataloader over which the gradients are computed
+        perBatch: bool
+            if True, the function computes the gradients of each mini-batch
+        factor_store: FactoredGradientStore, optional
+            If given, the exact per-element gradients are also written into it in factored form
+        labels: list, optional
+            If given, the targets of every mini-batch are appended to it
+
+        Returns
+        ----------
+        gradients: Tensor or FactoredGradients
+            Gradients of shape (number of elements or mini-batches, gradient dimension)
+        """
+        if not perBatch:
+            loader = self._selection_loader(loader)
+        store = self._gradient_store(GradientStore.num_rows(loader, perBatch), perBatch)
+        for batch_idx, (inputs, targets) in enumerate(loader):
+            if labels is not None:
+                labels.append(targets.view(-1))
+            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
+            out, l1, l0_grads = self._output_gradients(inputs, targets)
+            store.append(l0_grads, l1)
+            if factor_store is not None:
+                factor_store.append(l0_grads, l1)
+        return store.gradients()
+
+    def _selection_loader(self, loader):
+        """
+        Returns a dataloader that yields the elements of `loader` in the same order with `selection_batch_size`
+        elements per batch. The dataloader is created once and reused across selection rounds. If
+        `selection_batch_size` is None, or the order of `loader` depends on its batches, `loader` is returned.
+
+        Parameters
+        ----------
+        loader: class
+            PyTorch dataloader
+        """
+        if self.selection_batch_size is None or self.selection_batch_size == loader.batch_size or \
+                not isinstance(loader.sampler, SequentialSampler) or loader.drop_last:
+            return loader
+        if loader not in self.selection_loaders:
+            self.selection_loaders[loader] = DataLoader(loader.dataset, batch_size=self.selection_batch_size,
+                                                        shuffle=False, num_workers=loader.num_workers,
+                                                        collate_fn=loader.collate_fn, pin_memory=loader.pin_memory)
+        return self.selection_loaders[loader]
+
+    def _closed_form_loss(self, targets):
+        """
+        Name of the loss whose gradient with respect to the model outputs has a closed form, i.e., unweighted
+        cross entropy with class targets or mean squared error, both with reduction set to 'none', or None.
+        """
+        if getattr(self.loss, 'reduction', None) != 'none':
+            return None
+        if isinstance(self.loss, torch.nn.CrossEntropyLoss) and self.loss.weight is None and \
+                getattr(self.loss, 'label_smoothing', 0.0) == 0 and targets.dim() == 1 and not targets.is_floating_point():
+            return 'cross_entropy'
+        if isinstance(self.loss, torch.nn.MSELoss):
+            return 'mse'
+        return None
+
+    def _output_gradients(self, inputs, targets):
+        """
+        Runs the forward pass and computes the gradients of the summed loss with respect to the model outputs.
+
+        For cross entropy the gradient is :math:`\\mathrm{softmax}(out) - \\mathrm{onehot}(y)`, or zero for the
+        targets equal to `ignore_index`, and for mean squared error it is :math:`2 (out - y)`. In both cases the
+        forward pass runs under `torch.inference_mode` (`torch.no_grad` before torch 1.9) and no autograd graph is
+        built. For any other loss the gradients are computed with autograd.
+
+        Parameters
+        ----------
+        inputs: Tensor
+            Inputs of one mini-batch
+        targets: Tensor
+            Targets of one mini-batch
+
+        Returns
+        ----------
+        out: Tensor
+            Model outputs
+        l1: Tensor
+            Penultimate layer embeddings
+        l0_grads: Tensor
+            Gradients of the loss with respect to the model outputs
+        """
+        loss_name = self._closed_form_loss(targets)
+        if loss_name is None:
+            out, l1 = self.model(inputs, last=True, freeze=True)
+            loss = self.loss(out, targets).sum()
+            l0_grads = torch.autograd.grad(loss, out)[0]
+            return out, l1, l0_grads
+        with getattr(torch, 'inference_mode', torch.no_grad)():
+            out, l1 = self.model(inputs, last=True, freeze=True)
+            if loss_name == 'cross_entropy':
+                l0_grads = F.softmax(out, dim=1)
+                ignored = targets == self.loss.ignore_index
+                rows = torch.where(~ignored)[0]
+                l0_grads[rows, targets[rows]] -= 1
+                l0_grads[ignored] = 0
             else:
-                self.val_grads_per_elem = l0_grads
+                l0_grads = 2 * (out - targets.view_as(out))
+        return out, l1, l0_grads
+
+    def _gradient_store(self, num_rows, perBatch=False):
+        """
+        Creates the store for `num_rows` gradients. Gradients are sketched when `sketch_dim` is set and written to
+        disk when `memmap_grads` is True. Otherwise, per-element gradients of the last fc layer are stored in
+        factored form when `factored_grads` is True, and all the others in the dense form.
+
+        Parameters
+        ----------
+        num_rows: int
+            Number of gradients the store is expected to hold
+        perBatch: bool
+            if True, the store holds the gradients of each mini-batch
+        """
+        embDim = self.model.get_embedding_dim()
+        sketch = self._gradient_sketch()
+        if self.memmap_grads:
+            dtype = torch.float16 if self.memmap_dtype == 'float16' else torch.float32
+            return MemmapGradientStore(num_rows, self.num_classes, embDim, self.linear_layer, self.device,
+                                       perBatch=perBatch, dtype=dtype, sketch=sketch, memmap_dir=self.memmap_dir)
+        if sketch is None and self.factored_grads and self.linear_layer and not perBatch:
+            return FactoredGradientStore(num_rows, self.num_classes, embDim, self.linear_layer, self.device)
+        return GradientStore(num_rows, self.num_classes, embDim, self.linear_layer, self.device, perBatch=perBatch,
+                             sketch=sketch)
+
+    def _gradient_sketch(self):
+        """
+        Returns the random projection used for sketching the gradients, or None if sketching is disabled.
+        The projection is created on first use and then reused, so that sketches of all the selection
+        rounds live in the same subspace.
+        """
+        if self.sketch_dim is None:
+            return None
+        if self.sketch is None:
+            embDim = self.model.get_embedding_dim()
+            self.sketch = GradientSketch(GradientStore.gradient_dim(self.num_classes, embDim, self.linear_layer),
+                                         self.sketch_dim, sketch_type=self.sketch_type, seed=self.sketch_seed,
+                                         device=self.device)
+        return self.sketch
 
     def update_model(self, model_params):
         """
@@ -4,7 +4,6 @@ import torch
 import numpy as np
 from .dataselectionstrategy import DataSelectionStrategy
 from ..helpers import OrthogonalMP_REG_Parallel, OrthogonalMP_REG, OptimalWeights
-from torch.utils.data import Subset, DataLoader
 
 
 class FixedWeightStrategy(DataSelectionStrategy):
@@ -32,6 +31,8 @@ class FixedWeightStrategy(DataSelectionStrategy):
         - 'PerClass': PerClass method is where OMP algorithm is applied on each class data points seperately.
         - 'PerBatch': PerBatch method is where OMP algorithm is applied on each minibatch data points.
         - 'PerClassPerGradient': PerClassPerGradient method is same as PerClass but we use the gradient corresponding to classification layer of that class only.
+    logger : class
+        - logger object for logging the information
     valid : bool, optional
         If valid==True we use validation dataset gradient sum in OMP otherwise we use training dataset (default: False)
     lam : float
@@ -41,11 +42,11 @@ class FixedWeightStrategy(DataSelectionStrategy):
     """
 
     def __init__(self, trainloader, valloader, model, loss,
-                 eta, device, num_classes, linear_layer, selection_type, valid=True, lam=0, eps=1e-4, r=1):
+                 eta, device, num_classes, linear_layer, selection_type, logger, valid=True, lam=0, eps=1e-4, r=1):
         """
         Constructor method
         """
-        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device)
+        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device, logger)
         self.eta = eta  # step size for the one step gradient update
         self.init_out = list()
         self.init_l1 = list()
@@ -55,13 +56,11 @@ class FixedWeightStrategy(DataSelectionStrategy):
         self.eps = eps
 
     def optimalWeightsWrapper(self, X, Y, bud):
-
-        if self.device == "cpu":
-            ind, weights = OptimalWeights(X.cpu().numpy(), Y.cpu().numpy(), nnz=bud)
-
-        else:
-            ind, weights = OptimalWeights(X, Y, nnz=bud, device=self.device)
-
+        """
+        Selects `bud` rows of the gradients `X` (one row per element) whose sum, with a fixed weight, best matches
+        the gradient `Y`.
+        """
+        ind, weights = OptimalWeights(X, Y, nnz=bud, device=self.device)
         return ind, weights
 
     def select(self, budget, model_params):
@@ -86,29 +85,18 @@ class FixedWeightStrategy(DataSelectionStrategy):
         self.update_model(model_params)
 
         if self.selection_type == 'PerClass':
-            self.get_labels(valid=self.valid)
+            self.compute_class_gradients(valid=self.valid)
             idxs = []
             gammas = []
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True)
-                if self.valid:
-                    val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                    val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                    self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                  shuffle=False, pin_memory=True)
-
-                self.compute_gradients(self.valid, perBatch=False, perClass=True)
+                trn_subset_idx = self.set_class_gradients(i, valid=self.valid)
                 trn_gradients = self.grads_per_elem
                 if self.valid:
                     sum_val_grad = torch.sum(self.val_grads_per_elem, dim=0)
                 else:
                     sum_val_grad = torch.sum(trn_gradients, dim=0)
-                idxs_temp, gammas_temp = self.ompwrapper(torch.transpose(trn_gradients, 0, 1),
-                                                         sum_val_grad,
-                                                         math.ceil(budget * len(trn_subset_idx) / self.N_trn))
+                idxs_temp, gammas_temp = self.optimalWeightsWrapper(trn_gradients, sum_val_grad,
+                                                                    math.ceil(budget * len(trn_subset_idx) / self.N_trn))
                 idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
                 gammas.extend(gammas_temp)
 
@@ -121,8 +109,8 @@ class FixedWeightStrategy(DataSelectionStrategy):
                 sum_val_grad = torch.sum(self.val_grads_per_elem, dim=0)
             else:
                 sum_val_grad = torch.sum(trn_gradients, dim=0)
-            idxs_temp, gammas_temp = self.ompwrapper(torch.transpose(trn_gradients, 0, 1),
-                                                     sum_val_grad, math.ceil(budget / self.trainloader.batch_size))
+            idxs_temp, gammas_temp = self.optimalWeightsWrapper(trn_gradients, sum_val_grad,
+                                                                math.ceil(budget / self.trainloader.batch_size))
             batch_wise_indices = list(self.trainloader.batch_sampler)
             for i in range(len(idxs_temp)):
                 tmp = batch_wise_indices[idxs_temp[i]]
@@ -130,21 +118,12 @@ class FixedWeightStrategy(DataSelectionStrategy):
                 gammas.extend(list(gammas_temp[i] * np.ones(len(tmp))))
 
         elif self.selection_type == 'PerClassPerGradient':
-            self.get_labels(valid=self.valid)
+            self.compute_class_gradients(valid=self.valid)
             idxs = []
             gammas = []
             embDim = self.model.get_embedding_dim()
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True)
-                if self.valid:
-                    val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                    val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                    self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                  shuffle=False, pin_memory=True)
-                self.compute_gradients(self.valid, perBatch=False, perClass=True)
+                trn_subset_idx = self.set_class_gradients(i, valid=self.valid)
                 trn_gradients = self.grads_per_elem
                 tmp_gradients = trn_gradients[:, i].view(-1, 1)
                 tmp1_gradients = trn_gradients[:,
@@ -161,9 +140,8 @@ class FixedWeightStrategy(DataSelectionStrategy):
                 else:
                     sum_val_grad = torch.sum(trn_gradients, dim=0)
 
-                idxs_temp, gammas_temp = self.ompwrapper(torch.transpose(trn_gradients, 0, 1),
-                                                         sum_val_grad,
-                                                         math.ceil(budget * len(trn_subset_idx) / self.N_trn))
+                idxs_temp, gammas_temp = self.optimalWeightsWrapper(trn_gradients, sum_val_grad,
+                                                                    math.ceil(budget * len(trn_subset_idx) / self.N_trn))
                 idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
                 gammas.extend(gammas_temp)
 
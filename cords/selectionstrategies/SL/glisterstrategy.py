@@ -4,7 +4,7 @@ import time
 import torch
 import torch.nn.functional as F
 from .dataselectionstrategy import DataSelectionStrategy
-from torch.utils.data import Subset, DataLoader
+from ..helpers import FactoredGradients, FactoredGradientStore, GradientStore
 import numpy as np
 
 
@@ -78,22 +78,55 @@ class GLISTERStrategy(DataSelectionStrategy):
         logger class for logging the information
     r : int, optional
         Number of greedy selection rounds when selection method is RGreedy (default: 15)
+    factored_grads : bool, optional
+        If True, per-element training and validation gradients are kept in factored form (default: False)
+    sketch_dim : int, optional
+        If given, the greedy gains are evaluated on random projections of the gradients of this dimension.
+        The exact gradients of the selected subset, needed for the one-step update, are kept in factored
+        form (default: None)
+    sketch_type : str, optional
+        Type of random projection - 'gaussian' | 'sparse' | 'srht' (default: 'gaussian')
+    sketch_seed : int, optional
+        Seed of the random projection (default: 0)
+    selection_batch_size : int, optional
+        Batch size of the per-element gradient passes. If None, the batch size of the trainloader is used
+        (default: None)
+    memmap_grads : bool, optional
+        If True, the gradients are kept in a disk backed memmap and read tile by tile (default: False)
+    memmap_dir : str, optional
+        Directory of the memmap files. If None, the default temporary directory is used (default: None)
+    memmap_dtype : str, optional
+        Data type of the memmap files - 'float32' | 'float16' (default: 'float32')
+    time_limit : float, optional
+        Wall clock time in seconds of a selection round, including the gradient computation. Once it is over,
+        the greedy selection stops, and the subset is topped up with random elements (default: None)
+    max_iters : int, optional
+        Maximum number of greedy steps (rounds with RGreedy) of every greedy selection (default: None)
     """
 
     def __init__(self, trainloader, valloader, model, 
                 loss_func, eta, device, num_classes, 
                 linear_layer, selection_type, greedy,
-                logger, r=15):
+                logger, r=15, factored_grads=False,
+                sketch_dim=None, sketch_type='gaussian', sketch_seed=0,
+                selection_batch_size=None, memmap_grads=False, memmap_dir=None, memmap_dtype='float32',
+                time_limit=None, max_iters=None):
         """
         Constructor method
         """
-        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss_func, device, logger)
+        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss_func, device, logger,
+                         factored_grads=factored_grads, sketch_dim=sketch_dim, sketch_type=sketch_type,
+                         sketch_seed=sketch_seed, selection_batch_size=selection_batch_size,
+                         memmap_grads=memmap_grads, memmap_dir=memmap_dir, memmap_dtype=memmap_dtype,
+                         time_limit=time_limit, max_iters=max_iters)
         self.eta = eta  # step size for the one step gradient update
         self.init_out = list()
         self.init_l1 = list()
         self.selection_type = selection_type
         self.greedy = greedy
         self.r = r
+        self.grads_factors = None
+        self.batch_rows = None
 
     def _update_grads_val(self, grads_curr=None, first_init=False):
         """
@@ -113,46 +146,12 @@ class GLISTERStrategy(DataSelectionStrategy):
         #     raise ValueError("perBatch and perClass are mutually exclusive. Only one of them can be true at a time")
         self.model.zero_grad()
         embDim = self.model.get_embedding_dim()
-        
-        if self.selection_type == 'PerClass':
-            valloader = self.pcvalloader
-        else:
-            valloader = self.valloader
-        
+
         if first_init:
-            for batch_idx, (inputs, targets) in enumerate(valloader):
-                inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-                if batch_idx == 0:
-                    out, l1 = self.model(inputs, last=True, freeze=True)
-                    loss = self.loss(out, targets).sum()
-                    l0_grads = torch.autograd.grad(loss, out)[0]
-                    if self.linear_layer:
-                        l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                        l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                    self.init_out = out
-                    self.init_l1 = l1
-                    self.y_val = targets.view(-1, 1)
-                    if self.selection_type == 'PerBatch':
-                        l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                        if self.linear_layer:
-                            l1_grads = l1_grads.mean(dim=0).view(1, -1)
-                else:
-                    out, l1 = self.model(inputs, last=True, freeze=True)
-                    loss = self.loss(out, targets).sum()
-                    batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                    if self.linear_layer:
-                        batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                        batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-                    if self.selection_type == 'PerBatch':
-                        batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
-                        if self.linear_layer:
-                            batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
-                    l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                    if self.linear_layer:
-                        l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
-                    self.init_out = torch.cat((self.init_out, out), dim=0)
-                    self.init_l1 = torch.cat((self.init_l1, l1), dim=0)
-                    self.y_val = torch.cat((self.y_val, targets.view(-1, 1)), dim=0)
+            if self.selection_type == 'PerClass':
+                val_grads = self.val_grads_per_elem
+            else:
+                val_grads = self._compute_val_gradients(perBatch=self.selection_type == 'PerBatch')
 
         elif grads_curr is not None:
             out_vec = self.init_out - (
@@ -164,27 +163,67 @@ class GLISTERStrategy(DataSelectionStrategy):
 
             loss = self.loss(out_vec, self.y_val.view(-1)).sum()
             l0_grads = torch.autograd.grad(loss, out_vec)[0]
-            if self.linear_layer:
-                l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                l1_grads = l0_expand * self.init_l1.repeat(1, self.num_classes)
-            if self.selection_type == 'PerBatch':
-                b = int(self.y_val.shape[0]/self.valloader.batch_size)
-                l0_grads = torch.chunk(l0_grads, b, dim=0)
-                new_t = []
-                for i in range(len(l0_grads)):
-                    new_t.append(torch.mean(l0_grads[i], dim=0).view(1, -1))
-                l0_grads = torch.cat(new_t, dim=0)
+            if self.factored_grads and self.linear_layer and self.selection_type != 'PerBatch':
+                val_grads = FactoredGradients(l0_grads, self.init_l1)
+            else:
                 if self.linear_layer:
-                    l1_grads = torch.chunk(l1_grads, b, dim=0)
+                    l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
+                    l1_grads = l0_expand * self.init_l1.repeat(1, self.num_classes)
+                if self.selection_type == 'PerBatch':
+                    b = int(self.y_val.shape[0]/self.valloader.batch_size)
+                    l0_grads = torch.chunk(l0_grads, b, dim=0)
                     new_t = []
-                    for i in range(len(l1_grads)):
-                        new_t.append(torch.mean(l1_grads[i], dim=0).view(1, -1))
-                    l1_grads = torch.cat(new_t, dim=0)
+                    for i in range(len(l0_grads)):
+                        new_t.append(torch.mean(l0_grads[i], dim=0).view(1, -1))
+                    l0_grads = torch.cat(new_t, dim=0)
+                    if self.linear_layer:
+                        l1_grads = torch.chunk(l1_grads, b, dim=0)
+                        new_t = []
+                        for i in range(len(l1_grads)):
+                            new_t.append(torch.mean(l1_grads[i], dim=0).view(1, -1))
+                        l1_grads = torch.cat(new_t, dim=0)
+                if self.linear_layer:
+                    val_grads = torch.cat((l0_grads, l1_grads), dim=1)
+                else:
+                    val_grads = l0_grads
         torch.cuda.empty_cache()
-        if self.linear_layer:
-            self.grads_val_curr = torch.mean(torch.cat((l0_grads, l1_grads), dim=1), dim=0).view(-1, 1)
-        else:
-            self.grads_val_curr = torch.mean(l0_grads, dim=0).view(-1, 1)
+        grads_val_curr = val_grads.mean(dim=0)
+        if self.sketch_dim is not None and not first_init:
+            grads_val_curr = self._gradient_sketch().project(grads_val_curr.view(1, -1))
+        self.grads_val_curr = grads_val_curr.view(-1, 1)
+
+    def _compute_val_gradients(self, perBatch=False):
+        """
+        Computes the validation gradients and keeps the model outputs, the embeddings and the targets of the
+        validation set, from which the validation gradients are updated during the greedy selection.
+
+        Parameters
+        ----------
+        perBatch: bool
+            if True, the function computes the validation gradients of each mini-batch
+
+        Returns
+        ----------
+        val_grads: Tensor or FactoredGradients
+            Validation gradients
+        """
+        store = self._gradient_store(GradientStore.num_rows(self.valloader, perBatch), perBatch)
+        init_out = []
+        init_l1 = []
+        y_val = []
+        for batch_idx, (inputs, targets) in enumerate(self.valloader):
+            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
+            out, l1 = self.model(inputs, last=True, freeze=True)
+            loss = self.loss(out, targets).sum()
+            l0_grads = torch.autograd.grad(loss, out)[0]
+            store.append(l0_grads, l1)
+            init_out.append(out)
+            init_l1.append(l1)
+            y_val.append(targets.view(-1, 1))
+        self.init_out = torch.cat(init_out, dim=0)
+        self.init_l1 = torch.cat(init_l1, dim=0)
+        self.y_val = torch.cat(y_val, dim=0)
+        return store.gradients()
 
     def eval_taylor_modular(self, grads):
         """
@@ -192,7 +231,7 @@ class GLISTERStrategy(DataSelectionStrategy):
 
         Parameters
         ----------
-        grads: Tensor
+        grads: Tensor or FactoredGradients
             Gradients
 
         Returns
@@ -203,9 +242,65 @@ class GLISTERStrategy(DataSelectionStrategy):
 
         grads_val = self.grads_val_curr
         with torch.no_grad():
-            gains = torch.matmul(grads, grads_val)
+            gains = grads.matmul(grads_val)
         return gains
 
+    def _compute_train_gradients(self, perBatch=False, perClass=False):
+        """
+        Computes the training gradients used by the greedy selection. With sketching, the exact per-element
+        gradients are also kept in factored form, since the one-step update of the validation gradients
+        needs the exact gradient of the selected subset.
+
+        Parameters
+        ----------
+        perBatch: bool
+            if True, the function computes the gradients of each mini-batch
+        perClass: bool
+            if True, the function computes the gradients of all the elements in a single pass and records
+            their labels, see :func:`compute_class_gradients`
+        """
+        if self.sketch_dim is None:
+            if perClass:
+                self.compute_class_gradients()
+            else:
+                self.compute_gradients(perBatch=perBatch)
+            return
+        factor_store = FactoredGradientStore(GradientStore.num_rows(self.trainloader), self.num_classes,
+                                             self.model.get_embedding_dim(), self.linear_layer, self.device)
+        if perClass:
+            self.compute_class_gradients(factor_store=factor_store)
+        else:
+            self.grads_per_elem = self._compute_loader_gradients(self.trainloader, perBatch, factor_store=factor_store)
+        self.grads_factors = factor_store.gradients()
+        if perBatch:
+            self.batch_rows = []
+            start = 0
+            for batch in self.trainloader.batch_sampler:
+                self.batch_rows.append(list(range(start, start + len(batch))))
+                start += len(batch)
+        torch.cuda.empty_cache()
+
+    def _selected_gradients(self, element):
+        """
+        Sum of the exact gradients of the elements (or mini-batches) in `element`.
+
+        Parameters
+        ----------
+        element: list
+            Indices of the selected elements (or mini-batches)
+        """
+        if self.grads_factors is None:
+            return self.grads_per_elem[element].sum(dim=0)
+        if self.selection_type == 'PerBatch':
+            rows = []
+            weights = []
+            for idx in element:
+                rows.extend(self.batch_rows[idx])
+                weights.extend([1.0 / len(self.batch_rows[idx])] * len(self.batch_rows[idx]))
+            weights = torch.tensor(weights, device=self.grads_factors.device)
+            return self.grads_factors[rows].weighted_sum(weights)
+        return self.grads_factors[element].sum(dim=0)
+
     def _update_gradients_subset(self, grads, element):
         """
         Update gradients of set X + element (basically adding element to X)
@@ -219,7 +314,7 @@ class GLISTERStrategy(DataSelectionStrategy):
             Element that need to be added to the gradients
         """
         # if isinstance(element, list):
-        grads += self.grads_per_elem[element].sum(dim=0)
+        grads += self._selected_gradients(element)
 
     def greedy_algo(self, budget):
         greedySet = list()
@@ -229,7 +324,8 @@ class GLISTERStrategy(DataSelectionStrategy):
         numSelected = 0
         if self.greedy == 'RGreedy':
             # subset_size = int((len(self.grads_per_elem) / r))
-            selection_size = int(budget / self.r)
+            selection_size = max(1, int(budget / self.r))
+            max_steps = self._solver_iters(math.ceil(budget / selection_size))
             while (numSelected < budget):
                 # Try Using a List comprehension here!
                 rem_grads = self.grads_per_elem[remainSet]
@@ -240,17 +336,20 @@ class GLISTERStrategy(DataSelectionStrategy):
                 greedySet.extend(selected_indices)
                 [remainSet.remove(idx) for idx in selected_indices]
                 if numSelected == 0:
-                    grads_curr = self.grads_per_elem[selected_indices].sum(dim=0).view(1, -1)
+                    grads_curr = self._selected_gradients(selected_indices).view(1, -1)
                 else:  # If 1st selection, then just set it to bestId grads
                     self._update_gradients_subset(grads_curr, selected_indices)
                 # Update the grads_val_current using current greedySet grads
                 self._update_grads_val(grads_curr)
                 numSelected += selection_size
+                if self._check_time_limit() or numSelected >= max_steps * selection_size:
+                    break
             self.logger.debug("R greedy GLISTER total time: %.4f", time.time() - t_ng_start)
 
         # Stochastic Greedy Selection Algorithm
         elif self.greedy == 'Stochastic':
             subset_size = int((len(self.grads_per_elem) / budget) * math.log(100))
+            max_steps = self._solver_iters(budget)
             while (numSelected < budget):
                 # Try Using a List comprehension here!
                 subset_selected = random.sample(remainSet, k=subset_size)
@@ -266,12 +365,15 @@ class GLISTERStrategy(DataSelectionStrategy):
                 if numSelected > 1:
                     self._update_gradients_subset(grads_curr, bestId)
                 else:  # If 1st selection, then just set it to bestId grads
-                    grads_curr = self.grads_per_elem[bestId].view(1, -1)  # Making it a list so that is mutable!
+                    grads_curr = self._selected_gradients(bestId).view(1, -1)  # Making it a list so that is mutable!
                 # Update the grads_val_current using current greedySet grads
                 self._update_grads_val(grads_curr)
+                if self._check_time_limit() or numSelected >= max_steps:
+                    break
             self.logger.debug("Stochastic Greedy GLISTER total time: %.4f", time.time() - t_ng_start)
 
         elif self.greedy == 'Naive':
+            max_steps = self._solver_iters(budget)
             while (numSelected < budget):
                 # Try Using a List comprehension here!
                 rem_grads = self.grads_per_elem[remainSet]
@@ -285,13 +387,15 @@ class GLISTERStrategy(DataSelectionStrategy):
                 numSelected += 1
                 # Update info in grads_currX using element=bestId
                 if numSelected == 1:
-                    grads_curr = self.grads_per_elem[bestId[0]].view(1, -1)
+                    grads_curr = self._selected_gradients(bestId).view(1, -1)
                 else:  # If 1st selection, then just set it to bestId grads
                     self._update_gradients_subset(grads_curr, bestId)
                 # Update the grads_val_current using current greedySet grads
                 self._update_grads_val(grads_curr)
+                if self._check_time_limit() or numSelected >= max_steps:
+                    break
             self.logger.debug("Naive Greedy GLISTER total time: %.4f", time.time() - t_ng_start)
-        return list(greedySet), [1] * budget
+        return list(greedySet), [1] * len(greedySet)
 
 
     def select(self, budget, model_params):
@@ -313,21 +417,24 @@ class GLISTERStrategy(DataSelectionStrategy):
             Tensor containing gradients of datapoints present in greedySet
         """
         glister_start_time = time.time()
+        self._start_time_limit()
         self.update_model(model_params)
         if self.selection_type == 'PerClass':
-            self.get_labels(valid=True)
+            self._compute_train_gradients(perClass=True)
+            self.all_val_grads_per_elem = self._compute_val_gradients()
+            self.val_lbls = self.y_val.view(-1)
+            all_grads_factors = self.grads_factors
+            all_init_out, all_init_l1, all_y_val = self.init_out, self.init_l1, self.y_val
             idxs = []
             gammas = []
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True)
-                val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True)
-                self.compute_gradients(perClass=True)
+                trn_subset_idx = self.set_class_gradients(i, valid=True)
+                if all_grads_factors is not None:
+                    self.grads_factors = all_grads_factors[trn_subset_idx]
+                val_subset_idx = torch.where(self.val_lbls == i)[0]
+                self.init_out = all_init_out[val_subset_idx]
+                self.init_l1 = all_init_l1[val_subset_idx]
+                self.y_val = all_y_val[val_subset_idx]
                 self._update_grads_val(first_init=True)
                 idxs_temp, gammas_temp = self.greedy_algo(math.ceil(budget * len(trn_subset_idx) / self.N_trn))
                 idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
@@ -335,7 +442,7 @@ class GLISTERStrategy(DataSelectionStrategy):
         elif self.selection_type == 'PerBatch':
             idxs = []
             gammas = []
-            self.compute_gradients(perBatch=True)
+            self._compute_train_gradients(perBatch=True)
             self._update_grads_val(first_init=True)
             idxs_temp, gammas_temp = self.greedy_algo(math.ceil(budget/self.trainloader.batch_size))
             batch_wise_indices = list(self.trainloader.batch_sampler)
@@ -344,9 +451,10 @@ class GLISTERStrategy(DataSelectionStrategy):
                 idxs.extend(tmp)
                 gammas.extend([gammas_temp[i]] * len(tmp))
         else:
-            self.compute_gradients()
+            self._compute_train_gradients()
             self._update_grads_val(first_init=True)
             idxs, gammas = self.greedy_algo(budget)
+        self._random_top_up(idxs, gammas, budget, "GLISTER")
         glister_end_time = time.time()
         self.logger.debug("GLISTER algorithm Subset Selection time is: %.4f", glister_end_time - glister_start_time)
         return idxs, torch.FloatTensor(gammas)
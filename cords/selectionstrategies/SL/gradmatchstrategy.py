@@ -3,8 +3,8 @@ import time
 import torch
 import numpy as np
 from .dataselectionstrategy import DataSelectionStrategy
-from ..helpers import OrthogonalMP_REG_Parallel, OrthogonalMP_REG, OrthogonalMP_REG_Parallel_V1
-from torch.utils.data import Subset, DataLoader
+from ..helpers import OrthogonalMP_REG_Parallel, OrthogonalMP_REG, OrthogonalMP_REG_Parallel_V1, FactoredGradients, \
+    MemmapGradients, OrthogonalMP_REG_Cholesky, OrthogonalMP_REG_Batched
 
 
 class GradMatchStrategy(DataSelectionStrategy):
@@ -55,15 +55,71 @@ class GradMatchStrategy(DataSelectionStrategy):
         Regularization constant of OMP solver
     eps : float
         Epsilon parameter to which the above optimization problem is solved using OMP algorithm
+    factored_grads : bool, optional
+        If True, per-element gradients are kept in factored form and OMP works on their Gram columns.
+        Factored gradients are always solved with the v1 OMP solver (default: False)
+    sketch_dim : int, optional
+        If given, OMP runs on random projections of the gradients of this dimension (default: None)
+    sketch_type : str, optional
+        Type of random projection - 'gaussian' | 'sparse' | 'srht' (default: 'gaussian')
+    sketch_seed : int, optional
+        Seed of the random projection (default: 0)
+    selection_batch_size : int, optional
+        Batch size of the per-element gradient passes. If None, the batch size of the trainloader is used
+        (default: None)
+    memmap_grads : bool, optional
+        If True, the gradients are kept in a disk backed memmap and read tile by tile (default: False)
+    memmap_dir : str, optional
+        Directory of the memmap files. If None, the default temporary directory is used (default: None)
+    memmap_dtype : str, optional
+        Data type of the memmap files - 'float32' | 'float16' (default: 'float32')
+    omp_variant : str, optional
+        OMP solver used on dense gradients (default: 'cholesky') -
+        - 'cholesky': OMP that updates the Cholesky factor of the support Gram matrix one atom at a time.
+        - 'lstsq': OMP that solves the least squares problem of the support from scratch for every atom, with the
+          solver chosen by `device` and `v1`.
+        - 'stagewise': like 'cholesky', but every correlation with the residual adds the `omp_stage_size` atoms that
+          correlate most with it, which divides the number of iterations by `omp_stage_size` for a slightly larger
+          residual. The relative residual of every problem is logged at the debug level.
+    warm_start : bool, optional
+        If True, the OMP problems of every selection round start from the support selected for them in the previous
+        round, in decreasing order of the previous weights, instead of an empty support. Needs
+        `omp_variant='cholesky'` or `omp_variant='stagewise'`; factored and memory mapped gradients are still solved from scratch. The number of
+        reused atoms of the last round is kept in `warm_start_reused` (default: False)
+    omp_stage_size : int, optional
+        Number of atoms added per iteration with `omp_variant='stagewise'` (default: 8)
+    time_limit : float, optional
+        Wall clock time in seconds of a selection round, including the gradient computation. Once it is over,
+        the OMP solvers return the support selected so far, and the subset is topped up with random elements
+        (default: None)
+    max_iters : int, optional
+        Maximum number of iterations (atoms, or stages with `omp_variant='stagewise'`) of every OMP problem
+        (default: None)
     """
 
     def __init__(self, trainloader, valloader, model, loss,
                  eta, device, num_classes, linear_layer,
-                 selection_type, logger, valid=False, v1=True, lam=0, eps=1e-4):
+                 selection_type, logger, valid=False, v1=True, lam=0, eps=1e-4, factored_grads=False,
+                 sketch_dim=None, sketch_type='gaussian', sketch_seed=0,
+                 selection_batch_size=None, memmap_grads=False, memmap_dir=None, memmap_dtype='float32',
+                 omp_variant='cholesky', warm_start=False, omp_stage_size=8, time_limit=None, max_iters=None):
         """
         Constructor method
         """
-        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device, logger)
+        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device, logger,
+                         factored_grads=factored_grads, sketch_dim=sketch_dim, sketch_type=sketch_type,
+                         sketch_seed=sketch_seed, selection_batch_size=selection_batch_size,
+                         memmap_grads=memmap_grads, memmap_dir=memmap_dir, memmap_dtype=memmap_dtype,
+                         time_limit=time_limit, max_iters=max_iters)
+        if sketch_dim is not None and selection_type == 'PerClassPerGradient':
+            raise ValueError("PerClassPerGradient selection needs the gradient coordinates of each class and "
+                             "can not be used with gradient sketching")
+        if omp_variant not in ['cholesky', 'lstsq', 'stagewise']:
+            raise ValueError("omp_variant must be one of 'cholesky', 'lstsq' or 'stagewise'")
+        if warm_start and omp_variant not in ['cholesky', 'stagewise']:
+            raise ValueError("warm_start needs omp_variant='cholesky' or omp_variant='stagewise'")
+        if omp_stage_size < 1:
+            raise ValueError("omp_stage_size must be a positive integer")
         self.eta = eta  # step size for the one step gradient update
         self.device = device
         self.init_out = list()
@@ -73,23 +129,187 @@ class GradMatchStrategy(DataSelectionStrategy):
         self.lam = lam
         self.eps = eps
         self.v1 = v1
+        self.omp_variant = omp_variant
+        self.warm_start = warm_start
+        self.omp_stage_size = omp_stage_size
+        # support of every OMP problem of the previous round, in decreasing order of the weights
+        self.warm_support = dict()
+        self.warm_start_reused = 0
+        self.warm_start_atoms = 0
 
-    def ompwrapper(self, X, Y, bud):
-        if self.device == "cpu":
-            reg = OrthogonalMP_REG(X.numpy(), Y.numpy(), nnz=bud, positive=True, lam=0)
+    def _omp_budget(self, bud):
+        """
+        Number of atoms of an OMP problem with budget `bud`, capped by `max_iters`.
+        """
+        stage_size = self.omp_stage_size if self.omp_variant == 'stagewise' else 1
+        return min(bud, self._solver_iters(math.ceil(bud / stage_size)) * stage_size)
+
+    def ompwrapper(self, X, Y, bud, init=None):
+        bud = self._omp_budget(bud)
+        time_limit = self._time_left()
+        if isinstance(X, (FactoredGradients, MemmapGradients)):
+            reg = OrthogonalMP_REG_Parallel_V1(X, Y, nnz=bud,
+                                             positive=True, lam=self.lam,
+                                             tol=self.eps, device=self.device, time_limit=time_limit)
+            ind = torch.nonzero(reg).view(-1)
+        elif self.omp_variant in ['cholesky', 'stagewise']:
+            stage_size = self.omp_stage_size if self.omp_variant == 'stagewise' else 1
+            if self.device == "cpu":
+                reg = OrthogonalMP_REG_Cholesky(X, Y, nnz=bud, positive=True, lam=0, device=self.device, init=init,
+                                                stage_size=stage_size, time_limit=time_limit)
+            else:
+                reg = OrthogonalMP_REG_Cholesky(X, Y, nnz=bud, positive=True, lam=self.lam,
+                                                tol=self.eps, device=self.device, init=init, stage_size=stage_size,
+                                                time_limit=time_limit)
+            ind = torch.nonzero(reg).view(-1)
+            if self.omp_variant == 'stagewise':
+                self.logger.debug("Stagewise OMP (stage size %d): relative residual %.4f", stage_size,
+                                  ((Y - torch.matmul(X, reg)).norm() / Y.norm()).item())
+        elif self.device == "cpu":
+            reg = OrthogonalMP_REG(X.numpy(), Y.numpy(), nnz=bud, positive=True, lam=0, time_limit=time_limit)
             ind = np.nonzero(reg)[0]
         else:
             if self.v1:
                 reg = OrthogonalMP_REG_Parallel_V1(X, Y, nnz=bud,
                                                  positive=True, lam=self.lam,
-                                                 tol=self.eps, device=self.device)
+                                                 tol=self.eps, device=self.device, time_limit=time_limit)
             else:
                 reg = OrthogonalMP_REG_Parallel(X, Y, nnz=bud,
                                                 positive=True, lam=self.lam,
-                                                tol=self.eps, device=self.device)
+                                                tol=self.eps, device=self.device, time_limit=time_limit)
             ind = torch.nonzero(reg).view(-1)
+        self._check_time_limit()
         return ind.tolist(), reg[ind].tolist()
 
+    def batched_ompwrapper(self, problems):
+        """
+        Solves the OMP problems of several classes together with :func:`OrthogonalMP_REG_Batched`, which gives the
+        same selection as calling :func:`ompwrapper` on every problem with `omp_variant='cholesky'`.
+
+        Parameters
+        ----------
+        problems: list
+            List of (X, Y, bud) tuples, where X is a dense tensor
+
+        Returns
+        ----------
+        solutions: list
+            List of (indices, weights) tuples, one per problem
+        """
+        buds = [self._omp_budget(bud) for _, _, bud in problems]
+        if self.device == "cpu":
+            regs = OrthogonalMP_REG_Batched([X for X, _, _ in problems], [Y for _, Y, _ in problems], buds,
+                                            positive=True, lam=0, device=self.device, time_limit=self._time_left())
+        else:
+            regs = OrthogonalMP_REG_Batched([X for X, _, _ in problems], [Y for _, Y, _ in problems], buds,
+                                            positive=True, lam=self.lam, tol=self.eps, device=self.device,
+                                            time_limit=self._time_left())
+        self._check_time_limit()
+        solutions = []
+        for reg in regs:
+            ind = torch.nonzero(reg).view(-1)
+            solutions.append((ind.tolist(), reg[ind].tolist()))
+        return solutions
+
+    def _batched_omp(self, gradients):
+        """
+        Whether the per-class OMP problems are solved together with :func:`batched_ompwrapper`, which needs
+        dense gradients and the Cholesky OMP variant, and solves every problem from an empty support.
+        """
+        return self.omp_variant == 'cholesky' and isinstance(gradients, torch.Tensor) and \
+            not (self.warm_start and len(self.warm_support) > 0)
+
+    def _extend_batched(self, problems, idxs, gammas):
+        """
+        Solves the per-class problems collected for :func:`batched_ompwrapper` and appends the selected elements
+        and their weights to `idxs` and `gammas`, in the order of the classes.
+
+        Parameters
+        ----------
+        problems: list
+            List of (c, trn_subset_idx, (X, Y, bud)) tuples
+        idxs: list
+            Selected indices
+        gammas: list
+            Weights of the selected indices
+        """
+        if len(problems) == 0:
+            return
+        solutions = self.batched_ompwrapper([problem for _, _, problem in problems])
+        for (c, trn_subset_idx, _), (idxs_temp, gammas_temp) in zip(problems, solutions):
+            self._warm_update(c, list(np.array(trn_subset_idx)[idxs_temp]), gammas_temp)
+            idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
+            gammas.extend(gammas_temp)
+
+    def _warm_init(self, key, trn_subset_idx=None):
+        """
+        Column indices of the OMP problem `key` that were selected for it in the previous round, in decreasing
+        order of their weights, or None if there is nothing to start from.
+
+        Parameters
+        ----------
+        key: int or str
+            Class of a per-class problem, or 'PerBatch'
+        trn_subset_idx: list, optional
+            Elements of the columns of the problem. If None, the columns are the elements themselves
+            (default: None)
+        """
+        if not self.warm_start or key not in self.warm_support:
+            return None
+        if trn_subset_idx is None:
+            return self.warm_support[key]
+        columns = {int(j): col for col, j in enumerate(trn_subset_idx)}
+        return [columns[j] for j in self.warm_support[key] if j in columns]
+
+    def _warm_update(self, key, support, weights):
+        """
+        Keeps the elements selected for the OMP problem `key` for the warm start of the next round, and counts
+        how many of them were already selected in the previous round.
+
+        Parameters
+        ----------
+        key: int or str
+            Class of a per-class problem, or 'PerBatch'
+        support: list
+            Selected elements
+        weights: list
+            Weights of the selected elements
+        """
+        if not self.warm_start:
+            return
+        order = np.argsort(-np.asarray(weights), kind='stable')
+        support = [int(support[j]) for j in order]
+        self.warm_start_reused += len(set(self.warm_support.get(key, [])).intersection(support))
+        self.warm_start_atoms += len(support)
+        self.warm_support[key] = support
+
+    def _class_gradients(self, gradients, c, embDim):
+        """
+        Restricts the gradients to the bias and the weights of the output unit of class `c`.
+
+        Parameters
+        ----------
+        gradients: Tensor, FactoredGradients or MemmapGradients
+            Gradients of the elements
+        c: int
+            Class index
+        embDim: int
+            Dimension of the penultimate layer embedding
+
+        Returns
+        ----------
+        gradients: Tensor or FactoredGradients
+            Gradients of shape (number of elements, 1 + embDim)
+        """
+        if isinstance(gradients, FactoredGradients):
+            return gradients.class_gradients(c)
+        if isinstance(gradients, MemmapGradients):
+            return gradients.columns([c] + list(range(self.num_classes + (embDim * c),
+                                                      self.num_classes + (embDim * (c + 1)))))
+        tmp_gradients = gradients[:, c].view(-1, 1)
+        tmp1_gradients = gradients[:, self.num_classes + (embDim * c): self.num_classes + (embDim * (c + 1))]
+        return torch.cat((tmp_gradients, tmp1_gradients), dim=1)
+
     def select(self, budget, model_params):
         """
         Apply OMP Algorithm for data selection
@@ -109,34 +329,33 @@ class GradMatchStrategy(DataSelectionStrategy):
             Tensor containing weights of each instance
         """
         omp_start_time = time.time()
+        self._start_time_limit()
         self.update_model(model_params)
+        self.warm_start_reused = 0
+        self.warm_start_atoms = 0
 
         if self.selection_type == 'PerClass':
-            self.get_labels(valid=self.valid)
+            self.compute_class_gradients(valid=self.valid)
             idxs = []
             gammas = []
+            problems = []
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True, collate_fn=self.trainloader.collate_fn)
-                if self.valid:
-                    val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                    val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                    self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                  shuffle=False, pin_memory=True, collate_fn=self.trainloader.collate_fn)
-
-                self.compute_gradients(self.valid, perBatch=False, perClass=True)
+                trn_subset_idx = self.set_class_gradients(i, valid=self.valid)
                 trn_gradients = self.grads_per_elem
                 if self.valid:
-                    sum_val_grad = torch.sum(self.val_grads_per_elem, dim=0)
+                    sum_val_grad = self.val_grads_per_elem.sum(dim=0)
                 else:
-                    sum_val_grad = torch.sum(trn_gradients, dim=0)
-                idxs_temp, gammas_temp = self.ompwrapper(torch.transpose(trn_gradients, 0, 1),
-                                                         sum_val_grad,
-                                                         math.ceil(budget * len(trn_subset_idx) / self.N_trn))
+                    sum_val_grad = trn_gradients.sum(dim=0)
+                bud = math.ceil(budget * len(trn_subset_idx) / self.N_trn)
+                if self._batched_omp(trn_gradients):
+                    problems.append((i, trn_subset_idx, (trn_gradients.t(), sum_val_grad, bud)))
+                    continue
+                idxs_temp, gammas_temp = self.ompwrapper(trn_gradients.t(), sum_val_grad, bud,
+                                                         init=self._warm_init(i, trn_subset_idx))
+                self._warm_update(i, list(np.array(trn_subset_idx)[idxs_temp]), gammas_temp)
                 idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
                 gammas.extend(gammas_temp)
+            self._extend_batched(problems, idxs, gammas)
 
         elif self.selection_type == 'PerBatch':
             self.compute_gradients(self.valid, perBatch=True, perClass=False)
@@ -144,11 +363,13 @@ class GradMatchStrategy(DataSelectionStrategy):
             gammas = []
             trn_gradients = self.grads_per_elem
             if self.valid:
-                sum_val_grad = torch.sum(self.val_grads_per_elem, dim=0)
+                sum_val_grad = self.val_grads_per_elem.sum(dim=0)
             else:
-                sum_val_grad = torch.sum(trn_gradients, dim=0)
-            idxs_temp, gammas_temp = self.ompwrapper(torch.transpose(trn_gradients, 0, 1),
-                                                     sum_val_grad, math.ceil(budget / self.trainloader.batch_size))
+                sum_val_grad = trn_gradients.sum(dim=0)
+            idxs_temp, gammas_temp = self.ompwrapper(trn_gradients.t(),
+                                                     sum_val_grad, math.ceil(budget / self.trainloader.batch_size),
+                                                     init=self._warm_init('PerBatch'))
+            self._warm_update('PerBatch', idxs_temp, gammas_temp)
             batch_wise_indices = list(self.trainloader.batch_sampler)
             for i in range(len(idxs_temp)):
                 tmp = batch_wise_indices[idxs_temp[i]]
@@ -156,42 +377,36 @@ class GradMatchStrategy(DataSelectionStrategy):
                 gammas.extend(list(gammas_temp[i] * np.ones(len(tmp))))
 
         elif self.selection_type == 'PerClassPerGradient':
-            self.get_labels(valid=self.valid)
+            self.compute_class_gradients(valid=self.valid)
             idxs = []
             gammas = []
+            problems = []
             embDim = self.model.get_embedding_dim()
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True, collate_fn=self.trainloader.collate_fn)
-                if self.valid:
-                    val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                    val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                    self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                  shuffle=False, pin_memory=True, collate_fn=self.trainloader.collate_fn)
-                self.compute_gradients(self.valid, perBatch=False, perClass=True)
-                trn_gradients = self.grads_per_elem
-                tmp_gradients = trn_gradients[:, i].view(-1, 1)
-                tmp1_gradients = trn_gradients[:,
-                                 self.num_classes + (embDim * i): self.num_classes + (embDim * (i + 1))]
-                trn_gradients = torch.cat((tmp_gradients, tmp1_gradients), dim=1)
+                trn_subset_idx = self.set_class_gradients(i, valid=self.valid)
+                trn_gradients = self._class_gradients(self.grads_per_elem, i, embDim)
 
                 if self.valid:
-                    val_gradients = self.val_grads_per_elem
-                    tmp_gradients = val_gradients[:, i].view(-1, 1)
-                    tmp1_gradients = val_gradients[:,
-                                     self.num_classes + (embDim * i): self.num_classes + (embDim * (i + 1))]
-                    val_gradients = torch.cat((tmp_gradients, tmp1_gradients), dim=1)
-                    sum_val_grad = torch.sum(val_gradients, dim=0)
+                    val_gradients = self._class_gradients(self.val_grads_per_elem, i, embDim)
+                    sum_val_grad = val_gradients.sum(dim=0)
                 else:
-                    sum_val_grad = torch.sum(trn_gradients, dim=0)
+                    sum_val_grad = trn_gradients.sum(dim=0)
 
-                idxs_temp, gammas_temp = self.ompwrapper(torch.transpose(trn_gradients, 0, 1),
-                                                         sum_val_grad,
-                                                         math.ceil(budget * len(trn_subset_idx) / self.N_trn))
+                bud = math.ceil(budget * len(trn_subset_idx) / self.N_trn)
+                if self._batched_omp(trn_gradients):
+                    problems.append((i, trn_subset_idx, (trn_gradients.t(), sum_val_grad, bud)))
+                    continue
+                idxs_temp, gammas_temp = self.ompwrapper(trn_gradients.t(), sum_val_grad, bud,
+                                                         init=self._warm_init(i, trn_subset_idx))
+                self._warm_update(i, list(np.array(trn_subset_idx)[idxs_temp]), gammas_temp)
                 idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
                 gammas.extend(gammas_temp)
+            self._extend_batched(problems, idxs, gammas)
+        if self.warm_start:
+            self.logger.info("GradMatch warm start reused %d of the %d selected atoms",
+                             self.warm_start_reused, self.warm_start_atoms)
+        if self.stopped_early:
+            self._log_stopped_early("GradMatch", len(idxs), budget)
         diff = budget - len(idxs)
         self.logger.debug("Random points added: %d ", diff)
 
@@ -306,7 +306,7 @@ class SELCONstrategy(DataSelectionStrategy):
         return list(indices.cpu().numpy()), list(values.cpu().numpy())
 
     def select(self, budget, model_params):
-        N = len(self.trainloader)
+        N = self.N_trn
         current_idx = list(np.random.choice(N, budget, replace=False)) # take this from prev train loop
         state_values = list(self.optimizer.state.values())
         step = state_values[0]['step']
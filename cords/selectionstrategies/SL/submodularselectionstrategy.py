@@ -2,9 +2,10 @@ import apricot
 import numpy as np
 import torch
 import torch.nn.functional as F
-from scipy.sparse import csr_matrix
 from .dataselectionstrategy import DataSelectionStrategy
 from torch.utils.data.sampler import SubsetRandomSampler
+from ..helpers import block_similarity_kernel, facility_location_greedy, graph_cut_greedy, nearest_selected, \
+    pairwise_distances, similarity_kernel
 
 
 class SubmodularSelectionStrategy(DataSelectionStrategy):
@@ -35,23 +36,38 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
     submod_func_type: str
         The type of submodular optimization function. Must be one of
         'facility-location', 'graph-cut', 'sum-redundancy', 'saturated-coverage'
+    optimizer: str
+        Type of Greedy Algorithm
+    logger : class, optional
+        - logger object for logging the information (default: None)
+    kernel_dtype: str, optional
+        Data type of the similarity kernel - 'float32' | 'float16'. A float16 kernel takes half the memory and is
+        scaled to [0, 1]; the sparse kernel of 'Supervised' is float32, as scipy has no float16 sparse matrices
+        (default: 'float32')
     """
 
     def __init__(self, trainloader, valloader, model, loss,
-                 device, num_classes, linear_layer, if_convex, selection_type, submod_func_type, optimizer):
+                 device, num_classes, linear_layer, if_convex, selection_type, submod_func_type, optimizer,
+                 logger=None, kernel_dtype='float32'):
         """
         Constructer method
         """
-        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device)
+        super().__init__(trainloader, valloader, model, num_classes, linear_layer, loss, device, logger)
         self.if_convex = if_convex
         self.selection_type = selection_type
         self.submod_func_type = submod_func_type
         self.optimizer = optimizer
+        if kernel_dtype not in ['float32', 'float16']:
+            raise ValueError("kernel_dtype must be one of 'float32' or 'float16'")
+        self.kernel_dtype = kernel_dtype
 
     def distance(self, x, y, exp=2):
         """
         Compute the distance.
 
+        The squared euclidean distance is computed tile by tile with matrix products, see
+        :func:`cords.selectionstrategies.helpers.pairwise_distances`.
+
         Parameters
         ----------
         x: Tensor
@@ -66,15 +82,7 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
         dist: Tensor
             Output tensor
         """
-
-        n = x.size(0)
-        m = y.size(0)
-        d = x.size(1)
-        x = x.unsqueeze(1).expand(n, m, d)
-        y = y.unsqueeze(0).expand(n, m, d)
-        dist = torch.pow(x - y, exp).sum(2)
-        # dist = torch.exp(-1 * torch.pow(x - y, 2).sum(2))
-        return dist
+        return pairwise_distances(x, y, exp=exp)
 
     def compute_score(self, model_params, idxs):
         """
@@ -89,16 +97,20 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
         """
 
         trainset = self.trainloader.sampler.data_source
+        # the rows of the 'Supervised' kernel are the training elements in order, as the selected rows are returned
+        sampler = idxs.tolist() if self.selection_type == 'Supervised' else SubsetRandomSampler(idxs)
         subset_loader = torch.utils.data.DataLoader(trainset, batch_size=self.trainloader.batch_size, shuffle=False,
-                                                    sampler=SubsetRandomSampler(idxs),
+                                                    sampler=sampler,
                                                     pin_memory=True)
         self.model.load_state_dict(model_params)
         self.N = 0
         g_is = []
+        lbls = []
 
         if self.if_convex:
             for batch_idx, (inputs, targets) in enumerate(subset_loader):
                 inputs, targets = inputs, targets
+                lbls.append(targets.cpu())
                 if self.selection_type == 'PerBatch':
                     self.N += 1
                     g_is.append(inputs.view(inputs.size()[0], -1).mean(dim=0).view(1, -1))
@@ -109,6 +121,7 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
             embDim = self.model.get_embedding_dim()
             for batch_idx, (inputs, targets) in enumerate(subset_loader):
                 inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
+                lbls.append(targets.cpu())
                 if self.selection_type == 'PerBatch':
                     self.N += 1
                 else:
@@ -129,21 +142,11 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
                     else:
                         g_is.append(l0_grads)
 
-        self.dist_mat = torch.zeros([self.N, self.N], dtype=torch.float32)
-        first_i = True
-        if self.selection_type == 'PerBatch':
-            g_is = torch.cat(g_is, dim=0)
-            self.dist_mat = self.distance(g_is, g_is).cpu()
+        if self.selection_type == 'Supervised':
+            # similarities between elements of different classes are zero, so only the class blocks are stored
+            self.dist_mat, self.const = block_similarity_kernel(g_is, torch.cat(lbls))
         else:
-            for i, g_i in enumerate(g_is, 0):
-                if first_i:
-                    size_b = g_i.size(0)
-                    first_i = False
-                for j, g_j in enumerate(g_is, 0):
-                    self.dist_mat[i * size_b: i * size_b + g_i.size(0),
-                    j * size_b: j * size_b + g_j.size(0)] = self.distance(g_i, g_j).cpu()
-        self.const = torch.max(self.dist_mat).item()
-        self.dist_mat = (self.const - self.dist_mat).numpy()
+            self.dist_mat, self.const = similarity_kernel(g_is, dtype=self.kernel_dtype)
 
     def compute_gamma(self, idxs):
         """
@@ -160,18 +163,9 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
             Gradient values of the input indices
         """
 
-        if self.selection_type == 'PerClass':
-            gamma = [0 for i in range(len(idxs))]
-            best = self.dist_mat[idxs]  # .to(self.device)
-            rep = np.argmax(best, axis=0)
-            for i in rep:
-                gamma[i] += 1
-        elif self.selection_type == 'Supervised':
-            gamma = [0 for i in range(len(idxs))]
-            best = self.dist_mat[idxs]  # .to(self.device)
-            rep = np.argmax(best, axis=0)
-            for i in range(rep.shape[1]):
-                gamma[rep[0, i]] += 1
+        rep, _ = nearest_selected(self.dist_mat, idxs)
+        # the kernel of 'Supervised' is block diagonal, so elements are represented by selected elements of their class
+        gamma = np.bincount(rep[rep >= 0], minlength=len(idxs)).tolist()
         return gamma
 
     def get_similarity_kernel(self):
@@ -184,12 +178,8 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
             Array of kernel values
         """
 
-        for batch_idx, (inputs, targets) in enumerate(self.trainloader):
-            if batch_idx == 0:
-                labels = targets
-            else:
-                tmp_target_i = targets
-                labels = torch.cat((labels, tmp_target_i), dim=0)
+        self.get_labels()
+        labels = self.trn_lbls
         kernel = np.zeros((labels.shape[0], labels.shape[0]))
         for target in np.unique(labels):
             x = np.where(labels == target)[0]
@@ -198,6 +188,42 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
                 kernel[i, x] = 1
         return kernel
 
+    def _maximize(self, kernel, n_samples):
+        """
+        Greedily selects `n_samples` elements of the similarity matrix `kernel` with the submodular function
+        `submod_func_type`. Facility location and graph cut with the 'naive', 'lazy', 'stochastic' and 'two-stage'
+        optimizers run on the torch greedy of :mod:`cords.selectionstrategies.helpers.submodular_greedy`, and the
+        other functions and optimizers on apricot.
+
+        Returns
+        ----------
+        greedyList: list
+            Rows of `kernel` of the selected elements, in the order of selection
+        """
+        if self.optimizer in ['naive', 'lazy', 'stochastic', 'two-stage']:
+            if self.submod_func_type == 'facility-location':
+                return facility_location_greedy(kernel, n_samples, optimizer=self.optimizer)[0].tolist()
+            elif self.submod_func_type == 'graph-cut':
+                return graph_cut_greedy(kernel, n_samples, optimizer=self.optimizer)[0].tolist()
+        if self.submod_func_type == 'facility-location':
+            fl = apricot.functions.facilityLocation.FacilityLocationSelection(random_state=0, metric='precomputed',
+                                                                              n_samples=n_samples,
+                                                                              optimizer=self.optimizer)
+        elif self.submod_func_type == 'graph-cut':
+            fl = apricot.functions.graphCut.GraphCutSelection(random_state=0, metric='precomputed',
+                                                              n_samples=n_samples, optimizer=self.optimizer)
+        elif self.submod_func_type == 'sum-redundancy':
+            fl = apricot.functions.sumRedundancy.SumRedundancySelection(random_state=0, metric='precomputed',
+                                                                        n_samples=n_samples,
+                                                                        optimizer=self.optimizer)
+        elif self.submod_func_type == 'saturated-coverage':
+            fl = apricot.functions.saturatedCoverage.SaturatedCoverageSelection(random_state=0,
+                                                                                metric='precomputed',
+                                                                                n_samples=n_samples,
+                                                                                optimizer=self.optimizer)
+        fl.fit(kernel)
+        return list(fl.ranking)
+
     def select(self, budget, model_params):
         """
         Data selection method using different submodular optimization
@@ -222,12 +248,8 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
             List containing gradients of datapoints present in greedySet
         """
 
-        for batch_idx, (inputs, targets) in enumerate(self.trainloader):
-            if batch_idx == 0:
-                x_trn, labels = inputs, targets
-            else:
-                tmp_inputs, tmp_target_i = inputs, targets
-                labels = torch.cat((labels, tmp_target_i), dim=0)
+        self.get_labels()
+        labels = self.trn_lbls
         per_class_bud = int(budget / self.num_classes)
         total_greedy_list = []
         gammas = []
@@ -235,66 +257,14 @@ class SubmodularSelectionStrategy(DataSelectionStrategy):
             for i in range(self.num_classes):
                 idxs = torch.where(labels == i)[0]
                 self.compute_score(model_params, idxs)
-                if self.submod_func_type == 'facility-location':
-                    fl = apricot.functions.facilityLocation.FacilityLocationSelection(random_state=0,
-                                                                                      metric='precomputed',
-                                                                                      n_samples=per_class_bud,
-                                                                                      optimizer=self.optimizer)
-                elif self.submod_func_type == 'graph-cut':
-                    fl = apricot.functions.graphCut.GraphCutSelection(random_state=0, metric='precomputed',
-                                                                      n_samples=per_class_bud, optimizer=self.optimizer)
-                elif self.submod_func_type == 'sum-redundancy':
-                    fl = apricot.functions.sumRedundancy.SumRedundancySelection(random_state=0, metric='precomputed',
-                                                                                n_samples=per_class_bud,
-                                                                                optimizer=self.optimizer)
-                elif self.submod_func_type == 'saturated-coverage':
-                    fl = apricot.functions.saturatedCoverage.SaturatedCoverageSelection(random_state=0,
-                                                                                        metric='precomputed',
-                                                                                        n_samples=per_class_bud,
-                                                                                        optimizer=self.optimizer)
-
-                sim_sub = fl.fit_transform(self.dist_mat)
-                greedyList = list(np.argmax(sim_sub, axis=1))
+                greedyList = self._maximize(self.dist_mat, per_class_bud)
                 gamma = self.compute_gamma(greedyList)
                 total_greedy_list.extend(idxs[greedyList])
                 gammas.extend(gamma)
 
         elif self.selection_type == 'Supervised':
-            for i in range(self.num_classes):
-                if i == 0:
-                    idxs = torch.where(labels == i)[0]
-                    N = len(idxs)
-                    self.compute_score(model_params, idxs)
-                    row = idxs.repeat_interleave(N)
-                    col = idxs.repeat(N)
-                    data = self.dist_mat.flatten()
-                else:
-                    idxs = torch.where(labels == i)[0]
-                    N = len(idxs)
-                    self.compute_score(model_params, idxs)
-                    row = torch.cat((row, idxs.repeat_interleave(N)), dim=0)
-                    col = torch.cat((col, idxs.repeat(N)), dim=0)
-                    data = np.concatenate([data, self.dist_mat.flatten()], axis=0)
-            sparse_simmat = csr_matrix((data, (row.numpy(), col.numpy())), shape=(self.N_trn, self.N_trn))
-            self.dist_mat = sparse_simmat
-            if self.submod_func_type == 'facility-location':
-                fl = apricot.functions.facilityLocation.FacilityLocationSelection(random_state=0, metric='precomputed',
-                                                                                  n_samples=per_class_bud,
-                                                                                  optimizer=self.optimizer)
-            elif self.submod_func_type == 'graph-cut':
-                fl = apricot.functions.graphCut.GraphCutSelection(random_state=0, metric='precomputed',
-                                                                  n_samples=per_class_bud, optimizer=self.optimizer)
-            elif self.submod_func_type == 'sum-redundancy':
-                fl = apricot.functions.sumRedundancy.SumRedundancySelection(random_state=0, metric='precomputed',
-                                                                            n_samples=per_class_bud,
-                                                                            optimizer=self.optimizer)
-            elif self.submod_func_type == 'saturated-coverage':
-                fl = apricot.functions.saturatedCoverage.SaturatedCoverageSelection(random_state=0,
-                                                                                    metric='precomputed',
-                                                                                    n_samples=per_class_bud,
-                                                                                    optimizer=self.optimizer)
-
-            sim_sub = fl.fit_transform(sparse_simmat)
-            total_greedy_list = list(np.array(np.argmax(sim_sub, axis=1)).reshape(-1))
+            idxs = torch.arange(self.N_trn)
+            self.compute_score(model_params, idxs)
+            total_greedy_list = self._maximize(self.dist_mat, per_class_bud)
             gammas = self.compute_gamma(total_greedy_list)
         return total_greedy_list, gammas
@@ -3,6 +3,7 @@ import torch, time, apricot, math
 from scipy.sparse import csr_matrix
 from .dataselectionstrategy import DataSelectionStrategy
 from torch.utils.data.sampler import SubsetRandomSampler
+from ..helpers import nearest_selected
 
 
 class CRAIGStrategy(DataSelectionStrategy):
@@ -190,18 +191,8 @@ class CRAIGStrategy(DataSelectionStrategy):
             Gradient values of the input indices
         """
 
-        if self.selection_type in ['PerClass', 'PerBatch']:
-            gamma = [0 for i in range(len(idxs))]
-            best = self.dist_mat[idxs]  # .to(self.device)
-            rep = np.argmax(best, axis=0)
-            for i in rep:
-                gamma[i] += 1
-        elif self.selection_type == 'Supervised':
-            gamma = [0 for i in range(len(idxs))]
-            best = self.dist_mat[idxs]  # .to(self.device)
-            rep = np.argmax(best, axis=0)
-            for i in range(rep.shape[1]):
-                gamma[rep[0, i]] += 1
+        rep, _ = nearest_selected(self.dist_mat, idxs)
+        gamma = np.bincount(rep[rep >= 0], minlength=len(idxs)).tolist()
         return gamma
 
     def get_similarity_kernel(self):
@@ -1,6 +1,7 @@
 import numpy as np
 import torch
 from torch.nn.functional import cross_entropy
+from ..helpers import GradientStore, LabelIndex
 
 
 class DataSelectionStrategy(object):
@@ -129,7 +130,8 @@ class DataSelectionStrategy(object):
 
     def get_labels(self, valid=False):
         """
-        Function that iterates over labeled or unlabeled data and returns target or hypothesized labels.
+        Function that iterates over unlabeled data and returns its hypothesized labels. The labels of the
+        labeled set are read from its :class:`LabelIndex`.
 
         Parameters
         -----------
@@ -147,12 +149,7 @@ class DataSelectionStrategy(object):
         self.trn_lbls = self.trn_lbls.view(-1)
 
         if valid:
-            for batch_idx, (inputs, targets) in enumerate(self.valloader):
-                if batch_idx == 0:
-                    self.val_lbls = targets.view(-1, 1)
-                else:
-                    self.val_lbls = torch.cat((self.val_lbls, targets.view(-1, 1)), dim=0)
-            self.val_lbls = self.val_lbls.view(-1)
+            self.val_lbls = LabelIndex.from_loader(self.valloader).labels
         self.logger.debug("Get labels function finished")
 
     def compute_gradients(self, valid=False, perBatch=False, perClass=False, store_t=False):
@@ -212,6 +209,8 @@ class DataSelectionStrategy(object):
             targets = []
             masks = []
 
+        store = GradientStore(GradientStore.num_rows(trainloader, perBatch), self.num_classes, embDim,
+                              self.linear_layer, self.device, perBatch=perBatch)
         for batch_idx, (ul_weak_aug, ul_strong_aug, _) in enumerate(trainloader):
             ul_weak_aug, ul_strong_aug = ul_weak_aug.to(self.device), ul_strong_aug.to(self.device)
             if store_t:
@@ -221,75 +220,122 @@ class DataSelectionStrategy(object):
             else:
                 loss, out, l1, _, _ = self.ssl_loss(ul_weak_data=ul_weak_aug, ul_strong_data=ul_strong_aug)
             loss = loss.sum()
-            if batch_idx == 0:
-                l0_grads = torch.autograd.grad(loss, out)[0]
-                if self.linear_layer:
-                    l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                    l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                if perBatch:
-                    l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                    if self.linear_layer:
-                        l1_grads = l1_grads.mean(dim=0).view(1, -1)
-            else:
-                batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                if self.linear_layer:
-                    batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                    batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-                if perBatch:
-                    batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
-                    if self.linear_layer:
-                        batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
-                l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                if self.linear_layer:
-                    l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
+            l0_grads = torch.autograd.grad(loss, out)[0]
+            store.append(l0_grads, l1)
 
         torch.cuda.empty_cache()
         if store_t:
             self.weak_targets = targets
             self.weak_masks = masks
-        
-        if self.linear_layer:
-            self.grads_per_elem = torch.cat((l0_grads, l1_grads), dim=1)
-        else:
-            self.grads_per_elem = l0_grads
-            
+        self.grads_per_elem = store.gradients()
+
         if valid:
+            store = GradientStore(GradientStore.num_rows(valloader, perBatch), self.num_classes, embDim,
+                                  self.linear_layer, self.device, perBatch=perBatch)
             for batch_idx, (inputs, targets) in enumerate(valloader):
                 inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-                if batch_idx == 0:
-                    out, l1 = self.model(inputs, last=True, freeze=True)
-                    loss = cross_entropy(out, targets, reduction='none').sum()
-                    l0_grads = torch.autograd.grad(loss, out)[0]
-                    if self.linear_layer:
-                        l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                        l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                    if perBatch:
-                        l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                        if self.linear_layer:
-                            l1_grads = l1_grads.mean(dim=0).view(1, -1)
-                else:
-                    out, l1 = self.model(inputs, last=True, freeze=True)
-                    loss = cross_entropy(out, targets, reduction='none').sum()
-                    batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                    if self.linear_layer:
-                        batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                        batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-
-                    if perBatch:
-                        batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
-                        if self.linear_layer:
-                            batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
-                    l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                    if self.linear_layer:
-                        l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
+                out, l1 = self.model(inputs, last=True, freeze=True)
+                loss = cross_entropy(out, targets, reduction='none').sum()
+                l0_grads = torch.autograd.grad(loss, out)[0]
+                store.append(l0_grads, l1)
             torch.cuda.empty_cache()
-            if self.linear_layer:
-                self.val_grads_per_elem = torch.cat((l0_grads, l1_grads), dim=1)
-            else:
-                self.val_grads_per_elem = l0_grads
+            self.val_grads_per_elem = store.gradients()
         self.logger.debug("Per-sample gradient computation Finished")
 
-        
+    def compute_class_gradients(self, valid=False, store_t=False):
+        """
+        Computes the gradients of every unlabeled (and labeled) element in a single pass over each loader and
+        records the hypothesized label of every unlabeled element and the label of every labeled element.
+        PerClass selection then takes the gradients of each class with :func:`set_class_gradients` instead of
+        running a separate pass over a per-class dataloader.
+
+        Parameters
+        ----------
+        valid: bool
+            if True, the function also computes the validation gradients
+        store_t: bool
+            if True, the function also keeps the hypothesized weak augmentation targets and masks, and the
+            outputs and penultimate layer embeddings of the unlabeled set
+        """
+        self.logger.debug("Per-class gradient computation Initiated")
+        embDim = self.model.get_embedding_dim()
+        trn_lbls = []
+        targets = []
+        masks = []
+        outs = []
+        l1s = []
+        store = GradientStore(GradientStore.num_rows(self.trainloader), self.num_classes, embDim,
+                              self.linear_layer, self.device)
+        for batch_idx, (ul_weak_aug, ul_strong_aug, _) in enumerate(self.trainloader):
+            ul_weak_aug, ul_strong_aug = ul_weak_aug.to(self.device), ul_strong_aug.to(self.device)
+            loss, out, l1, t, m = self.ssl_loss(ul_weak_data=ul_weak_aug, ul_strong_data=ul_strong_aug)
+            if t.ndim == 1:
+                trn_lbls.append(t)
+            else:
+                trn_lbls.append(t.argmax(dim=1))
+            if store_t:
+                targets.append(t)
+                masks.append(m)
+                outs.append(out.detach())
+                l1s.append(l1.detach())
+            loss = loss.sum()
+            l0_grads = torch.autograd.grad(loss, out)[0]
+            store.append(l0_grads, l1)
+
+        torch.cuda.empty_cache()
+        self.trn_lbls = torch.cat(trn_lbls, dim=0)
+        self.all_grads_per_elem = store.gradients()
+        if store_t:
+            self.all_weak_targets = torch.cat(targets, dim=0)
+            self.all_weak_masks = torch.cat(masks, dim=0)
+            self.all_strong_out = torch.cat(outs, dim=0)
+            self.all_strong_l1 = torch.cat(l1s, dim=0)
+
+        if valid:
+            val_lbls = []
+            store = GradientStore(GradientStore.num_rows(self.valloader), self.num_classes, embDim,
+                                  self.linear_layer, self.device)
+            for batch_idx, (inputs, targets) in enumerate(self.valloader):
+                val_lbls.append(targets.view(-1))
+                inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
+                out, l1 = self.model(inputs, last=True, freeze=True)
+                loss = cross_entropy(out, targets, reduction='none').sum()
+                l0_grads = torch.autograd.grad(loss, out)[0]
+                store.append(l0_grads, l1)
+            torch.cuda.empty_cache()
+            self.val_lbls = torch.cat(val_lbls, dim=0)
+            self.all_val_grads_per_elem = store.gradients()
+        self.logger.debug("Per-class gradient computation Finished")
+
+    def set_class_gradients(self, c, valid=False, store_t=False):
+        """
+        Sets `grads_per_elem` (and `val_grads_per_elem`) to the gradients of the elements of class `c`, taken
+        from the gradients computed by :func:`compute_class_gradients`.
+
+        Parameters
+        ----------
+        c: int
+            Class index
+        valid: bool
+            if True, the validation gradients of class `c` are also set
+        store_t: bool
+            if True, `weak_targets` and `weak_masks` are also set to the targets and masks of class `c`
+
+        Returns
+        ----------
+        trn_subset_idx: list
+            Indices of the unlabeled elements of class `c`
+        """
+        trn_subset_idx = torch.where(self.trn_lbls == c)[0]
+        self.grads_per_elem = self.all_grads_per_elem[trn_subset_idx]
+        if store_t:
+            self.weak_targets = [self.all_weak_targets[trn_subset_idx]]
+            self.weak_masks = [self.all_weak_masks[trn_subset_idx]]
+        if valid:
+            val_subset_idx = torch.where(self.val_lbls == c)[0]
+            self.val_grads_per_elem = self.all_val_grads_per_elem[val_subset_idx]
+        return trn_subset_idx.tolist()
+
     def update_model(self, model_params, tea_model_params):
         """
         Update the models parameters
@@ -4,7 +4,6 @@ import torch
 import numpy as np
 from .dataselectionstrategy import DataSelectionStrategy
 from ..helpers import OrthogonalMP_REG_Parallel, OrthogonalMP_REG, OrthogonalMP_REG_Parallel_V1
-from torch.utils.data import Subset, DataLoader
 
 
 class GradMatchStrategy(DataSelectionStrategy):
@@ -136,21 +135,11 @@ class GradMatchStrategy(DataSelectionStrategy):
         omp_start_time = time.time()
         self.update_model(model_params, tea_model_params)
         if self.selection_type == 'PerClass':
-            self.get_labels(valid=self.valid)
+            self.compute_class_gradients(valid=self.valid)
             idxs = []
             gammas = []
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                          shuffle=False, pin_memory=True)
-                if self.valid:
-                    val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                    val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                    self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                    shuffle=False, pin_memory=True)
-
-                self.compute_gradients(self.valid, perBatch=False, perClass=True)
+                trn_subset_idx = self.set_class_gradients(i, valid=self.valid)
                 trn_gradients = self.grads_per_elem
                 if self.valid:
                     sum_val_grad = torch.sum(self.val_grads_per_elem, dim=0)
@@ -179,21 +168,12 @@ class GradMatchStrategy(DataSelectionStrategy):
                 gammas.extend(list(gammas_temp[i] * np.ones(len(tmp))))
 
         elif self.selection_type == 'PerClassPerGradient':
-            self.get_labels(valid=self.valid)
+            self.compute_class_gradients(valid=self.valid)
             idxs = []
             gammas = []
             embDim = self.model.get_embedding_dim()
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                          shuffle=False, pin_memory=True)
-                if self.valid:
-                    val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                    val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                    self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                                    shuffle=False, pin_memory=True)
-                self.compute_gradients(self.valid, perBatch=False, perClass=True)
+                trn_subset_idx = self.set_class_gradients(i, valid=self.valid)
                 trn_gradients = self.grads_per_elem
                 tmp_gradients = trn_gradients[:, i].view(-1, 1)
                 tmp1_gradients = trn_gradients[:,
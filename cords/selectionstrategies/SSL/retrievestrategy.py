@@ -4,7 +4,6 @@ import time
 import torch
 import torch.nn.functional as F
 from .dataselectionstrategy import DataSelectionStrategy
-from torch.utils.data import Subset, DataLoader
 import numpy as np
 
 
@@ -113,75 +112,14 @@ class RETRIEVEStrategy(DataSelectionStrategy):
             Gradient initialization (default: False)
         """
         self.model.zero_grad()
-        if self.selection_type == 'PerClass':
-            valloader = self.pcvalloader
-        else:
-            valloader = self.valloader
-
-        if self.selection_type == 'PerClass':
-            trainloader = self.pctrainloader
-        else:
-            trainloader = self.trainloader
-            
         embDim = self.model.get_embedding_dim()
         loss_name = self.loss.__class__.__name__
         if self.valid:
             if first_init:
-                for batch_idx, (inputs, targets) in enumerate(valloader):
-                    inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
-                    if loss_name == 'MeanSquared':
-                        tmp_targets = torch.zeros(len(inputs), self.num_classes, device=self.device)
-                        tmp_targets[torch.arange(len(inputs)), targets] = 1
-                        targets = tmp_targets
-                    if batch_idx == 0:
-                        out, l1 = self.model(inputs, last=True, freeze=True)
-                        if loss_name == 'MeanSquared':
-                            temp_out = F.softmax(out, dim=1)
-                            loss = F.mse_loss(temp_out, targets, reduction='none').sum()
-                        else:
-                            loss = F.cross_entropy(out, targets, reduction='none').sum()
-                        l0_grads = torch.autograd.grad(loss, out)[0]
-                        if self.linear_layer:
-                            l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                            l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                        self.init_out = out
-                        self.init_l1 = l1                        
-                        if self.selection_type == 'PerBatch':
-                            l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                            if self.linear_layer:
-                                l1_grads = l1_grads.mean(dim=0).view(1, -1)                        
-                        if loss_name == 'MeanSquared':
-                            self.y_val = targets
-                        else:
-                            self.y_val = targets.view(-1, 1)
-                    else:
-                        out, l1 = self.model(inputs, last=True, freeze=True)
-                        
-                        if loss_name == 'MeanSquared':
-                            temp_out = F.softmax(out, dim=1)
-                            loss = F.mse_loss(temp_out, targets, reduction='none').sum()
-                        else:
-                            loss = F.cross_entropy(out, targets, reduction='none').sum()
-                        
-                        batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                        if self.linear_layer:
-                            batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                            batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-                        
-                        if self.selection_type == 'PerBatch':
-                            batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
-                            if self.linear_layer:
-                                batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
-                        
-                        l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                        if self.linear_layer:
-                            l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
-                        self.init_out = torch.cat((self.init_out, out), dim=0)
-                        self.init_l1 = torch.cat((self.init_l1, l1), dim=0)
-                        if loss_name == 'MeanSquared':
-                            self.y_val = torch.cat((self.y_val, targets), dim=0)
-                        else:
-                            self.y_val = torch.cat((self.y_val, targets.view(-1, 1)), dim=0)
+                if self.selection_type == 'PerClass':
+                    l0_grads, l1_grads = self.val_l0_grads, self.val_l1_grads
+                else:
+                    l0_grads, l1_grads = self._compute_val_gradients(perBatch=self.selection_type == 'PerBatch')
             elif grads_currX is not None:
                 out_vec = self.init_out - (
                         self.eta * grads_currX[0][0:self.num_classes].view(1, -1).expand(self.init_out.shape[0], -1))
@@ -218,48 +156,60 @@ class RETRIEVEStrategy(DataSelectionStrategy):
         else:
             if first_init:
                 self.y_val = torch.cat(self.weak_targets, dim=0)
-                for batch_idx, (ul_weak_aug, ul_strong_aug, _) in enumerate(trainloader):
-                    ul_weak_aug, ul_strong_aug = ul_weak_aug.to(self.device), ul_strong_aug.to(self.device)
-                    if batch_idx == 0:
-                        out, l1 = self.model(ul_strong_aug, last=True, freeze=True)
-                        if loss_name == 'MeanSquared':
-                            temp_out = F.softmax(out, dim=1)
-                            loss = self.loss(temp_out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
-                        else:
-                            loss = self.loss(out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
-                        l0_grads = torch.autograd.grad(loss, out)[0]
-                        if self.linear_layer:
-                            l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
-                            l1_grads = l0_expand * l1.repeat(1, self.num_classes)
-                        self.init_out = out
-                        self.init_l1 = l1
-                        if self.selection_type == 'PerBatch':
-                            l0_grads = l0_grads.mean(dim=0).view(1, -1)
-                            if self.linear_layer:
-                                l1_grads = l1_grads.mean(dim=0).view(1, -1)                        
-                        
+                if self.selection_type == 'PerClass':
+                    out = self.init_out.requires_grad_()
+                    masks = torch.cat(self.weak_masks, dim=0)
+                    if loss_name == 'MeanSquared':
+                        loss = self.loss(F.softmax(out, dim=1), self.y_val, masks).sum()
                     else:
-                        out, l1 = self.model(ul_strong_aug, last=True, freeze=True)
-                        if loss_name == 'MeanSquared':
-                            temp_out = F.softmax(out, dim=1)
-                            loss = self.loss(temp_out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
+                        loss = self.loss(out, self.y_val, masks).sum()
+                    l0_grads = torch.autograd.grad(loss, out)[0]
+                    if self.linear_layer:
+                        l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
+                        l1_grads = l0_expand * self.init_l1.repeat(1, self.num_classes)
+                else:
+                    for batch_idx, (ul_weak_aug, ul_strong_aug, _) in enumerate(self.trainloader):
+                        ul_weak_aug, ul_strong_aug = ul_weak_aug.to(self.device), ul_strong_aug.to(self.device)
+                        if batch_idx == 0:
+                            out, l1 = self.model(ul_strong_aug, last=True, freeze=True)
+                            if loss_name == 'MeanSquared':
+                                temp_out = F.softmax(out, dim=1)
+                                loss = self.loss(temp_out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
+                            else:
+                                loss = self.loss(out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
+                            l0_grads = torch.autograd.grad(loss, out)[0]
+                            if self.linear_layer:
+                                l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
+                                l1_grads = l0_expand * l1.repeat(1, self.num_classes)
+                            self.init_out = out
+                            self.init_l1 = l1
+                            if self.selection_type == 'PerBatch':
+                                l0_grads = l0_grads.mean(dim=0).view(1, -1)
+                                if self.linear_layer:
+                                    l1_grads = l1_grads.mean(dim=0).view(1, -1)                        
+
                         else:
-                            loss = self.loss(out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
-                        batch_l0_grads = torch.autograd.grad(loss, out)[0]
-                        if self.linear_layer:
-                            batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
-                            batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
-                        
-                        if self.selection_type == 'PerBatch':
-                            batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
+                            out, l1 = self.model(ul_strong_aug, last=True, freeze=True)
+                            if loss_name == 'MeanSquared':
+                                temp_out = F.softmax(out, dim=1)
+                                loss = self.loss(temp_out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
+                            else:
+                                loss = self.loss(out, self.weak_targets[batch_idx], self.weak_masks[batch_idx]).sum()
+                            batch_l0_grads = torch.autograd.grad(loss, out)[0]
                             if self.linear_layer:
-                                batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
+                                batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
+                                batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
 
-                        l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
-                        if self.linear_layer:
-                            l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
-                        self.init_out = torch.cat((self.init_out, out), dim=0)
-                        self.init_l1 = torch.cat((self.init_l1, l1), dim=0)
+                            if self.selection_type == 'PerBatch':
+                                batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
+                                if self.linear_layer:
+                                    batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
+
+                            l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
+                            if self.linear_layer:
+                                l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
+                            self.init_out = torch.cat((self.init_out, out), dim=0)
+                            self.init_l1 = torch.cat((self.init_l1, l1), dim=0)
             elif grads_currX is not None:
                 out_vec = self.init_out - (
                             self.eta * grads_currX[0][0:self.num_classes].view(1, -1).expand(self.init_out.shape[0],-1))
@@ -298,6 +248,86 @@ class RETRIEVEStrategy(DataSelectionStrategy):
             else:
                 self.grads_val_curr = torch.mean(l0_grads, dim=0).view(-1, 1)
 
+    def _compute_val_gradients(self, perBatch=False):
+        """
+        Computes the gradients of the labeled set and keeps its model outputs, penultimate layer embeddings,
+        targets and labels, from which the validation gradients are updated during the greedy selection.
+
+        Parameters
+        ----------
+        perBatch: bool
+            if True, the function computes the gradients of each mini-batch
+
+        Returns
+        ----------
+        l0_grads: Tensor
+            Gradients with respect to the last layer biases
+        l1_grads: Tensor
+            Gradients with respect to the last layer weights, None if `linear_layer` is False
+        """
+        embDim = self.model.get_embedding_dim()
+        loss_name = self.loss.__class__.__name__
+        l1_grads = None
+        val_lbls = []
+        for batch_idx, (inputs, targets) in enumerate(self.valloader):
+            val_lbls.append(targets.view(-1))
+            inputs, targets = inputs.to(self.device), targets.to(self.device, non_blocking=True)
+            if loss_name == 'MeanSquared':
+                tmp_targets = torch.zeros(len(inputs), self.num_classes, device=self.device)
+                tmp_targets[torch.arange(len(inputs)), targets] = 1
+                targets = tmp_targets
+            if batch_idx == 0:
+                out, l1 = self.model(inputs, last=True, freeze=True)
+                if loss_name == 'MeanSquared':
+                    temp_out = F.softmax(out, dim=1)
+                    loss = F.mse_loss(temp_out, targets, reduction='none').sum()
+                else:
+                    loss = F.cross_entropy(out, targets, reduction='none').sum()
+                l0_grads = torch.autograd.grad(loss, out)[0]
+                if self.linear_layer:
+                    l0_expand = torch.repeat_interleave(l0_grads, embDim, dim=1)
+                    l1_grads = l0_expand * l1.repeat(1, self.num_classes)
+                self.init_out = out
+                self.init_l1 = l1                        
+                if perBatch:
+                    l0_grads = l0_grads.mean(dim=0).view(1, -1)
+                    if self.linear_layer:
+                        l1_grads = l1_grads.mean(dim=0).view(1, -1)                        
+                if loss_name == 'MeanSquared':
+                    self.y_val = targets
+                else:
+                    self.y_val = targets.view(-1, 1)
+            else:
+                out, l1 = self.model(inputs, last=True, freeze=True)
+
+                if loss_name == 'MeanSquared':
+                    temp_out = F.softmax(out, dim=1)
+                    loss = F.mse_loss(temp_out, targets, reduction='none').sum()
+                else:
+                    loss = F.cross_entropy(out, targets, reduction='none').sum()
+
+                batch_l0_grads = torch.autograd.grad(loss, out)[0]
+                if self.linear_layer:
+                    batch_l0_expand = torch.repeat_interleave(batch_l0_grads, embDim, dim=1)
+                    batch_l1_grads = batch_l0_expand * l1.repeat(1, self.num_classes)
+
+                if perBatch:
+                    batch_l0_grads = batch_l0_grads.mean(dim=0).view(1, -1)
+                    if self.linear_layer:
+                        batch_l1_grads = batch_l1_grads.mean(dim=0).view(1, -1)
+
+                l0_grads = torch.cat((l0_grads, batch_l0_grads), dim=0)
+                if self.linear_layer:
+                    l1_grads = torch.cat((l1_grads, batch_l1_grads), dim=0)
+                self.init_out = torch.cat((self.init_out, out), dim=0)
+                self.init_l1 = torch.cat((self.init_l1, l1), dim=0)
+                if loss_name == 'MeanSquared':
+                    self.y_val = torch.cat((self.y_val, targets), dim=0)
+                else:
+                    self.y_val = torch.cat((self.y_val, targets.view(-1, 1)), dim=0)
+        self.val_lbls = torch.cat(val_lbls, dim=0)
+        return l0_grads, l1_grads
+
     def eval_taylor_modular(self, grads):
         """
         Evaluate gradients
@@ -436,24 +466,24 @@ class RETRIEVEStrategy(DataSelectionStrategy):
         glister_start_time = time.time() # naive greedy start time
         self.update_model(model_params, tea_model_params)
         if self.selection_type == 'PerClass':
-            self.get_labels(valid=True)
+            self.compute_class_gradients(store_t=not self.valid)
+            if self.valid:
+                all_l0_grads, all_l1_grads = self._compute_val_gradients()
+                all_init_out, all_init_l1, all_y_val = self.init_out, self.init_l1, self.y_val
             idxs = []
             gammas = []
             for i in range(self.num_classes):
-                trn_subset_idx = torch.where(self.trn_lbls == i)[0].tolist()
-                trn_data_sub = Subset(self.trainloader.dataset, trn_subset_idx)
-                self.pctrainloader = DataLoader(trn_data_sub, batch_size=self.trainloader.batch_size,
-                                                shuffle=False, pin_memory=True)
-                
-                val_subset_idx = torch.where(self.val_lbls == i)[0].tolist()
-                val_data_sub = Subset(self.valloader.dataset, val_subset_idx)
-                self.pcvalloader = DataLoader(val_data_sub, batch_size=self.trainloader.batch_size,
-                                            shuffle=False, pin_memory=True)
+                trn_subset_idx = self.set_class_gradients(i, store_t=not self.valid)
                 if self.valid:
-                    self.compute_gradients(store_t=False, perClass=True)
+                    val_subset_idx = torch.where(self.val_lbls == i)[0]
+                    self.init_out = all_init_out[val_subset_idx]
+                    self.init_l1 = all_init_l1[val_subset_idx]
+                    self.y_val = all_y_val[val_subset_idx]
+                    self.val_l0_grads = all_l0_grads[val_subset_idx]
+                    self.val_l1_grads = None if all_l1_grads is None else all_l1_grads[val_subset_idx]
                 else:
-                    self.compute_gradients(store_t=True, perClass=True)
-                
+                    self.init_out = self.all_strong_out[trn_subset_idx]
+                    self.init_l1 = self.all_strong_l1[trn_subset_idx]
                 self._update_grads_val(first_init=True)
                 idxs_temp, gammas_temp = self.greedy_algo(math.ceil(budget * len(trn_subset_idx) / self.N_trn))
                 idxs.extend(list(np.array(trn_subset_idx)[idxs_temp]))
@@ -3,4 +3,27 @@ from .omp_solvers import OrthogonalMP_REG_Parallel_V1
 from .omp_solvers import OrthogonalMP_REG
 from .omp_solvers import OrthogonalMP_REG_NNLS_Parallel
 from .omp_solvers import OrthogonalMP_REG_NNLS
+from .omp_solvers import NonnegativeLS
+from .omp_solvers import OrthogonalMP_REG_Cholesky
+from .omp_solvers import OrthogonalMP_REG_Batched
 from .optimalWeights import OptimalWeights
+from .gradient_store import GradientStore
+from .gradient_store import FactoredGradientStore
+from .gradient_store import MemmapGradientStore
+from .factored_gradients import FactoredGradients
+from .memmap_gradients import MemmapGradients
+from .gradient_sketch import GradientSketch
+from .label_index import LabelIndex
+from .pairwise_distances import pairwise_distances
+from .pairwise_distances import similarity_kernel
+from .pairwise_distances import block_similarity_kernel
+from .pairwise_distances import nearest
+from .nearest_selected import nearest_selected
+from .knn_graph import knn_graph
+from .partitions import partition_indices
+from .submodular_greedy import facility_location_greedy
+from .submodular_greedy import graph_cut_greedy
+from .sieve_streaming import SieveStreaming
+from .kernel_cache import KernelCache
+from .kernel_cache import fingerprint
+from .kernel_cache import dataset_fingerprint
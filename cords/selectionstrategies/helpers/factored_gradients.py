@@ -0,0 +1,155 @@
+import torch
+
+
+class FactoredGradients(object):
+    """
+    Factored representation of the last layer gradients of a set of elements.
+
+    With `linear_layer` set to True, the last layer gradient of an element is the concatenation of the bias gradient
+    :math:`a \\in \\mathbb{R}^C` and the weight gradient :math:`a \\otimes b`, where :math:`b \\in \\mathbb{R}^D` is
+    the penultimate layer embedding. Up to a permutation of its columns, this is the outer product
+    :math:`a \\otimes [1, b]`, so the gradient of every element is fully described by `l0` (N x C) and `l1` (N x D).
+    All the operations needed by the selection algorithms are computed through the identity
+
+    .. math::
+        \\langle a \\otimes b, c \\otimes d \\rangle = \\langle a, c \\rangle \\langle b, d \\rangle
+
+    which never materializes the N x (C + C * D) gradient matrix. Inner products, norms and Gram blocks between
+    elements cost :math:`O(C + D)` instead of :math:`O(C \\cdot D)`.
+
+    Dense vectors (e.g., a summed validation gradient) always use the layout of the dense gradient matrix, i.e.,
+    the :math:`C` bias gradients followed by the :math:`C \\cdot D` weight gradients, so results of this class can be
+    mixed freely with dense gradients.
+
+    Parameters
+    ----------
+    l0: Tensor
+        Gradients of the loss with respect to the model outputs of shape (N, C)
+    l1: Tensor, optional
+        Penultimate layer embeddings of shape (N, D). If None, only the bias gradients are represented
+    transposed: bool, optional
+        If True, the object stands for the transposed (C + C * D, N) matrix, which is the orientation of the design
+        matrix expected by the OMP solvers (default: False)
+    """
+
+    def __init__(self, l0, l1=None, transposed=False):
+        """
+        Constructor method
+        """
+        self.l0 = l0
+        self.l1 = l1
+        self.transposed = transposed
+        self.num_classes = l0.shape[1]
+        self.embDim = 0 if l1 is None else l1.shape[1]
+        ones = torch.ones((l0.shape[0], 1), device=l0.device, dtype=l0.dtype)
+        if l1 is None:
+            self.right = ones
+        else:
+            self.right = torch.cat((ones, l1), dim=1)
+
+    @property
+    def shape(self):
+        shape = (self.l0.shape[0], self.num_classes * (1 + self.embDim))
+        if self.transposed:
+            shape = shape[::-1]
+        return torch.Size(shape)
+
+    @property
+    def device(self):
+        return self.l0.device
+
+    def __len__(self):
+        return self.l0.shape[0]
+
+    def __getitem__(self, idxs):
+        """
+        Returns the factored gradients of the elements in `idxs`.
+        """
+        if isinstance(idxs, int):
+            idxs = [idxs]
+        l1 = None if self.l1 is None else self.l1[idxs]
+        return FactoredGradients(self.l0[idxs], l1)
+
+    def t(self):
+        """
+        Returns the transposed view of the gradients. The factors are shared, not copied.
+        """
+        return FactoredGradients(self.l0, self.l1, transposed=not self.transposed)
+
+    def class_gradients(self, c):
+        """
+        Returns the gradients with respect to the bias and the weights of the output unit of class `c` only,
+        laid out as in the dense matrix ``[l0[:, c], l1_grads[:, c * D:(c + 1) * D]]``.
+        """
+        return FactoredGradients(self.l0[:, c].view(-1, 1), self.l1)
+
+    def to_matrix(self, v):
+        """
+        Reshapes a dense gradient vector of length C + C * D into its (C, D + 1) matrix form.
+        """
+        return torch.cat((v[:self.num_classes].view(-1, 1),
+                          v[self.num_classes:].view(self.num_classes, self.embDim)), dim=1)
+
+    def from_matrix(self, m):
+        """
+        Flattens a (C, D + 1) matrix into a dense gradient vector of length C + C * D.
+        """
+        return torch.cat((m[:, 0], m[:, 1:].reshape(-1)))
+
+    def dense(self):
+        """
+        Materializes the dense (N, C + C * D) gradient matrix.
+        """
+        if self.l1 is None:
+            dense = self.l0
+        else:
+            l0_expand = torch.repeat_interleave(self.l0, self.embDim, dim=1)
+            dense = torch.cat((self.l0, l0_expand * self.l1.repeat(1, self.num_classes)), dim=1)
+        if self.transposed:
+            return dense.t()
+        return dense
+
+    def sum(self, dim=0):
+        """
+        Sum of the gradients of all the elements as a dense vector of length C + C * D.
+        """
+        if dim != 0:
+            raise ValueError("FactoredGradients can only be reduced along the element dimension (dim=0)")
+        return self.from_matrix(torch.matmul(self.l0.t(), self.right))
+
+    def weighted_sum(self, w):
+        """
+        Sum of the gradients of all the elements weighted by `w` (of length N), as a dense vector of
+        length C + C * D.
+        """
+        return self.from_matrix(torch.matmul(self.l0.t(), w.view(-1, 1) * self.right))
+
+    def mean(self, dim=0):
+        """
+        Mean of the gradients of all the elements as a dense vector of length C + C * D.
+        """
+        return self.sum(dim=dim) / len(self)
+
+    def matmul(self, v):
+        """
+        Product of the (N, C + C * D) gradient matrix with a dense vector, or with a matrix of shape
+        (C + C * D, k) whose columns are dense vectors.
+        """
+        if v.dim() == 1:
+            return (torch.matmul(self.l0, self.to_matrix(v)) * self.right).sum(dim=1)
+        return torch.stack([self.matmul(v[:, j]) for j in range(v.shape[1])], dim=1)
+
+    def inner(self, other=None):
+        """
+        Matrix of inner products between the gradients of this set (rows) and of `other` (columns).
+        If `other` is None, the Gram matrix of this set is returned.
+        """
+        if other is None:
+            other = self
+        return torch.matmul(self.l0, other.l0.t()) * torch.matmul(self.right, other.right.t())
+
+    def sq_norms(self):
+        """
+        Squared euclidean norm of the gradient of every element.
+        """
+        return (self.l0 ** 2).sum(dim=1) * (self.right ** 2).sum(dim=1)
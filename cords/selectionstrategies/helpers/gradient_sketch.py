@@ -0,0 +1,98 @@
+import math
+import torch
+
+
+class GradientSketch(object):
+    """
+    Seeded random projection of gradients onto a fixed `sketch_dim` dimensional subspace.
+
+    The projection is drawn once from `seed` and reused for every call, so that the sketches of different
+    mini-batches, of the training and validation sets, and of different selection rounds are comparable.
+    All the projections preserve inner products and norms in expectation (Johnson-Lindenstrauss), hence
+    inner product, distance and OMP based selection can run on the sketches directly.
+
+    Parameters
+    ----------
+    input_dim: int
+        Dimension of the gradients to be sketched
+    sketch_dim: int
+        Dimension of the sketches
+    sketch_type: str, optional
+        Type of random projection (default: 'gaussian') -
+        - 'gaussian': Dense projection with i.i.d. :math:`\\mathcal{N}(0, 1/k)` entries.
+        - 'sparse': Sparse JL projection where every input coordinate is hashed `nnz_per_col` times to output
+          coordinates with random signs, as in a count sketch.
+        - 'srht': Subsampled randomized Hadamard transform, computed with a fast Walsh-Hadamard transform
+          in :math:`O(d \\log d)` per row.
+    seed: int, optional
+        Seed of the random projection (default: 0)
+    device: str, optional
+        The device on which the projection is applied - cpu | cuda (default: 'cpu')
+    nnz_per_col: int, optional
+        Number of nonzeros per input coordinate of the sparse JL projection (default: 8)
+    """
+
+    def __init__(self, input_dim, sketch_dim, sketch_type='gaussian', seed=0, device='cpu', nnz_per_col=8):
+        """
+        Constructor method
+        """
+        self.input_dim = input_dim
+        self.sketch_dim = sketch_dim
+        self.sketch_type = sketch_type
+        self.seed = seed
+        self.device = device
+        g = torch.Generator().manual_seed(seed)
+        if sketch_type == 'gaussian':
+            self.proj = (torch.randn(input_dim, sketch_dim, generator=g) / math.sqrt(sketch_dim)).to(device)
+        elif sketch_type == 'sparse':
+            # s independent hashes of every input coordinate, so the projection takes O(s input_dim) memory
+            s = min(nnz_per_col, sketch_dim)
+            self.buckets = torch.randint(sketch_dim, (s, input_dim), generator=g).to(device)
+            self.signs = ((torch.randint(2, (s, input_dim), generator=g) * 2 - 1).float() / math.sqrt(s)).to(device)
+        elif sketch_type == 'srht':
+            self.padded_dim = 1 << max(0, (input_dim - 1).bit_length())
+            if sketch_dim > self.padded_dim:
+                raise ValueError("sketch_dim can not exceed the padded gradient dimension for SRHT")
+            self.signs = (torch.randint(0, 2, (input_dim,), generator=g).float() * 2 - 1).to(device)
+            self.rows = torch.randperm(self.padded_dim, generator=g)[:sketch_dim].to(device)
+        else:
+            raise ValueError("sketch_type must be one of 'gaussian', 'sparse' or 'srht'")
+
+    @staticmethod
+    def _fwht(x):
+        """
+        Unnormalized fast Walsh-Hadamard transform along the last dimension, whose size must be a power of two.
+        """
+        b, n = x.shape
+        h = 1
+        while h < n:
+            x = x.view(b, n // (2 * h), 2, h)
+            x = torch.stack((x[:, :, 0, :] + x[:, :, 1, :], x[:, :, 0, :] - x[:, :, 1, :]), dim=2)
+            h *= 2
+        return x.view(b, n)
+
+    def project(self, grads):
+        """
+        Projects the rows of `grads`.
+
+        Parameters
+        ----------
+        grads: Tensor
+            Gradients of shape (batch_size, input_dim)
+
+        Returns
+        ----------
+        sketches: Tensor
+            Sketches of shape (batch_size, sketch_dim)
+        """
+        if self.sketch_type == 'gaussian':
+            return torch.matmul(grads, self.proj)
+        elif self.sketch_type == 'sparse':
+            sketches = torch.zeros((grads.shape[0], self.sketch_dim), device=grads.device, dtype=grads.dtype)
+            for buckets, signs in zip(self.buckets, self.signs):
+                sketches.index_add_(1, buckets, grads * signs.to(grads.dtype))
+            return sketches
+        else:
+            padded = torch.zeros((grads.shape[0], self.padded_dim), device=grads.device, dtype=grads.dtype)
+            padded[:, :self.input_dim] = grads * self.signs
+            return self._fwht(padded)[:, self.rows] / math.sqrt(self.sketch_dim)
@@ -0,0 +1,271 @@
+import numpy as np
+import torch
+from .factored_gradients import FactoredGradients
+from .memmap_gradients import MemmapGradients, memmap_array, release_pages
+
+
+class GradientStore(object):
+    """
+    Preallocated store for the last layer gradients of every element (or every mini-batch) of a dataloader.
+
+    The store is sized once from the number of rows that the dataloader is going to produce and the width
+    of the last layer gradient, i.e., :math:`num\\_classes` bias gradients followed by :math:`embDim * num\\_classes`
+    weight gradients when `linear_layer` is True. Every mini-batch is then written in place into its row block,
+    which keeps the gradient computation linear in the number of elements and avoids the extra copy of the
+    whole matrix that incremental concatenation needs.
+
+    Parameters
+    ----------
+    num_rows: int
+        Number of rows the store is expected to hold, e.g., ``len(loader.sampler)`` for per-element gradients
+        or ``len(loader)`` for per-batch gradients
+    num_classes: int
+        Number of target classes in the dataset
+    embDim: int
+        Dimension of the penultimate layer embedding
+    linear_layer: bool
+        If True, the store also holds the last fc layer weight gradients
+    device: str
+        The device on which the gradients are stored - cpu | cuda
+    perBatch: bool, optional
+        If True, every appended mini-batch is reduced to the mean of its gradients (default: False)
+    dtype: torch.dtype, optional
+        Data type of the stored gradients (default: torch.float32)
+    sketch: GradientSketch, optional
+        If given, every mini-batch of gradients is projected with the sketch before it is written, so the
+        store only holds (num_rows, sketch_dim) sketches (default: None)
+    """
+
+    def __init__(self, num_rows, num_classes, embDim, linear_layer, device, perBatch=False, dtype=torch.float32,
+                 sketch=None):
+        """
+        Constructor method
+        """
+        self.num_classes = num_classes
+        self.embDim = embDim
+        self.linear_layer = linear_layer
+        self.device = device
+        self.perBatch = perBatch
+        self.dtype = dtype
+        self.sketch = sketch
+        self.num_cols = self.gradient_dim(num_classes, embDim, linear_layer)
+        self.size = 0
+        self.data = self._allocate(num_rows)
+
+    @staticmethod
+    def num_rows(loader, perBatch=False):
+        """
+        Number of gradient rows that a pass over the loader produces.
+
+        Parameters
+        ----------
+        loader: class
+            PyTorch dataloader
+        perBatch: bool, optional
+            If True, one row is produced per mini-batch (default: False)
+        """
+        if perBatch:
+            return len(loader)
+        return len(loader.sampler)
+
+    @staticmethod
+    def gradient_dim(num_classes, embDim, linear_layer):
+        """
+        Dimension of the last layer gradient of one element.
+
+        Parameters
+        ----------
+        num_classes: int
+            Number of target classes in the dataset
+        embDim: int
+            Dimension of the penultimate layer embedding
+        linear_layer: bool
+            If True, the gradient also includes the last fc layer weight gradients
+        """
+        if linear_layer:
+            return num_classes + embDim * num_classes
+        return num_classes
+
+    def _allocate(self, num_rows):
+        width = self.num_cols if self.sketch is None else self.sketch.sketch_dim
+        return torch.empty((num_rows, width), device=self.device, dtype=self.dtype)
+
+    def _reserve(self, num_rows):
+        """
+        Makes room for `num_rows` more rows. The store only grows if the loader produced more rows than
+        it reported, in which case the capacity is doubled to keep the total cost linear.
+        """
+        capacity = self.data.shape[0]
+        if self.size + num_rows <= capacity:
+            return
+        new_data = self._allocate(max(self.size + num_rows, 2 * capacity))
+        new_data[:self.size] = self.data[:self.size]
+        self.data = new_data
+
+    def _write(self, start, l0_grads, l1_grads):
+        end = start + l0_grads.shape[0]
+        if self.sketch is not None:
+            if self.linear_layer:
+                l0_grads = torch.cat((l0_grads, l1_grads), dim=1)
+            self.data[start:end] = self.sketch.project(l0_grads)
+            return
+        self.data[start:end, :self.num_classes] = l0_grads
+        if self.linear_layer:
+            self.data[start:end, self.num_classes:] = l1_grads
+
+    def append(self, l0_grads, l1=None):
+        """
+        Writes the gradients of one mini-batch into the store.
+
+        Parameters
+        ----------
+        l0_grads: Tensor
+            Gradients of the loss with respect to the model outputs of shape (batch_size, num_classes)
+        l1: Tensor, optional
+            Penultimate layer embeddings of shape (batch_size, embDim), required when `linear_layer` is True
+        """
+        l1_grads = None
+        if self.linear_layer:
+            l0_expand = torch.repeat_interleave(l0_grads, self.embDim, dim=1)
+            l1_grads = l0_expand * l1.repeat(1, self.num_classes)
+        if self.perBatch:
+            l0_grads = l0_grads.mean(dim=0).view(1, -1)
+            if self.linear_layer:
+                l1_grads = l1_grads.mean(dim=0).view(1, -1)
+        self._reserve(l0_grads.shape[0])
+        self._write(self.size, l0_grads, l1_grads)
+        self.size += l0_grads.shape[0]
+
+    def gradients(self):
+        """
+        Returns the gradients written so far as a (num_rows, num_cols) tensor, or as (num_rows, sketch_dim)
+        sketches when a sketch is used.
+        """
+        return self.data[:self.size]
+
+
+class FactoredGradientStore(GradientStore):
+    """
+    Preallocated store that keeps the last layer gradients in the factored form of :class:`FactoredGradients`,
+    i.e., the (num_rows, num_classes) output gradients and the (num_rows, embDim) embeddings, instead of
+    the dense (num_rows, num_classes + embDim * num_classes) gradient matrix.
+
+    A per-batch gradient is the mean of several outer products and has no factored form, so only
+    per-element gradients can be stored.
+
+    Parameters
+    ----------
+    num_rows: int
+        Number of elements the store is expected to hold
+    num_classes: int
+        Number of target classes in the dataset
+    embDim: int
+        Dimension of the penultimate layer embedding
+    linear_layer: bool
+        If True, the gradients also stand for the last fc layer weight gradients
+    device: str
+        The device on which the gradients are stored - cpu | cuda
+    perBatch: bool, optional
+        Must be False (default: False)
+    dtype: torch.dtype, optional
+        Data type of the stored factors (default: torch.float32)
+    """
+
+    def __init__(self, num_rows, num_classes, embDim, linear_layer, device, perBatch=False, dtype=torch.float32):
+        """
+        Constructor method
+        """
+        if perBatch:
+            raise ValueError("Per-batch gradients cannot be stored in factored form")
+        super().__init__(num_rows, num_classes, embDim, linear_layer, device, perBatch=perBatch, dtype=dtype)
+
+    def _allocate(self, num_rows):
+        width = self.num_classes + (self.embDim if self.linear_layer else 0)
+        return torch.empty((num_rows, width), device=self.device, dtype=self.dtype)
+
+    def append(self, l0_grads, l1=None):
+        """
+        Writes the output gradients and embeddings of one mini-batch into the store.
+
+        Parameters
+        ----------
+        l0_grads: Tensor
+            Gradients of the loss with respect to the model outputs of shape (batch_size, num_classes)
+        l1: Tensor, optional
+            Penultimate layer embeddings of shape (batch_size, embDim), required when `linear_layer` is True
+        """
+        self._reserve(l0_grads.shape[0])
+        self._write(self.size, l0_grads, l1)
+        self.size += l0_grads.shape[0]
+
+    def gradients(self):
+        """
+        Returns the gradients written so far as :class:`FactoredGradients`.
+        """
+        data = self.data[:self.size]
+        if self.linear_layer:
+            return FactoredGradients(data[:, :self.num_classes], data[:, self.num_classes:])
+        return FactoredGradients(data)
+
+
+class MemmapGradientStore(GradientStore):
+    """
+    Store that writes the last layer gradients (or their sketches) block by block into a disk backed `np.memmap`
+    instead of host memory, for datasets whose gradients do not fit into RAM.
+
+    The memmap file is created in `memmap_dir` and unlinked right away, so it is removed by the operating system
+    as soon as the store and the gradients read from it are garbage collected. The gradients are returned as
+    :class:`MemmapGradients`, which the selection algorithms read tile by tile.
+
+    Parameters
+    ----------
+    num_rows: int
+        Number of rows the store is expected to hold
+    num_classes: int
+        Number of target classes in the dataset
+    embDim: int
+        Dimension of the penultimate layer embedding
+    linear_layer: bool
+        If True, the store also holds the last fc layer weight gradients
+    device: str
+        The device on which the tiles read from the store are processed - cpu | cuda
+    perBatch: bool, optional
+        If True, every appended mini-batch is reduced to the mean of its gradients (default: False)
+    dtype: torch.dtype, optional
+        Data type of the stored gradients - torch.float32 | torch.float16 (default: torch.float32)
+    sketch: GradientSketch, optional
+        If given, every mini-batch of gradients is projected with the sketch before it is written (default: None)
+    memmap_dir: str, optional
+        Directory of the memmap file. If None, the default temporary directory is used (default: None)
+    """
+
+    def __init__(self, num_rows, num_classes, embDim, linear_layer, device, perBatch=False, dtype=torch.float32,
+                 sketch=None, memmap_dir=None):
+        """
+        Constructor method
+        """
+        if dtype not in [torch.float16, torch.float32]:
+            raise ValueError("Gradients can only be memory mapped as torch.float16 or torch.float32")
+        self.memmap_dir = memmap_dir
+        super().__init__(num_rows, num_classes, embDim, linear_layer, device, perBatch=perBatch, dtype=dtype,
+                         sketch=sketch)
+
+    def _allocate(self, num_rows):
+        width = self.num_cols if self.sketch is None else self.sketch.sketch_dim
+        np_dtype = np.float16 if self.dtype == torch.float16 else np.float32
+        return memmap_array((max(1, num_rows), width), dtype=np_dtype, memmap_dir=self.memmap_dir)
+
+    def _write(self, start, l0_grads, l1_grads):
+        end = start + l0_grads.shape[0]
+        if self.linear_layer:
+            l0_grads = torch.cat((l0_grads, l1_grads), dim=1)
+        if self.sketch is not None:
+            l0_grads = self.sketch.project(l0_grads)
+        self.data[start:end] = l0_grads.detach().to(self.dtype).cpu().numpy()
+        release_pages(self.data)
+
+    def gradients(self):
+        """
+        Returns the gradients written so far as :class:`MemmapGradients`.
+        """
+        return MemmapGradients(self.data[:self.size], device=self.device)
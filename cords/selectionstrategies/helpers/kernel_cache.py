@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix, issparse
+
+
+def _update(digest, part):
+    if isinstance(part, torch.Tensor):
+        part = part.detach().cpu().numpy()
+    if isinstance(part, np.ndarray):
+        if part.dtype == object:
+            _update(digest, part.tolist())
+            return
+        digest.update(repr((part.dtype.str, part.shape)).encode())
+        digest.update(np.ascontiguousarray(part).tobytes())
+    elif isinstance(part, dict):
+        digest.update(b'{')
+        for key in sorted(part, key=str):
+            _update(digest, str(key))
+            _update(digest, part[key])
+        digest.update(b'}')
+    elif isinstance(part, (list, tuple)):
+        digest.update(b'(')
+        for item in part:
+            _update(digest, item)
+        digest.update(b')')
+    elif isinstance(part, bytes):
+        digest.update(repr(len(part)).encode())
+        digest.update(part)
+    elif part is None or isinstance(part, (str, bool, int, float, np.generic)):
+        digest.update(repr((type(part).__name__, part)).encode())
+    else:
+        raise TypeError("Cannot fingerprint an object of type %s" % type(part).__name__)
+
+
+def fingerprint(*parts):
+    """
+    Content address of `parts`: the sha256 of tensors and arrays (by dtype, shape and bytes), of dicts such as
+    state dicts (by sorted keys), of lists and tuples (by items), and of strings, bytes, numbers, booleans and None.
+    Any other object raises a TypeError, as its repr may hold memory addresses and is not a stable address.
+
+    Parameters
+    ----------
+    parts: object
+        Parts of the address
+
+    Returns
+    ----------
+    key: str
+        Hexadecimal digest
+    """
+    digest = hashlib.sha256()
+    _update(digest, parts)
+    return digest.hexdigest()
+
+
+def _is_content(value):
+    """
+    Whether an attribute of a dataset is part of its content: a tensor, an array, or a non empty list or tuple of
+    them.
+    """
+    if isinstance(value, (torch.Tensor, np.ndarray)):
+        return True
+    return isinstance(value, (list, tuple)) and len(value) > 0 and \
+        all(isinstance(item, (torch.Tensor, np.ndarray)) for item in value)
+
+
+def dataset_fingerprint(dataset):
+    """
+    Fingerprint of the content of a dataset, which is read from its storage rather than through its items, so that
+    random training transforms (e.g., random crops and flips) do not change it:
+
+     - `Subset` and `WeightedSubset`: the indices (and weights), and the fingerprint of the parent dataset
+     - `ConcatDataset`: the fingerprints of its datasets
+     - `TensorDataset`: its tensors
+     - datasets with a `data` attribute, e.g., the torchvision datasets: `data`, and `targets` or `labels`
+     - other datasets: the tensors and arrays they hold as attributes, alone or in lists and tuples, e.g.,
+       the token indices and labels of the text datasets
+
+    Datasets without any such content, or whose content cannot be fingerprinted, raise a TypeError, and take an
+    explicit key instead.
+
+    Parameters
+    ----------
+    dataset: torch.utils.data.Dataset
+        Dataset to fingerprint
+
+    Returns
+    ----------
+    key: str
+        Hexadecimal digest
+    """
+    name = type(dataset).__name__
+    if hasattr(dataset, 'indices') and hasattr(dataset, 'dataset'):
+        return fingerprint(name, np.asarray(dataset.indices), getattr(dataset, 'weights', None),
+                           dataset_fingerprint(dataset.dataset))
+    if hasattr(dataset, 'datasets'):
+        return fingerprint(name, [dataset_fingerprint(d) for d in dataset.datasets])
+    if hasattr(dataset, 'tensors'):
+        return fingerprint(name, list(dataset.tensors))
+    if hasattr(dataset, 'data'):
+        targets = getattr(dataset, 'targets', getattr(dataset, 'labels', None))
+        return fingerprint(name, dataset.data, targets)
+    content = {key: value for key, value in sorted(vars(dataset).items()) if _is_content(value)}
+    if len(content) > 0:
+        return fingerprint(name, content)
+    raise TypeError("Cannot fingerprint a dataset of type %s, give an explicit dataset key" % name)
+
+
+class KernelCache(object):
+    """
+    Content addressed store of the arrays of a selection, e.g., features, similarity kernels, knn graphs and
+    rankings, under a directory per key (see :func:`fingerprint`). Dense arrays are ``.npy`` files and sparse
+    matrices are the ``.npy`` files of their CSR arrays, which are memory mapped when they are loaded, so a kernel
+    is opened without being read or copied. An entry is written to a temporary directory that is renamed when it
+    is complete, so concurrent runs, e.g., HPO trials, never read a partial entry.
+
+    Parameters
+    ----------
+    root: str
+        Directory of the cache, created if needed
+    mmap_mode: str, optional
+        Memory mapping mode of the loaded arrays, see ``np.load``. With 'c' (copy on write), the arrays can be
+        modified in memory without modifying the files (default: 'c')
+    """
+
+    def __init__(self, root, mmap_mode='c'):
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.mmap_mode = mmap_mode
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key):
+        """
+        Arrays of the entry `key`, as a dict of memory mapped arrays and `csr_matrix`, or None if there is no such
+        entry.
+        """
+        path = self.path(key)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return None
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {}
+        for name, kind in meta['arrays'].items():
+            load = lambda suffix: np.load(os.path.join(path, name + suffix + '.npy'), mmap_mode=self.mmap_mode)
+            if kind == 'csr':
+                arrays[name] = csr_matrix((load('.data'), load('.indices'), load('.indptr')),
+                                          shape=tuple(meta['shapes'][name]), copy=False)
+            else:
+                arrays[name] = load('')
+        return arrays
+
+    def save(self, key, **arrays):
+        """
+        Writes the tensors, arrays and sparse matrices `arrays` as the entry `key`, and returns them as loaded by
+        :meth:`load`. If the entry already exists, e.g., written by a concurrent run, it is kept.
+        """
+        if os.path.exists(self.path(key)):
+            return self.load(key)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        meta = {'arrays': {}, 'shapes': {}}
+        for name, array in arrays.items():
+            if issparse(array):
+                array = array.tocsr()
+                np.save(os.path.join(tmp, name + '.data.npy'), array.data)
+                np.save(os.path.join(tmp, name + '.indices.npy'), array.indices)
+                np.save(os.path.join(tmp, name + '.indptr.npy'), array.indptr)
+                meta['arrays'][name] = 'csr'
+            else:
+                if isinstance(array, torch.Tensor):
+                    array = array.detach().cpu().numpy()
+                array = np.asarray(array)
+                np.save(os.path.join(tmp, name + '.npy'), array)
+                meta['arrays'][name] = 'dense'
+            meta['shapes'][name] = list(array.shape)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        try:
+            os.rename(tmp, self.path(key))
+        except OSError:
+            # another run wrote the entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+        return self.load(key)
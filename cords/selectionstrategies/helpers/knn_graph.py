@@ -0,0 +1,154 @@
+import math
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
+from .memmap_gradients import MemmapGradients
+from .pairwise_distances import concat_rows, pairwise_distances, _sq_norms, _tile_distances, _tiles
+
+
+def _merge(rows, cols, dists, k):
+    """
+    Keeps the `k` nearest distinct neighbours of every row among the candidate edges ``(rows, cols, dists)``.
+    """
+    order = np.lexsort((dists, cols, rows))
+    rows, cols, dists = rows[order], cols[order], dists[order]
+    distinct = np.ones(len(rows), dtype=bool)
+    distinct[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    rows, cols, dists = rows[distinct], cols[distinct], dists[distinct]
+    order = np.lexsort((dists, rows))
+    rows, cols, dists = rows[order], cols[order], dists[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    keep = rank < k
+    return rows[keep], cols[keep], dists[keep]
+
+
+def _exact_knn(x, k, tile_size):
+    """
+    Exact `k` nearest neighbours of every row of `x` by a tiled scan, which keeps a running top-k per row tile.
+    """
+    n = len(x)
+    sq_norms = _sq_norms(x)
+    rows, cols, dists = [], [], []
+    for i, x_i in _tiles(x, tile_size):
+        best = torch.empty((len(x_i), 0))
+        best_idxs = torch.empty((len(x_i), 0), dtype=torch.long)
+        for j, x_j in _tiles(x, tile_size):
+            dist = _tile_distances(x_i, x_j, sq_norms[i:i + len(x_i)], sq_norms[j:j + len(x_j)], 2).cpu()
+            if i == j:
+                dist.fill_diagonal_(0)
+            best = torch.cat((best, dist), dim=1)
+            best_idxs = torch.cat((best_idxs, torch.arange(j, j + len(x_j)).expand(len(x_i), -1)), dim=1)
+            best, order = torch.topk(best, min(k, best.shape[1]), dim=1, largest=False)
+            best_idxs = torch.gather(best_idxs, 1, order)
+        rows.append(torch.arange(i, i + len(x_i)).repeat_interleave(best.shape[1]))
+        cols.append(best_idxs.reshape(-1))
+        dists.append(best.reshape(-1))
+    return torch.cat(rows).numpy(), torch.cat(cols).numpy(), torch.cat(dists).numpy()
+
+
+def _rp_tree_knn(x, k, n_trees, leaf_size, seed):
+    """
+    Approximate `k` nearest neighbours of every row of `x` with a forest of random projection trees.
+
+    Every tree splits the rows at the median of their projection on a random direction, with one direction per
+    level of the tree, until the leaves have at most `leaf_size` rows. The neighbours are searched exactly within
+    every leaf, and the candidates of all the trees are merged. All the projections of a tree are computed in a
+    single pass over the rows.
+    """
+    n, d = len(x), x.shape[1]
+    depth = max(0, math.ceil(math.log2(n / leaf_size)))
+    device = 'cpu' if isinstance(x, MemmapGradients) else x.device
+    generator = torch.Generator().manual_seed(seed)
+    rows, cols, dists = [], [], []
+    for _ in range(n_trees):
+        directions = torch.randn(d, max(depth, 1), generator=generator).to(device)
+        if isinstance(x, torch.Tensor):
+            projections = torch.matmul(x, directions).cpu()
+        else:
+            projections = x.matmul(directions).cpu()
+        leaves = [torch.arange(n)]
+        for level in range(depth):
+            split = []
+            for leaf in leaves:
+                if len(leaf) <= leaf_size:
+                    split.append(leaf)
+                    continue
+                order = leaf[torch.argsort(projections[leaf, level])]
+                split.extend([order[:len(order) // 2], order[len(order) // 2:]])
+            leaves = split
+        for leaf in leaves:
+            dist = pairwise_distances(x[leaf]).cpu()
+            dist.fill_diagonal_(0)
+            best, order = torch.topk(dist, min(k, len(leaf)), dim=1, largest=False)
+            rows.append(leaf.repeat_interleave(best.shape[1]))
+            cols.append(leaf[order].reshape(-1))
+            dists.append(best.reshape(-1))
+    return torch.cat(rows).numpy(), torch.cat(cols).numpy(), torch.cat(dists).numpy()
+
+
+def knn_graph(x, k, labels=None, method='exact', tile_size=2048, n_trees=4, leaf_size=256, seed=0):
+    """
+    Sparse similarity graph of the `k` nearest neighbours, in squared euclidean distance, of every row of `x`.
+
+    An edge between :math:`i` and :math:`j` is kept if :math:`j` is one of the `k` nearest neighbours of
+    :math:`i` or the other way around. Its similarity is :math:`c - \\|x^i - x^j\\|^2`, where :math:`c` is the
+    largest squared distance of an edge, as in :func:`similarity_kernel`. Every row is its own neighbour. The graph
+    takes O(N k) memory, and is a `csr_matrix` that apricot's functions take with ``metric='precomputed'``.
+
+    Parameters
+    ----------
+    x: Tensor, FactoredGradients, MemmapGradients or list
+        Rows of shape (N, d), e.g., input features or gradients, or a list of row blocks
+    k: int
+        Number of neighbours of every row, itself included
+    labels: Tensor or np.ndarray, optional
+        Labels of the rows. If given, the neighbours of a row are searched among the rows of its label only, and
+        the graph is block diagonal. If None, all the rows are searched (default: None)
+    method: str, optional
+        Nearest neighbour search - 'exact' | 'rp_tree'. 'exact' scans all the pairs of row tiles, 'rp_tree' searches
+        within the leaves of a forest of random projection trees (default: 'exact')
+    tile_size: int, optional
+        Number of rows of a tile of the exact search (default: 2048)
+    n_trees: int, optional
+        Number of random projection trees (default: 4)
+    leaf_size: int, optional
+        Maximum number of rows of a leaf of a random projection tree (default: 256)
+    seed: int, optional
+        Seed of the random projections (default: 0)
+
+    Returns
+    ----------
+    graph: csr_matrix
+        float32 similarities of shape (N, N)
+    const: float
+        The largest squared distance :math:`c` of an edge
+    """
+    if method not in ['exact', 'rp_tree']:
+        raise ValueError("method must be one of 'exact' or 'rp_tree'")
+    if k < 1:
+        raise ValueError("k must be positive")
+    x = concat_rows(x)
+    n = len(x)
+    if labels is None:
+        groups = [torch.arange(n)]
+    else:
+        labels = torch.as_tensor(np.asarray(labels)).view(-1)
+        groups = [torch.where(labels == c)[0] for c in torch.unique(labels)]
+    rows, cols, dists = [], [], []
+    for group in groups:
+        x_g = x if len(groups) == 1 else x[group]
+        if method == 'exact':
+            r, c, dist = _exact_knn(x_g, k, tile_size)
+        else:
+            r, c, dist = _rp_tree_knn(x_g, k, n_trees, max(leaf_size, k), seed)
+        r, c, dist = _merge(r, c, dist, k)
+        rows.append(group.numpy()[r])
+        cols.append(group.numpy()[c])
+        dists.append(dist)
+    rows, cols, dists = np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+    # symmetric graph: both directions of every edge, with duplicates dropped by _merge
+    rows, cols, dists = _merge(np.concatenate((rows, cols)), np.concatenate((cols, rows)),
+                               np.concatenate((dists, dists)), n)
+    const = float(dists.max()) if len(dists) > 0 else 0.0
+    graph = csr_matrix(((const - dists).astype(np.float32), (rows, cols)), shape=(n, n))
+    return graph, const
@@ -0,0 +1,119 @@
+import weakref
+import numpy as np
+import torch
+from torch.utils.data import ConcatDataset, Subset
+from torch.utils.data.sampler import SequentialSampler
+
+
+class LabelIndex(object):
+    """
+    Labels of every element of a dataloader, in the order in which the dataloader yields them, together with
+    the indices of the elements of every class.
+
+    The index is built once per dataloader with :func:`from_loader` and shared by all the strategies and
+    selection rounds that use the same dataloader. For a sequential dataloader, the labels are read directly
+    from the dataset: from the `targets` (e.g., torchvision datasets, `CustomDataset`) or `labels` attribute,
+    through the `indices` of a `Subset` (e.g., the splits of `random_split`) and across the parts of a
+    `ConcatDataset`. Only if none of these is available, or if the dataset transforms its targets, the labels
+    are collected with a one-time pass over the dataloader.
+
+    Parameters
+    ----------
+    labels: Tensor
+        Label of every element of shape (N,)
+    """
+
+    _cache = weakref.WeakKeyDictionary()
+
+    def __init__(self, labels):
+        """
+        Constructor method
+        """
+        self.labels = labels
+        self._class_indices = {}
+
+    @classmethod
+    def from_loader(cls, loader):
+        """
+        Returns the label index of the dataloader, building it on first use.
+
+        Parameters
+        ----------
+        loader: class
+            PyTorch dataloader
+
+        Returns
+        ----------
+        label_index: LabelIndex
+            Label index of the dataloader
+        """
+        label_index = cls._cache.get(loader)
+        if label_index is None:
+            labels = None
+            if isinstance(loader.sampler, SequentialSampler):
+                labels = cls.dataset_targets(loader.dataset)
+                if labels is not None and loader.drop_last:
+                    labels = labels[:len(loader) * loader.batch_size]
+            if labels is None:
+                labels = cls._loader_targets(loader)
+            label_index = cls(labels)
+            cls._cache[loader] = label_index
+        return label_index
+
+    @staticmethod
+    def dataset_targets(dataset):
+        """
+        Reads the targets of every element of the dataset without loading the elements.
+
+        Parameters
+        ----------
+        dataset: class
+            PyTorch dataset
+
+        Returns
+        ----------
+        targets: Tensor
+            Targets of shape (len(dataset),), or None if they cannot be read from the dataset
+        """
+        if isinstance(dataset, Subset):
+            targets = LabelIndex.dataset_targets(dataset.dataset)
+            if targets is None:
+                return None
+            return targets[torch.as_tensor(dataset.indices, dtype=torch.long)]
+        if isinstance(dataset, ConcatDataset):
+            targets = [LabelIndex.dataset_targets(d) for d in dataset.datasets]
+            if any(t is None for t in targets):
+                return None
+            return torch.cat(targets, dim=0)
+        if getattr(dataset, 'target_transform', None) is not None:
+            return None
+        for attr in ['targets', 'labels']:
+            targets = getattr(dataset, attr, None)
+            if isinstance(targets, (torch.Tensor, np.ndarray, list)) and len(targets) == len(dataset):
+                return torch.as_tensor(targets).cpu().view(len(dataset), -1).squeeze(1)
+        return None
+
+    @staticmethod
+    def _loader_targets(loader):
+        labels = []
+        for batch in loader:
+            labels.append(batch[1].view(-1))
+        return torch.cat(labels, dim=0)
+
+    def class_indices(self, c):
+        """
+        Indices of the elements of class `c`.
+
+        Parameters
+        ----------
+        c: int
+            Class index
+
+        Returns
+        ----------
+        indices: Tensor
+            Indices of the elements of class `c`
+        """
+        if c not in self._class_indices:
+            self._class_indices[c] = torch.where(self.labels == c)[0]
+        return self._class_indices[c]
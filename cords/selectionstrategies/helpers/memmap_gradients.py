@@ -0,0 +1,212 @@
+import mmap
+import os
+import tempfile
+import numpy as np
+import torch
+
+
+def memmap_array(shape, dtype=np.float32, memmap_dir=None):
+    """
+    Creates a zero initialized `np.memmap` of the given shape backed by an unlinked temporary file in `memmap_dir`,
+    which the operating system removes once the array is garbage collected.
+
+    Parameters
+    ----------
+    shape: tuple
+        Shape of the array
+    dtype: np.dtype, optional
+        Data type of the array (default: np.float32)
+    memmap_dir: str, optional
+        Directory of the file. If None, the default temporary directory is used (default: None)
+    """
+    fd, path = tempfile.mkstemp(prefix='cords_', suffix='.dat', dir=memmap_dir)
+    try:
+        data = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+    finally:
+        os.close(fd)
+        os.unlink(path)
+    return data
+
+
+def release_pages(data):
+    """
+    Drops the pages of the `np.memmap` `data` from the resident memory of the process. The data stays in the file
+    (and in the page cache, from which the operating system can reclaim it), so later reads are still valid. Does
+    nothing for arrays that are not memory mapped or where `madvise` is not available.
+
+    Parameters
+    ----------
+    data: np.ndarray
+        Memory mapped array, or a view of one
+    """
+    mm = getattr(data, '_mmap', None)
+    if mm is not None and hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+        mm.madvise(mmap.MADV_DONTNEED)
+
+
+class MemmapGradients(object):
+    """
+    Gradients of a set of elements kept in a (disk backed) `np.memmap` of shape (N, d), read tile by tile.
+
+    Only a tile of rows, of at most `tile_bytes` bytes in float32, is loaded at any time, so the operations needed
+    by the selection algorithms (products with a dense vector, sums, Gram columns and distance tiles) run with a
+    memory footprint that does not grow with the number of elements; the pages of a tile are dropped from the
+    resident memory once the next tile is requested. Indexing with a list of rows returns a lazy
+    view that shares the memmap; no data is read until an operation needs it. The memmap can be float16, in which
+    case every tile is converted to float32 after it is read.
+
+    Parameters
+    ----------
+    data: np.ndarray
+        Gradients of shape (N, d), usually an `np.memmap`
+    rows: np.ndarray, optional
+        Rows of `data` that this object stands for, in order. If None, all the rows are used (default: None)
+    transposed: bool, optional
+        If True, the object stands for the transposed (d, N) matrix, which is the orientation of the design
+        matrix expected by the OMP solvers (default: False)
+    device: str, optional
+        The device to which the tiles are moved - cpu | cuda (default: 'cpu')
+    tile_bytes: int, optional
+        Maximum size in bytes of one float32 tile (default: 64 MiB)
+    """
+
+    def __init__(self, data, rows=None, transposed=False, device='cpu', tile_bytes=2 ** 26):
+        """
+        Constructor method
+        """
+        self.data = data
+        self.rows = rows
+        self.transposed = transposed
+        self.device = device
+        self.tile_bytes = tile_bytes
+        self.tile_rows = max(1, tile_bytes // (4 * max(1, data.shape[1])))
+
+    @property
+    def shape(self):
+        shape = (len(self), self.data.shape[1])
+        if self.transposed:
+            shape = shape[::-1]
+        return torch.Size(shape)
+
+    def __len__(self):
+        if self.rows is None:
+            return self.data.shape[0]
+        return len(self.rows)
+
+    def _view(self, rows=None, transposed=False):
+        return MemmapGradients(self.data, rows=rows, transposed=transposed, device=self.device,
+                               tile_bytes=self.tile_bytes)
+
+    def __getitem__(self, idxs):
+        """
+        Returns a lazy view of the gradients of the elements in `idxs`.
+        """
+        if isinstance(idxs, torch.Tensor):
+            idxs = idxs.cpu().numpy()
+        idxs = np.atleast_1d(np.asarray(idxs, dtype=np.int64))
+        if self.rows is not None:
+            idxs = self.rows[idxs]
+        return self._view(rows=idxs)
+
+    def t(self):
+        """
+        Returns the transposed view of the gradients. The memmap is shared, not copied.
+        """
+        return self._view(rows=self.rows, transposed=not self.transposed)
+
+    def _read(self, start, end):
+        if self.rows is None:
+            block = self.data[start:end]
+        else:
+            block = self.data[self.rows[start:end]]
+        return torch.from_numpy(block).to(self.device, dtype=torch.float32)
+
+    def tiles(self):
+        """
+        Iterates over the gradients in row tiles.
+
+        Yields
+        ----------
+        start: int
+            Index of the first element of the tile
+        tile: Tensor
+            float32 gradients of the elements ``start, ..., start + len(tile) - 1``
+        """
+        for start in range(0, len(self), self.tile_rows):
+            yield start, self._read(start, min(start + self.tile_rows, len(self)))
+            release_pages(self.data)
+
+    def dense(self):
+        """
+        Loads all the gradients into a dense float32 tensor.
+        """
+        dense = self._read(0, len(self))
+        if self.transposed:
+            return dense.t()
+        return dense
+
+    def columns(self, cols):
+        """
+        Loads the columns `cols` of the gradients of all the elements into a dense float32 tensor.
+        """
+        cols = np.asarray(cols, dtype=np.int64)
+        out = torch.empty((len(self), len(cols)), device=self.device)
+        for start, tile in self.tiles():
+            out[start:start + len(tile)] = tile[:, torch.from_numpy(cols).to(self.device)]
+        return out
+
+    def sum(self, dim=0):
+        """
+        Sum of the gradients of all the elements.
+        """
+        if dim != 0:
+            raise ValueError("MemmapGradients can only be reduced along the element dimension (dim=0)")
+        total = torch.zeros(self.data.shape[1], device=self.device)
+        for _, tile in self.tiles():
+            total += tile.sum(dim=0)
+        return total
+
+    def weighted_sum(self, w):
+        """
+        Sum of the gradients of all the elements weighted by `w` (of length N).
+        """
+        total = torch.zeros(self.data.shape[1], device=self.device)
+        for start, tile in self.tiles():
+            total += torch.matmul(w[start:start + len(tile)].view(1, -1), tile).view(-1)
+        return total
+
+    def mean(self, dim=0):
+        """
+        Mean of the gradients of all the elements.
+        """
+        return self.sum(dim=dim) / len(self)
+
+    def matmul(self, v):
+        """
+        Product of the (N, d) gradient matrix with a dense vector of length d, or with a (d, k) matrix.
+        """
+        out = torch.empty((len(self),) + tuple(v.shape[1:]), device=self.device)
+        for start, tile in self.tiles():
+            out[start:start + len(tile)] = torch.matmul(tile, v)
+        return out
+
+    def inner(self, other=None):
+        """
+        Matrix of inner products between the gradients of this set (rows) and of `other` (columns), which is
+        loaded into memory and should hence be small, e.g., the gradient of one element.
+        If `other` is None, the Gram matrix of this set is returned.
+        """
+        if other is None:
+            other = self
+        if isinstance(other, MemmapGradients):
+            other = other.dense()
+        return self.matmul(other.t())
+
+    def sq_norms(self):
+        """
+        Squared euclidean norm of the gradient of every element.
+        """
+        out = torch.empty(len(self), device=self.device)
+        for start, tile in self.tiles():
+            out[start:start + len(tile)] = (tile ** 2).sum(dim=1)
+        return out
@@ -0,0 +1,78 @@
+import numpy as np
+import torch
+from scipy.sparse import issparse
+
+
+def _sparse_nearest_selected(kernel, idxs, tile_bytes):
+    kernel = kernel.tocsr()
+    rep = np.full(kernel.shape[1], -1, dtype=np.int64)
+    best = np.full(kernel.shape[1], -np.inf)
+    # a panel of selected rows holds about as many stored entries as a dense tile of `tile_bytes` bytes
+    counts = np.diff(kernel.indptr)[idxs]
+    panels = (np.cumsum(counts) - counts) // max(1, tile_bytes // 8)
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(panels)) + 1, [len(idxs)]))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        panel = kernel[idxs[start:end]].tocoo()
+        rows, cols, vals = panel.row + start, panel.col, panel.data.astype(np.float64)
+        # the first largest entry of every column, in the order of the selected rows
+        order = np.lexsort((rows, -vals, cols))
+        rows, cols, vals = rows[order], cols[order], vals[order]
+        first = np.ones(len(cols), dtype=bool)
+        first[1:] = cols[1:] != cols[:-1]
+        rows, cols, vals = rows[first], cols[first], vals[first]
+        better = vals > best[cols]
+        rep[cols[better]], best[cols[better]] = rows[better], vals[better]
+    return rep, best
+
+
+def nearest_selected(kernel, idxs, tile_bytes=2 ** 26):
+    """
+    Most similar selected element :math:`\\arg\\max_{s \\in S} K_{sj}` of every column :math:`j` of a similarity
+    kernel, i.e., the element that represents :math:`j` in the facility location function. The number of columns
+    represented by every selected element is the CRAIG weight, ``np.bincount(rep[rep >= 0], minlength=len(idxs))``.
+
+    The selected rows are read in tiles of at most `tile_bytes` bytes, so the |S| x N slice of the kernel is never
+    formed: dense and memory mapped kernels in panels of columns, and sparse kernels in panels of rows with a
+    running maximum over their stored entries. Ties go to the first selected element, as with ``np.argmax``.
+
+    Parameters
+    ----------
+    kernel: Tensor, np.ndarray or sparse matrix
+        Similarity kernel of shape (N, M), e.g., the output of :func:`similarity_kernel`,
+        :func:`block_similarity_kernel` or :func:`knn_graph`
+    idxs: list, np.ndarray or LongTensor
+        Rows of the selected elements
+    tile_bytes: int, optional
+        Maximum size in bytes of a tile of the selected rows (default: 64 MiB)
+
+    Returns
+    ----------
+    rep: np.ndarray
+        Position in `idxs` of the representative of every column, or -1 for the columns of a sparse kernel without
+        any stored entry in the selected rows
+    best: np.ndarray
+        float64 similarity of every column to its representative, or -inf where `rep` is -1
+    """
+    if isinstance(idxs, torch.Tensor):
+        idxs = idxs.cpu().numpy()
+    idxs = np.asarray(idxs, dtype=np.int64).reshape(-1)
+    if issparse(kernel):
+        return _sparse_nearest_selected(kernel, idxs, tile_bytes)
+    m = kernel.shape[1]
+    rep = np.empty(m, dtype=np.int64)
+    best = np.empty(m, dtype=np.float64)
+    if len(idxs) == 0:
+        rep.fill(-1)
+        best.fill(-np.inf)
+        return rep, best
+    itemsize = kernel.element_size() if isinstance(kernel, torch.Tensor) else kernel.dtype.itemsize
+    width = max(1, tile_bytes // (itemsize * len(idxs)))
+    rows = torch.from_numpy(idxs).to(kernel.device) if isinstance(kernel, torch.Tensor) else idxs
+    for j in range(0, m, width):
+        tile = kernel[rows, j:j + width]
+        if isinstance(tile, torch.Tensor):
+            tile = tile.cpu().numpy()
+        tile_rep = np.argmax(tile, axis=0)
+        rep[j:j + width] = tile_rep
+        best[j:j + width] = tile[tile_rep, np.arange(tile.shape[1])]
+    return rep, best
@@ -1,3 +1,5 @@
+import math
+import time
 import numpy as np
 
 np.seterr(all='raise')
@@ -9,6 +11,8 @@ from scipy.linalg import lstsq
 from scipy.linalg import solve
 from scipy.optimize import nnls
 import torch
+from .factored_gradients import FactoredGradients
+from .memmap_gradients import MemmapGradients
 
 
 # NOTE: Textbook Primal-Dual IPM: Boyd & Vandenberghe, ``Chapter 11: Interior-point Methods," Convex Optimization, 2004.
@@ -342,8 +346,19 @@ def OrthogonalMP_REG_NNLS(A, b, tol=1E-4, nnz=None, positive=False, lam=1):
     return x
 
 
+def _deadline(time_limit):
+    '''time.perf_counter() value after which a solver with the given time limit (in seconds) stops, or None'''
+    return None if time_limit is None else time.perf_counter() + time_limit
+
+
+def _expired(deadline):
+    '''whether the deadline of a solver has passed; the OMP solvers check it at the end of every iteration, so that
+    they always return the solution of the support selected so far (of at least one atom)'''
+    return deadline is not None and time.perf_counter() > deadline
+
+
 # NOTE: Standard Algorithm, e.g. Tropp, ``Greed is Good: Algorithmic Results for Sparse Approximation," IEEE Trans. Info. Theory, 2004.
-def OrthogonalMP_REG(A, b, tol=1E-4, nnz=None, positive=False, lam=1):
+def OrthogonalMP_REG(A, b, tol=1E-4, nnz=None, positive=False, lam=1, gram=None, time_limit=None):
     '''approximately solves min_x |x|_0 s.t. Ax=b using Orthogonal Matching Pursuit
     Args:
       A: design matrix of size (d, n)
@@ -351,6 +366,10 @@ def OrthogonalMP_REG(A, b, tol=1E-4, nnz=None, positive=False, lam=1):
       tol: solver tolerance
       nnz = maximum number of nonzero coefficients (if None set to n)
       positive: only allow positive nonzero coefficients
+      gram: run the iterations on the precomputed Gram matrix A^T A (see _use_gram); if None it is chosen
+            from the shape of A
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
     Returns:
        vector of length n
     '''
@@ -358,6 +377,11 @@ def OrthogonalMP_REG(A, b, tol=1E-4, nnz=None, positive=False, lam=1):
     d, n = A.shape
     if nnz is None:
         nnz = n
+    if gram is None:
+        gram = _use_gram(d, n, nnz)
+    if gram:
+        return _OrthogonalMP_REG_Gram(A, b, tol=tol, nnz=nnz, positive=positive, lam=lam, time_limit=time_limit)
+    deadline = _deadline(time_limit)
     x = np.zeros(n)
     resid = np.copy(b)
     normb = norm(b)
@@ -389,6 +413,8 @@ def OrthogonalMP_REG(A, b, tol=1E-4, nnz=None, positive=False, lam=1):
                     A_i = np.vstack([A_i[:argmin], A_i[argmin + 1:]])
                     x_i = lstsq(A_i.dot(A_i.T) + lam * np.identity(A_i.shape[0]), A_i.dot(b))[0]
         resid = b - A_i.T.dot(x_i)
+        if _expired(deadline):
+            break
     for i, index in enumerate(indices):
         try:
             x[index] += x_i[i]
@@ -397,22 +423,115 @@ def OrthogonalMP_REG(A, b, tol=1E-4, nnz=None, positive=False, lam=1):
     return x
 
 
+# Forming A^T A is a matrix product, which runs several times faster per flop than the matrix-vector products
+# A^T r of the atoms; the measured crossover is around n = 10 nnz (see benchmarks/solvers/omp_gram.py)
+GRAM_SPEEDUP = 8
+
+
+def _use_gram(d, n, nnz):
+    '''whether OMP on a design matrix of size (d, n) is cheaper with the precomputed Gram matrix
+    With G = A^T A and A^T b computed once, the correlations of the atoms are A^T r = A^T b - G_{:,S} x_S and the
+    residual norm is |b|^2 - 2 x_S^T A_S^T b + x_S^T G_SS x_S, so every atom costs O(n k) instead of O(n d). The
+    Gram matrix costs n^2 d flops up front, against nnz n d for the products A^T r, and takes n^2 memory, so it
+    only pays off when n is small compared to both d and the number of atoms, e.g., for PerBatch selection.
+    Args:
+      d: number of rows of A
+      n: number of columns (atoms) of A
+      nnz: maximum number of atoms
+    Returns:
+       True if the Gram formulation is expected to be faster
+    '''
+    return n <= d and n <= GRAM_SPEEDUP * min(nnz, n)
+
+
+def _OrthogonalMP_REG_Gram(A, b, tol=1E-4, nnz=None, positive=False, lam=1, time_limit=None):
+    '''OrthogonalMP_REG on the precomputed Gram matrix of A, which is kept in float64 so that the residual norm can
+    be computed from it down to the solver tolerance
+    Args:
+      A: design matrix of size (d, n)
+      b: measurement vector of length d
+      tol: solver tolerance
+      nnz = maximum number of nonzero coefficients
+      positive: only allow positive nonzero coefficients
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
+    Returns:
+       vector of length n
+    '''
+    deadline = _deadline(time_limit)
+    A = A.astype(np.float64)
+    b = b.astype(np.float64)
+    G = A.T.dot(A)
+    Atb = A.T.dot(b)
+    bb = b.dot(b)
+    n = A.shape[1]
+    x = np.zeros(n)
+    normb = np.sqrt(bb)
+    indices = []
+    resid_sq = bb
+
+    for i in range(nnz):
+        if np.sqrt(max(resid_sq, 0.0)) / normb < tol:
+            break
+        if len(indices) == 0:
+            projections = Atb
+        else:
+            projections = Atb - G[:, indices].dot(x_i)
+        if positive:
+            index = np.argmax(projections)
+        else:
+            index = np.argmax(abs(projections))
+        if index in indices:
+            break
+        indices.append(index)
+        if len(indices) == 1:
+            x_i = np.atleast_1d(projections[index] / G[index, index])
+        else:
+            x_i = lstsq(G[np.ix_(indices, indices)] + lam * np.identity(len(indices)), Atb[indices])[0]
+            if positive:
+                while min(x_i) < 0.0:
+                    argmin = np.argmin(x_i)
+                    indices = indices[:argmin] + indices[argmin + 1:]
+                    x_i = lstsq(G[np.ix_(indices, indices)] + lam * np.identity(len(indices)), Atb[indices])[0]
+        resid_sq = bb - 2 * x_i.dot(Atb[indices]) + x_i.dot(G[np.ix_(indices, indices)].dot(x_i))
+        if _expired(deadline):
+            break
+    for i, index in enumerate(indices):
+        x[index] += x_i[i]
+    return x
+
+
 # NOTE: Standard Algorithm, e.g. Tropp, ``Greed is Good: Algorithmic Results for Sparse Approximation," IEEE Trans. Info. Theory, 2004.
-def OrthogonalMP_REG_Parallel_V1(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu"):
+def OrthogonalMP_REG_Parallel_V1(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu", gram=None,
+                                 time_limit=None):
     '''approximately solves min_x |x|_0 s.t. Ax=b using Orthogonal Matching Pursuit
     Args:
-      A: design matrix of size (d, n)
+      A: design matrix of size (d, n), or transposed FactoredGradients or MemmapGradients whose n rows are the
+         columns of A
       b: measurement vector of length d
       tol: solver tolerance
       nnz = maximum number of nonzero coefficients (if None set to n)
       positive: only allow positive nonzero coefficients
+      gram: run the iterations on the precomputed Gram matrix A^T A (see _use_gram); if None it is chosen
+            from the shape of A. Ignored for FactoredGradients and MemmapGradients
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
     Returns:
        vector of length n
     '''
+    if isinstance(A, (FactoredGradients, MemmapGradients)):
+        return _OrthogonalMP_REG_Parallel_V1_Rows(A.t(), b, tol=tol, nnz=nnz, positive=positive,
+                                                  lam=lam, device=device, time_limit=time_limit)
     AT = torch.transpose(A, 0, 1)
     d, n = A.shape
     if nnz is None:
         nnz = n
+    if gram is None:
+        gram = _use_gram(d, n, nnz)
+    if gram:
+        return _OrthogonalMP_REG_Parallel_V1_Gram(A, b, tol=tol, nnz=nnz, positive=positive, lam=lam, device=device,
+                                                  time_limit=time_limit)
+    deadline = _deadline(time_limit)
     x = torch.zeros(n, device=device)  # ,dtype=torch.float64)
     resid = b.detach().clone()
     normb = b.norm().item()
@@ -453,6 +572,8 @@ def OrthogonalMP_REG_Parallel_V1(A, b, tol=1E-4, nnz=None, positive=False, lam=1
                     temp = torch.matmul(A_i, torch.transpose(A_i, 0, 1)) + lam * torch.eye(A_i.shape[0], device=device)
                     x_i, _, _, _ = torch.linalg.lstsq(temp, torch.matmul(A_i, b).view(-1, 1))
         resid = b - torch.matmul(torch.transpose(A_i, 0, 1), x_i).view(-1)  # A_i.T.dot(x_i)
+        if _expired(deadline):
+            break
     x_i = x_i.view(-1)
     for i, index in enumerate(indices):
         try:
@@ -462,22 +583,493 @@ def OrthogonalMP_REG_Parallel_V1(A, b, tol=1E-4, nnz=None, positive=False, lam=1
     return x
 
 
+def _cholesky_append(L, W, k, g, gkk):
+    '''appends one atom to the Cholesky factor L[:k, :k] of the regularized Gram matrix of the support and to its
+    inverse W[:k, :k], in place
+    Args:
+      L: preallocated lower triangular factor of size at least (k + 1, k + 1)
+      W: preallocated inverse of L of the same size
+      k: number of atoms in the support
+      g: Gram entries of the new atom with the k atoms of the support
+      gkk: Gram entry of the new atom with itself, including the regularization
+    Returns:
+       False if the new atom is numerically in the span of the support, in which case L and W are not changed
+    '''
+    l = torch.matmul(W[:k, :k], g)
+    diag = gkk - torch.dot(l, l).item()
+    if diag <= 1E-6 * gkk:
+        return False
+    L[k, :k] = l
+    L[k, k] = math.sqrt(diag)
+    W[k, :k] = -torch.matmul(l, W[:k, :k]) / L[k, k]
+    W[k, k] = 1 / L[k, k]
+    return True
+
+
+def _cholesky_delete(L, k, j):
+    '''removes the j-th atom from the Cholesky factor L[:k, :k], in place
+    Deleting row and column j leaves the trailing block L33 with L33' L33'^T = L33 L33^T + l l^T, where l is
+    the column of the removed atom below the diagonal. The rows and columns before j are not changed, so only the
+    trailing block is refactored, with a single (LAPACK) Cholesky factorization.
+    '''
+    v = L[j + 1:k, j].clone()
+    L[j:k - 1, :j] = L[j + 1:k, :j].clone()
+    if j < k - 1:
+        L33 = L[j + 1:k, j + 1:k]
+        L[j:k - 1, j:k - 1] = torch.linalg.cholesky(torch.matmul(L33, L33.t()) + torch.outer(v, v))
+    L[k - 1, :k] = 0
+
+
+def _support_delete(L, W, support, Atb, z, k, j):
+    '''removes the j-th of the k atoms of the support from the buffers of OrthogonalMP_REG_Cholesky, in place'''
+    _cholesky_delete(L, k, j)
+    support[j:k - 1] = support[j + 1:k].clone()
+    support[k - 1] = 0
+    Atb[j:k - 1] = Atb[j + 1:k].clone()
+    Atb[k - 1] = 0
+    # the first j rows of the inverse factor are not changed; its rows from j on solve L' W' = I for the
+    # downdated factor L'
+    W[k - 1] = 0
+    if j < k - 1:
+        L33 = L[j:k - 1, j:k - 1].contiguous()
+        rhs = torch.cat((-torch.matmul(L[j:k - 1, :j], W[:j, :j]),
+                         torch.eye(k - 1 - j, device=W.device, dtype=W.dtype)), dim=1)
+        W[j:k - 1, :k - 1] = torch.triangular_solve(rhs, L33, upper=False).solution
+    z[k - 1] = 0
+    z[j:k - 1] = torch.matmul(W[j:k - 1, :k - 1], Atb[:k - 1])
+
+
+def _grow(t, size, dims):
+    '''copies t into a zero tensor whose first `dims` dimensions have the given size'''
+    shape = list(t.shape)
+    for dim in range(dims):
+        shape[dim] = size
+    new_t = t.new_zeros(shape)
+    new_t[tuple(slice(0, s) for s in t.shape[:dims])] = t
+    return new_t
+
+
 # NOTE: Standard Algorithm, e.g. Tropp, ``Greed is Good: Algorithmic Results for Sparse Approximation," IEEE Trans. Info. Theory, 2004.
-def OrthogonalMP_REG_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu"):
+def OrthogonalMP_REG_Cholesky(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu", gram=None,
+                              init=None, stage_size=1, time_limit=None):
     '''approximately solves min_x |x|_0 s.t. Ax=b using Orthogonal Matching Pursuit
+    Same iterations as OrthogonalMP_REG, but instead of rebuilding the support matrix and solving
+    (A_i A_i^T + lam I) x_i = A_i b from scratch on every atom, the Cholesky factor of the regularized Gram matrix
+    is updated with one row per new atom in O(k d + k^2), and downdated in O(k^2) when the positivity loop removes
+    an atom. The inverse of the factor is updated along with it, so that every atom only needs matrix-vector
+    products with the factors, which run directly on the preallocated buffers (triangular solves would copy them).
+    The support matrix, the factors and A_i b live in preallocated buffers that grow by doubling. The factors are
+    kept in float64. Atoms that are numerically in the span of the support stop the pursuit.
+    With the Gram formulation (see _use_gram), the support buffer holds the rows of the float64 Gram matrix of the
+    atoms instead of the atoms, from which the correlations and the residual norm are computed in O(n k).
+    With a warm start, the atoms of `init` take the place of the first greedy picks: they are appended in order
+    without computing any correlations with the residual, which saves the O(n d) product of every reused atom.
+    Atoms of `init` that no longer correlate positively with b (when positive) are pruned, as are atoms whose
+    weight is negative once all of them are in the support; the pursuit then continues greedily from the
+    remaining support.
+    With stage_size > 1 the pursuit is stagewise (generalized OMP, Wang, Kwon & Shim, IEEE Trans. Signal Process.,
+    2012): every correlation with the residual adds the stage_size atoms that correlate most (positively, when
+    positive) with it, so the number of O(n d) correlations drops from nnz to about nnz / stage_size. The atoms of
+    a stage are selected before the residual accounts for the first of them, so the residual is usually somewhat
+    larger than the one of OMP.
+    Args:
+      A: design matrix of size (d, n)
+      b: measurement vector of length d
+      tol: solver tolerance
+      nnz = maximum number of nonzero coefficients (if None set to n)
+      positive: only allow positive nonzero coefficients
+      gram: run the iterations on the precomputed Gram matrix A^T A; if None it is chosen from the shape of A
+      init: column indices of the support of a previous solution to start from, e.g., in decreasing order of
+            their previous weights
+      stage_size: number of atoms added per correlation with the residual
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
+    Returns:
+       vector of length n
+    '''
+    AT = torch.transpose(A, 0, 1)
+    d, n = A.shape
+    if nnz is None:
+        nnz = n
+    if gram is None:
+        gram = _use_gram(d, n, nnz)
+    deadline = _deadline(time_limit)
+    x = torch.zeros(n, device=device)
+    normb = b.norm().item()
+    indices = []
+    warm = [] if init is None else [j for j in dict.fromkeys(int(j) for j in init) if 0 <= j < n]
+    if positive and len(warm) > 0:
+        warm = [j for j, c in zip(warm, torch.matmul(b, A[:, warm]).tolist()) if c > 0]
+    warm = warm[:nnz]
+    # atoms of the current stage that remain to be appended
+    staged = []
+    capacity = max(1, min(nnz, n, max(128, len(warm))))
+    if gram:
+        A64 = A.detach().double()
+        G = torch.matmul(torch.transpose(A64, 0, 1), A64)
+        Atb_all = torch.matmul(b.detach().double(), A64)
+        del A64
+        bb = normb ** 2
+        support = torch.zeros((capacity, n), device=device, dtype=torch.float64)
+    else:
+        support = torch.zeros((capacity, d), device=device, dtype=A.dtype)
+    L = torch.zeros((capacity, capacity), device=device, dtype=torch.float64)
+    W = torch.zeros((capacity, capacity), device=device, dtype=torch.float64)
+    Atb = torch.zeros(capacity, device=device, dtype=torch.float64)
+    # z = W A_i b, so that x_i = W^T z
+    z = torch.zeros(capacity, device=device, dtype=torch.float64)
+    x_i = Atb[:0]
+
+    for i in range(nnz):
+        queued = len(warm) > 0 or len(staged) > 0
+        if len(warm) > 0:
+            index = warm.pop(0)
+        elif len(staged) > 0:
+            index = staged.pop(0)
+        else:
+            k = len(indices)
+            if gram:
+                # x_i^T G_SS x_i = |L^T x_i|^2 - lam |x_i|^2
+                resid_sq = bb - 2 * torch.dot(x_i, Atb[:k]).item() + \
+                    torch.matmul(x_i, L[:k, :k]).square().sum().item() - lam * torch.dot(x_i, x_i).item()
+                if math.sqrt(max(resid_sq, 0.0)) / normb < tol:
+                    break
+                projections = Atb_all - torch.matmul(x_i, support[:k])
+            else:
+                resid = b - torch.matmul(torch.transpose(support[:k], 0, 1), x_i.to(A.dtype))
+                if resid.norm().item() / normb < tol:
+                    break
+                projections = torch.matmul(AT, resid)
+            if not positive:
+                projections = torch.abs(projections)
+            index = torch.argmax(projections).item()
+            if index in indices:
+                break
+            if stage_size > 1:
+                projections[indices + [index]] = -math.inf
+                values, candidates = torch.topk(projections, min(stage_size - 1, nnz - i - 1, n))
+                staged = [j for j, v in zip(candidates.tolist(), values.tolist()) if v > 0]
+        k = len(indices)
+        if k == capacity:
+            capacity = min(2 * capacity, nnz, n)
+            support = _grow(support, capacity, 1)
+            L = _grow(L, capacity, 2)
+            W = _grow(W, capacity, 2)
+            Atb = _grow(Atb, capacity, 1)
+            z = _grow(z, capacity, 1)
+        if gram:
+            atom = G[index]
+            g = atom[indices]
+            gkk = atom[index].item()
+        else:
+            atom = A[:, index]
+            g = torch.matmul(support[:k], atom).double()
+            gkk = torch.dot(atom, atom).item()
+        if _cholesky_append(L, W, k, g, gkk + lam):
+            support[k] = atom
+            Atb[k] = Atb_all[index].item() if gram else torch.dot(atom, b).item()
+            z[k] = (Atb[k] - torch.dot(L[k, :k], z[:k])) / L[k, k]
+            indices.append(index)
+            k += 1
+            x_i = torch.matmul(z[:k], W[:k, :k])
+        elif not queued:
+            break
+        expired = _expired(deadline)
+        # the weights of the warm start and of a stage are only checked once all their atoms are in the support,
+        # or when the pursuit stops at the time limit
+        if positive and (expired or (len(warm) == 0 and len(staged) == 0)):
+            while k > 0 and torch.min(x_i) < 0.0:
+                argmin = torch.argmin(x_i).item()
+                _support_delete(L, W, support, Atb, z, k, argmin)
+                indices = indices[:argmin] + indices[argmin + 1:]
+                k -= 1
+                x_i = torch.matmul(z[:k], W[:k, :k])
+        if expired:
+            break
+    x[indices] = x_i.to(x.dtype)
+    return x
+
+
+def OrthogonalMP_REG_Batched(As, bs, nnzs, tol=1E-4, positive=False, lam=1, device="cpu", time_limit=None):
+    '''approximately solves the independent problems min_x |x|_0 s.t. A_c x = b_c using Orthogonal Matching Pursuit
+    Every problem follows the iterations of OrthogonalMP_REG_Cholesky, but the problems are advanced together: the
+    design matrices are zero padded to the largest number of columns and stacked, so that the correlations, the
+    Cholesky updates and the residuals of all the problems are computed with one batched product each, and
+    problems drop out of the batch as they stop. This replaces many small products, which leave the BLAS threads
+    idle, by a few large ones. Only the removal of atoms by the positivity loop, which is rare, runs per problem.
+    Args:
+      As: list of design matrices of size (d, n_c), with the same d
+      bs: list of measurement vectors of length d
+      nnzs: list of maximum numbers of nonzero coefficients of every problem
+      tol: solver tolerance
+      positive: only allow positive nonzero coefficients
+      time_limit: maximum time in seconds, after which the solutions of the current supports are returned; if None
+                  the solver runs until nnz or tol is reached
+    Returns:
+       list of vectors of length n_c
+    '''
+    deadline = _deadline(time_limit)
+    B = len(As)
+    d = As[0].shape[0]
+    dtype = As[0].dtype
+    ns = torch.tensor([A.shape[1] for A in As], device=device)
+    n_max = int(ns.max())
+    nnzs = torch.tensor(nnzs, device=device)
+    K = max(1, int(torch.minimum(nnzs, ns).max()))
+    AT = torch.zeros((B, n_max, d), device=device, dtype=dtype)
+    for c, A in enumerate(As):
+        AT[c, :A.shape[1]] = torch.transpose(A, 0, 1)
+    b = torch.stack([b_c.detach() for b_c in bs])
+    padding = torch.arange(n_max, device=device).view(1, -1) >= ns.view(-1, 1)
+    resid = b.clone()
+    normb = b.norm(dim=1)
+    support = torch.zeros((B, K, d), device=device, dtype=dtype)
+    L = torch.zeros((B, K, K), device=device, dtype=torch.float64)
+    W = torch.zeros((B, K, K), device=device, dtype=torch.float64)
+    Atb = torch.zeros((B, K), device=device, dtype=torch.float64)
+    z = torch.zeros((B, K), device=device, dtype=torch.float64)
+    x_i = torch.zeros((B, K), device=device, dtype=torch.float64)
+    indices = torch.full((B, K), -1, device=device, dtype=torch.long)
+    k = torch.zeros(B, device=device, dtype=torch.long)
+    iters = torch.zeros(B, device=device, dtype=torch.long)
+    active = torch.ones(B, device=device, dtype=torch.bool)
+
+    rows = torch.arange(B, device=device)
+    while True:
+        active &= (iters < nnzs) & ~(resid.norm(dim=1) / normb < tol)
+        if not active.any():
+            break
+        iters += active
+        # products are computed for the whole batch, which avoids copying the stacked matrices of the
+        # active problems, and only the rows of the active problems are written back
+        projections = torch.bmm(AT, resid.unsqueeze(2)).squeeze(2)
+        if not positive:
+            projections = torch.abs(projections)
+        index = torch.argmax(projections.masked_fill(padding, -float('inf')), dim=1)
+        atom = AT[rows, index]
+        g = torch.bmm(support, atom.unsqueeze(2)).squeeze(2).double()
+        l = torch.bmm(W, g.unsqueeze(2)).squeeze(2)
+        gkk = (atom * atom).sum(dim=1).double() + lam
+        diag = gkk - (l * l).sum(dim=1)
+        # problems that select an atom of their support again stop, as in OrthogonalMP_REG, and so do problems
+        # whose new atom is numerically in the span of their support
+        repeated = (indices == index.view(-1, 1)).any(dim=1)
+        active &= ~repeated & (diag > 1E-6 * gkk)
+        a = torch.nonzero(active).view(-1)
+        if len(a) == 0:
+            break
+        ka = k[a]
+        delta = torch.sqrt(diag[a])
+        W_new = -torch.bmm(l.unsqueeze(1), W).squeeze(1)
+        L[a, ka] = l[a]
+        L[a, ka, ka] = delta
+        W[a, ka] = W_new[a] / delta.view(-1, 1)
+        W[a, ka, ka] = 1 / delta
+        support[a, ka] = atom[a]
+        Atb[a, ka] = (atom[a] * b[a]).sum(dim=1).double()
+        z[a, ka] = (Atb[a, ka] - (l[a] * z[a]).sum(dim=1)) / delta
+        indices[a, ka] = index[a]
+        k[a] += 1
+        x_i = torch.where(active.view(-1, 1), torch.bmm(z.unsqueeze(1), W).squeeze(1), x_i)
+        if positive:
+            for c in torch.nonzero(active & (x_i < 0).any(dim=1)).view(-1).tolist():
+                while k[c] > 0 and torch.min(x_i[c, :k[c]]) < 0.0:
+                    argmin = torch.argmin(x_i[c, :k[c]]).item()
+                    _support_delete(L[c], W[c], support[c], Atb[c], z[c], k[c].item(), argmin)
+                    indices[c, argmin:k[c] - 1] = indices[c, argmin + 1:k[c]].clone()
+                    indices[c, k[c] - 1] = -1
+                    k[c] -= 1
+                    x_i[c] = torch.matmul(z[c], W[c])
+        fit = torch.bmm(torch.transpose(support, 1, 2), x_i.to(dtype).unsqueeze(2)).squeeze(2)
+        resid = torch.where(active.view(-1, 1), b - fit, resid)
+        if _expired(deadline):
+            break
+
+    xs = []
+    for c in range(B):
+        x = torch.zeros(int(ns[c]), device=device)
+        x[indices[c, :k[c]]] = x_i[c, :k[c]].to(x.dtype)
+        xs.append(x)
+    return xs
+
+
+def _OrthogonalMP_REG_Parallel_V1_Rows(G, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu",
+                                       time_limit=None):
+    '''OrthogonalMP_REG_Parallel_V1 for atoms given as the rows of a gradient container, i.e., A^T = G.dense()
+    The iterations are the same as in the dense solver, but A is never formed in memory.
+    With Atb = A^T b computed once and the Gram columns of the support cached,
+      A^T resid = Atb - G_{:,S} x_S
+    For FactoredGradients every iteration costs O(n (C + D)) instead of O(n C D); MemmapGradients compute the
+    products tile by tile from disk. The residual itself is only formed from the support, which keeps the
+    stopping criterion as accurate as in the dense solver.
+    Args:
+      G: FactoredGradients or MemmapGradients of the n atoms
+      b: measurement vector of length d
+      tol: solver tolerance
+      nnz = maximum number of nonzero coefficients (if None set to n)
+      positive: only allow positive nonzero coefficients
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
+    Returns:
+       vector of length n
+    '''
+    deadline = _deadline(time_limit)
+    n = len(G)
+    if nnz is None:
+        nnz = n
+    x = torch.zeros(n, device=device)
+    Atb = G.matmul(b)
+    normb = b.norm().item()
+    indices = []
+    # atoms of the least squares problem, in the same order as the rows of A_i in the dense solver
+    support = []
+    gram_cols = None
+    x_i = None
+
+    resid = b.detach().clone()
+    for i in range(nnz):
+        if resid.norm().item() / normb < tol:
+            break
+        if x_i is None:
+            projections = Atb
+        else:
+            projections = Atb - torch.matmul(gram_cols, x_i)
+
+        if positive:
+            index = torch.argmax(projections).item()
+        else:
+            index = torch.argmax(torch.abs(projections)).item()
+
+        if index not in indices:
+            indices.append(index)
+
+        gram_col = G.inner(G[[index]])
+        if len(indices) == 1:
+            support = [index]
+            gram_cols = gram_col
+            x_i = (projections[index] / gram_col[index, 0]).view(-1)
+        else:
+            support.append(index)
+            gram_cols = torch.cat((gram_cols, gram_col), dim=1)
+            temp = gram_cols[support] + lam * torch.eye(len(support), device=device)
+            x_i = torch.linalg.lstsq(temp, Atb[support].view(-1, 1))[0].view(-1)
+            if positive:
+                while min(x_i) < 0.0:
+                    argmin = torch.argmin(x_i).item()
+                    indices = indices[:argmin] + indices[argmin + 1:]
+                    support = support[:argmin] + support[argmin + 1:]
+                    gram_cols = torch.cat((gram_cols[:, :argmin], gram_cols[:, argmin + 1:]), dim=1)
+                    temp = gram_cols[support] + lam * torch.eye(len(support), device=device)
+                    x_i = torch.linalg.lstsq(temp, Atb[support].view(-1, 1))[0].view(-1)
+        resid = b - G[support].weighted_sum(x_i)
+        if _expired(deadline):
+            break
+    for i, index in enumerate(indices):
+        x[index] += x_i[i]
+    return x
+
+
+def _OrthogonalMP_REG_Parallel_V1_Gram(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu",
+                                       time_limit=None):
+    '''OrthogonalMP_REG_Parallel_V1 on the precomputed Gram matrix of A (see _use_gram)
+    The iterations are those of _OrthogonalMP_REG_Parallel_V1_Rows, with the Gram columns of the support copied
+    from G into a preallocated buffer instead of being computed, and the residual norm computed from G. G is kept
+    in float64 so that the residual norm is accurate down to the solver tolerance.
     Args:
       A: design matrix of size (d, n)
       b: measurement vector of length d
       tol: solver tolerance
+      nnz = maximum number of nonzero coefficients
+      positive: only allow positive nonzero coefficients
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
+    Returns:
+       vector of length n
+    '''
+    deadline = _deadline(time_limit)
+    A = A.detach().double()
+    b = b.detach().double()
+    AT = torch.transpose(A, 0, 1)
+    G = torch.matmul(AT, A)
+    Atb = torch.matmul(AT, b)
+    del A, AT
+    bb = torch.dot(b, b).item()
+    n = G.shape[0]
+    x = torch.zeros(n, device=device)
+    normb = math.sqrt(bb)
+    indices = []
+    support = []
+    # rows of G of the atoms in support, in the same order
+    gram_rows = torch.zeros((nnz, n), device=device, dtype=G.dtype)
+    x_i = None
+
+    resid_sq = bb
+    for i in range(nnz):
+        if math.sqrt(max(resid_sq, 0.0)) / normb < tol:
+            break
+        if x_i is None:
+            projections = Atb
+        else:
+            projections = Atb - torch.matmul(x_i, gram_rows[:len(support)])
+
+        if positive:
+            index = torch.argmax(projections).item()
+        else:
+            index = torch.argmax(torch.abs(projections)).item()
+
+        if index not in indices:
+            indices.append(index)
+
+        if len(indices) == 1:
+            support = [index]
+            gram_rows[0] = G[index]
+            x_i = (projections[index] / G[index, index]).view(-1)
+        else:
+            gram_rows[len(support)] = G[index]
+            support.append(index)
+            temp = gram_rows[:len(support), support] + lam * torch.eye(len(support), device=device, dtype=G.dtype)
+            x_i = torch.linalg.lstsq(temp, Atb[support].view(-1, 1))[0].view(-1)
+            if positive:
+                while min(x_i) < 0.0:
+                    argmin = torch.argmin(x_i).item()
+                    indices = indices[:argmin] + indices[argmin + 1:]
+                    support = support[:argmin] + support[argmin + 1:]
+                    gram_rows[argmin:len(support)] = gram_rows[argmin + 1:len(support) + 1].clone()
+                    temp = gram_rows[:len(support), support] + \
+                        lam * torch.eye(len(support), device=device, dtype=G.dtype)
+                    x_i = torch.linalg.lstsq(temp, Atb[support].view(-1, 1))[0].view(-1)
+        resid_sq = bb - 2 * torch.dot(x_i, Atb[support]).item() + \
+            torch.dot(x_i, torch.matmul(gram_rows[:len(support), support], x_i)).item()
+        if _expired(deadline):
+            break
+    for i, index in enumerate(indices):
+        x[index] += x_i[i].item()
+    return x
+
+
+# NOTE: Standard Algorithm, e.g. Tropp, ``Greed is Good: Algorithmic Results for Sparse Approximation," IEEE Trans. Info. Theory, 2004.
+def OrthogonalMP_REG_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu", time_limit=None):
+    '''approximately solves min_x |x|_0 s.t. Ax=b using Orthogonal Matching Pursuit
+    Args:
+      A: design matrix of size (d, n), or transposed FactoredGradients or MemmapGradients whose n rows are the
+         columns of A
+      b: measurement vector of length d
+      tol: solver tolerance
       nnz = maximum number of nonzero coefficients (if None set to n)
       positive: only allow positive nonzero coefficients
+      time_limit: maximum time in seconds, after which the solution of the current support is returned; if None
+                  the solver runs until nnz or tol is reached
     Returns:
        vector of length n
     '''
+    if isinstance(A, (FactoredGradients, MemmapGradients)):
+        return _OrthogonalMP_REG_Parallel_V1_Rows(A.t(), b, tol=tol, nnz=nnz, positive=positive,
+                                                  lam=lam, device=device, time_limit=time_limit)
     AT = torch.transpose(A, 0, 1)
     d, n = A.shape
     if nnz is None:
         nnz = n
+    deadline = _deadline(time_limit)
     x = torch.zeros(n, device=device)  # ,dtype=torch.float64)
     resid = b.detach().clone()
     normb = b.norm().item()
@@ -524,6 +1116,8 @@ def OrthogonalMP_REG_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam=1, d
         #  torch.matmul(torch.transpose(A_i, 0, 1), x_i).shape)
         resid = b - torch.matmul(torch.transpose(A_i, 0, 1), x_i).view(-1)  # A_i.T.dot(x_i)
         # print("REsID",resid.shape)
+        if _expired(deadline):
+            break
 
     x_i = x_i.view(-1)
     # print(x_i.shape)
@@ -538,11 +1132,165 @@ def OrthogonalMP_REG_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam=1, d
     return x
 
 
+def _nnls_active_set(Q, c, tol=1E-10, niter=None):
+    '''solves min_x x^T Q x / 2 - c^T x s.t. x>=0 for one problem with the Lawson-Hanson active set method
+    (Bro & De Jong, ``A Fast Non-negativity-constrained Least Squares Algorithm," J. Chemometrics, 1997)
+    The Cholesky factor of the passive set and its inverse are updated one coefficient at a time, as in
+    OrthogonalMP_REG_Cholesky, and coefficients whose column is numerically in the span of the passive set are
+    skipped, so that the passive set never grows beyond the rank of Q. Used by NonnegativeLS for rank deficient
+    problems, on which block principal pivoting does not converge.
+    Args:
+      Q: float64 Gram matrix of size (n, n)
+      c: float64 vector of length n
+      tol: tolerance of the gradient, relative to the largest entry of |c|
+      niter: maximum number of coefficients that enter the passive set (if None set to 3 n)
+    Returns:
+      vector of length n
+    '''
+    n = c.shape[0]
+    if niter is None:
+        niter = 3 * n
+    device = c.device
+    x = torch.zeros(n, dtype=torch.float64, device=device)
+    thresh = tol * c.abs().max().item()
+    # rows of Q of the passive set, and the factors of its Gram matrix
+    rows = torch.zeros((n, n), dtype=torch.float64, device=device)
+    L = torch.zeros((n, n), dtype=torch.float64, device=device)
+    W = torch.zeros((n, n), dtype=torch.float64, device=device)
+    c_p = torch.zeros(n, dtype=torch.float64, device=device)
+    z = torch.zeros(n, dtype=torch.float64, device=device)
+    passive = []
+    skipped = set()
+
+    for i in range(niter + 1):
+        k = len(passive)
+        s = torch.matmul(z[:k], W[:k, :k])
+        # coefficients that turn nonpositive leave the passive set, moving x towards s as far as it stays feasible
+        while k > 0 and torch.min(s) <= 0:
+            x_p = x[passive]
+            neg = s <= 0
+            ratios = x_p[neg] / (x_p[neg] - s[neg])
+            x_p = x_p + torch.min(ratios) * (s - x_p)
+            x_p[torch.nonzero(neg).view(-1)[torch.argmin(ratios)]] = 0
+            for j in sorted(torch.nonzero(x_p <= 0).view(-1).tolist(), reverse=True):
+                _support_delete(L, W, rows, c_p, z, k, j)
+                passive = passive[:j] + passive[j + 1:]
+                x_p = torch.cat((x_p[:j], x_p[j + 1:]))
+                k -= 1
+            x.zero_()
+            x[passive] = x_p
+            skipped.clear()
+            s = torch.matmul(z[:k], W[:k, :k])
+        x.zero_()
+        x[passive] = s
+        if i == niter:
+            break
+        w = c - torch.matmul(s, rows[:k])
+        w[passive + list(skipped)] = -math.inf
+        j = torch.argmax(w).item()
+        if w[j] <= thresh:
+            break
+        if not _cholesky_append(L, W, k, rows[:k, j], Q[j, j].item()):
+            skipped.add(j)
+            continue
+        rows[k] = Q[j]
+        c_p[k] = c[j]
+        z[k] = (c_p[k] - torch.dot(L[k, :k], z[:k])) / L[k, k]
+        passive.append(j)
+    return x
+
+
+def _batched_cholesky(H):
+    '''Cholesky factors L of the batch of matrices H, with info != 0 for the matrices that are not positive
+    definite (whose factors are the identity) instead of raising, as torch.linalg.cholesky_ex, which only exists
+    from torch 1.9
+    '''
+    info = torch.zeros(H.shape[0], dtype=torch.int32, device=H.device)
+    try:
+        return torch.linalg.cholesky(H), info
+    except RuntimeError:
+        L = torch.eye(H.shape[1], dtype=H.dtype, device=H.device).repeat(H.shape[0], 1, 1)
+        for j in range(H.shape[0]):
+            try:
+                L[j] = torch.linalg.cholesky(H[j])
+            except RuntimeError:
+                info[j] = 1
+        return L, info
+
+
+# NOTE: Block principal pivoting: Kim & Park, ``Fast Nonnegative Matrix Factorization: An Active-set-like Method and Comparisons," SIAM J. Sci. Comput., 2011.
+def NonnegativeLS(AtA, Atb, x0=None, tol=1E-10, niter=20, pbar=3):
+    '''solves min_x |Ax - b|^2 s.t. x>=0, given as min_x x^T AtA x / 2 - Atb^T x, using block principal pivoting
+    Like the Lawson-Hanson active set method, every iteration solves the unconstrained least squares problem of
+    the passive (free) set, but instead of moving one coefficient in or out of the passive set per iteration, all
+    the coefficients that violate the optimality conditions are exchanged at once, falling back to one at a time
+    when the number of violations stops decreasing. The passive set of a warm start x0 is usually a few exchanges
+    away from the solution of a similar problem, so only a few factorizations are needed. A batch of problems is
+    solved together with batched Cholesky factorizations, all in torch on the device of AtA, in float64; problems
+    of different sizes can be batched by padding AtA with an identity block and Atb with zeros. Block principal
+    pivoting needs AtA to be positive definite; problems that have not converged after `niter` iterations, which
+    are usually rank deficient (e.g., fewer rows than columns in A), are solved by the Lawson-Hanson method.
+    Args:
+      AtA: Gram matrix A^T A of size (n, n), or a batch of size (B, n, n)
+      Atb: vector A^T b of length n, or a batch of size (B, n)
+      x0: starting point (warm start) of the same size as Atb, whose positive coefficients form the first
+          passive set; if None starts from 0
+      tol: tolerance of the gradient, relative to the largest entry of |Atb|
+      niter: maximum number of block principal pivoting iterations
+      pbar: number of full exchanges allowed without a decrease of the number of violations
+    Returns:
+      vector of length n, or a batch of size (B, n), in float64
+    '''
+    batched = AtA.dim() == 3
+    Q = AtA.double().reshape(-1, AtA.shape[-2], AtA.shape[-1])
+    c = Atb.double().reshape(Q.shape[0], -1)
+    B, n = c.shape
+    if x0 is None:
+        free = torch.zeros((B, n), dtype=torch.bool, device=c.device)
+    else:
+        free = x0.reshape(B, n) > 0
+    diag = Q.diagonal(dim1=1, dim2=2)
+    scaling = torch.where(diag > 0, diag, torch.ones_like(diag))
+    ridge = 1E-12 * scaling.amax(dim=1, keepdim=True).expand_as(scaling)
+    thresh = tol * c.abs().amax(dim=1, keepdim=True)
+    position = torch.arange(1, n + 1, device=c.device).expand(B, n)
+    ninf = torch.full((B,), n + 1, dtype=torch.long, device=c.device)
+    p = torch.full((B,), pbar, dtype=torch.long, device=c.device)
+
+    for i in range(niter + 1):
+        H = torch.where(free.unsqueeze(2) & free.unsqueeze(1), Q, torch.zeros_like(Q))
+        H = H + torch.diag_embed(torch.where(free, ridge, scaling))
+        L, info = _batched_cholesky(H)
+        x = torch.cholesky_solve(torch.where(free, c, torch.zeros_like(c)).unsqueeze(2), L).squeeze(2)
+        x = torch.where(free & (info == 0).unsqueeze(1), x, torch.zeros_like(x))
+        y = torch.matmul(Q, x.unsqueeze(2)).squeeze(2) - c
+        infeasible = (free & (x < 0)) | (~free & (y < -thresh))
+        count = infeasible.sum(dim=1)
+        active = (count > 0) | (info != 0)
+        if i == niter or not bool(active.any()):
+            break
+        improved = active & (count < ninf)
+        use_p = active & ~improved & (p >= 1)
+        p = torch.where(improved, torch.full_like(p, pbar), torch.where(use_p, p - 1, p))
+        ninf = torch.where(improved, count, ninf)
+        # backup rule: only the violation with the largest index is exchanged
+        last = torch.argmax(infeasible * position, dim=1)
+        single = torch.zeros_like(infeasible).scatter_(1, last.unsqueeze(1), True) & active.unsqueeze(1)
+        free ^= torch.where((improved | use_p).unsqueeze(1), infeasible, single)
+    for j in torch.nonzero(active).view(-1).tolist():
+        x[j] = _nnls_active_set(Q[j], c[j], tol=tol)
+    x = x.clamp(min=0)
+    if not batched:
+        return x.view(-1)
+    return x
+
+
 # NOTE: Standard Algorithm, e.g. Tropp, ``Greed is Good: Algorithmic Results for Sparse Approximation," IEEE Trans. Info. Theory, 2004.
 def OrthogonalMP_REG_NNLS_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam=1, device="cpu"):
     '''approximately solves min_x |x|_0 s.t. Ax=b using Orthogonal Matching Pursuit
     Args:
-      A: design matrix of size (d, n)
+      A: design matrix of size (d, n), or transposed FactoredGradients or MemmapGradients whose n rows are the
+         columns of A
       b: measurement vector of length d
       tol: solver tolerance
       nnz = maximum number of nonzero coefficients (if None set to n)
@@ -550,6 +1298,9 @@ def OrthogonalMP_REG_NNLS_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam
     Returns:
        vector of length n
     '''
+    if isinstance(A, (FactoredGradients, MemmapGradients)):
+        return _OrthogonalMP_REG_Parallel_V1_Rows(A.t(), b, tol=tol, nnz=nnz, positive=positive,
+                                                  lam=lam, device=device)
     AT = torch.transpose(A, 0, 1)
     d, n = A.shape
     if nnz is None:
@@ -581,8 +1332,10 @@ def OrthogonalMP_REG_NNLS_Parallel(A, b, tol=1E-4, nnz=None, positive=False, lam
             A_i = torch.cat((A_i, A[:, index].view(1, -1)), dim=0)  # np.vstack([A_i, A[:,index]])
             temp = torch.matmul(A_i, torch.transpose(A_i, 0, 1)) + lam * torch.eye(A_i.shape[0], device=device)
             if positive:
-                x_i, _ = nnls(temp.cpu().numpy(), torch.matmul(A_i, b).view(-1).cpu().numpy())
-                x_i = torch.from_numpy(x_i).float().to(device=device)
+                # the previous coefficients, with 0 for the new atom, are a warm start of the NNLS problem
+                x0 = torch.cat((x_i.view(-1), torch.zeros(1, device=x_i.device)))
+                x_i = NonnegativeLS(torch.matmul(temp.t(), temp), torch.matmul(temp.t(), torch.matmul(A_i, b).view(-1)),
+                                    x0=x0).float()
             else:
                 x_i, _, _, _ = torch.linalg.lstsq(temp, torch.matmul(A_i, b).view(-1, 1))
         resid = b - torch.matmul(torch.transpose(A_i, 0, 1), x_i).view(-1)  # A_i.T.dot(x_i)
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 
 np.seterr(all='raise')
@@ -14,38 +15,51 @@ import torch
 
 
 def OptimalWeights(A, b, tol=1E-4, nnz=None, device="cpu"):
-    '''approximately solves min_x |x|_0 s.t. Ax=b using Orthogonal Matching Pursuit
+    '''greedily selects the rows of A whose running sum s, together with the fixed weight w, best matches b
+    Every step selects the row a that minimizes |a + s - w b|, where s is the sum of the selected rows. Instead
+    of recomputing the distances of all the rows and deleting the selected row from A, the selected rows are
+    masked and the squared distances are updated through
+    |a + s - w b|^2 = |a|^2 + 2 <a, s> - 2 w <a, b> + |s - w b|^2,
+    where |a|^2 and <a, b> are computed once, <a, s> is updated with one product A a_j per step, and the last
+    term is the same for all the rows. Every step costs O(n d) without allocating or copying A.
     Args:
-      A: design matrix of size (d, n)
-      b: measurement vector of length d
+      A: matrix of size (n, d) whose rows are the candidates
+      b: target vector of length d
       tol: solver tolerance
-      nnz = maximum number of nonzero coefficients (if None set to n)
-      positive: only allow positive nonzero coefficients
+      nnz = number of rows to select (if None set to n)
     Returns:
-       vector of length n
+       list of the indices of the selected rows, and list of their (equal) weights
     '''
-
-    sum_sel_grad = torch.zeros_like(b,device= device)
+    n = A.shape[0]
+    if nnz is None:
+        nnz = n
+    nnz = min(nnz, n)
+    A = A.to(device)
+    b = b.to(device)
+    sum_sel_grad = torch.zeros_like(b)
     w = 1.0
 
     final_indices = []
-    remainList = [i for i in range(A.shape[0])]
+    selected = torch.zeros(n, dtype=torch.bool, device=device)
+    # the terms of the expansion are accumulated in float64, since they cancel out in the distance
+    sq_norms = A.square().sum(dim=1).double()
+    Ab = torch.matmul(A, b).double()
+    # <a, s> for every row a
+    As = torch.zeros_like(Ab)
 
     b_norm = b.norm()
 
     for i in range(nnz):
 
-        projection = (A + sum_sel_grad - w*b).norm(dim=1)
+        projection = sq_norms + 2 * (As - w * Ab)
+        projection.masked_fill_(selected, math.inf)
         index = torch.argmin(projection).item()
 
         sum_sel_grad += A[index]
-        w = torch.dot(A[index],sum_sel_grad)/b_norm
-
-        actual_idx = remainList[index]
-        final_indices.append(actual_idx)
+        As += torch.matmul(A, A[index])
+        w = (torch.dot(A[index], sum_sel_grad) / b_norm).item()
 
-        remainList.remove(actual_idx)        
-        A = torch.cat((A[:index], A[index + 1:]), dim=0)
+        final_indices.append(index)
+        selected[index] = True
 
     return final_indices, [w for _ in range(nnz)]
-
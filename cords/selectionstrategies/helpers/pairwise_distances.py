@@ -0,0 +1,251 @@
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
+from .factored_gradients import FactoredGradients
+from .memmap_gradients import MemmapGradients, release_pages
+
+
+def concat_rows(xs):
+    """
+    Concatenates a list of row blocks (dense tensors or `FactoredGradients`) into a single set of rows. A single
+    block is returned as is.
+    """
+    if not isinstance(xs, (list, tuple)):
+        return xs
+    if len(xs) == 1:
+        return xs[0]
+    if isinstance(xs[0], FactoredGradients):
+        l1 = None if xs[0].l1 is None else torch.cat([x.l1 for x in xs], dim=0)
+        return FactoredGradients(torch.cat([x.l0 for x in xs], dim=0), l1)
+    return torch.cat(xs, dim=0)
+
+
+def _tiles(x, tile_size):
+    if isinstance(x, MemmapGradients):
+        yield from x.tiles()
+    else:
+        for start in range(0, len(x), tile_size):
+            yield start, x[start:start + tile_size]
+
+
+def _sq_norms(x):
+    if isinstance(x, (FactoredGradients, MemmapGradients)):
+        return x.sq_norms()
+    return (x ** 2).sum(dim=1)
+
+
+def _tile_distances(x_i, y_j, sq_norms_i, sq_norms_j, exp):
+    if exp == 2:
+        if isinstance(x_i, FactoredGradients):
+            inner = x_i.inner(y_j)
+        else:
+            inner = torch.matmul(x_i, y_j.t())
+        return torch.clamp(sq_norms_i.view(-1, 1) + sq_norms_j.view(1, -1) - 2 * inner, min=0)
+    if isinstance(x_i, FactoredGradients):
+        raise ValueError("Only the squared euclidean distance (exp=2) is supported for factored gradients")
+    # the elementwise power has no matmul form, so the n x m x d difference is formed for a few rows at a time
+    rows = max(1, 2 ** 24 // max(1, y_j.shape[0] * y_j.shape[1]))
+    return torch.cat([torch.pow(x_i[r:r + rows].unsqueeze(1) - y_j.unsqueeze(0), exp).sum(2)
+                      for r in range(0, x_i.shape[0], rows)], dim=0)
+
+
+def _write(out, i, j, tile):
+    if isinstance(out, torch.Tensor):
+        out[i:i + tile.shape[0], j:j + tile.shape[1]] = tile
+    else:
+        out[i:i + tile.shape[0], j:j + tile.shape[1]] = tile.cpu().numpy()
+
+
+def _distance_tiles(x, y, exp, tile_size):
+    """
+    Yields the tiles ``(i, j, dist)`` of the distances between the rows of `x` and `y`.
+    """
+    same = y is None
+    if same:
+        y = x
+    sq_norms_x = _sq_norms(x) if exp == 2 else None
+    sq_norms_y = sq_norms_x if same or exp != 2 else _sq_norms(y)
+    for i, x_i in _tiles(x, tile_size):
+        for j, y_j in _tiles(y, tile_size):
+            dist = _tile_distances(x_i, y_j, None if exp != 2 else sq_norms_x[i:i + len(x_i)],
+                                   None if exp != 2 else sq_norms_y[j:j + len(y_j)], exp)
+            if same and i == j:
+                # exact zeros on the diagonal, where the expansion of the squared distance cancels out
+                dist.fill_diagonal_(0)
+            yield i, j, dist
+
+
+def pairwise_distances(x, y=None, exp=2, out=None, tile_size=2048):
+    """
+    Pairwise distances :math:`\\sum_k (x^i_k - y^j_k)^{exp}` between the rows of `x` and `y`, computed tile by tile
+    and written into `out`.
+
+    The squared euclidean distance (`exp=2`) is expanded as :math:`\\|x^i\\|^2 + \\|y^j\\|^2 - 2 \\langle x^i,
+    y^j \\rangle`, so every tile is a matrix product and no n x m x d difference is formed. Other exponents form the
+    difference for a few rows at a time.
+
+    Parameters
+    ----------
+    x: Tensor, FactoredGradients, MemmapGradients or list
+        Rows of shape (n, d), or a list of row blocks
+    y: Tensor, FactoredGradients, MemmapGradients or list, optional
+        Rows of shape (m, d). If None, the distances between the rows of `x` are computed (default: None)
+    exp: float, optional
+        The exponent value (default: 2)
+    out: Tensor or np.ndarray, optional
+        Preallocated (n, m) output of any floating point type, e.g., a float16 array or an `np.memmap`. If None, a
+        float32 tensor on the device of `x` is allocated (default: None)
+    tile_size: int, optional
+        Number of rows of a tile (default: 2048)
+
+    Returns
+    ----------
+    out: Tensor or np.ndarray
+        The distances
+    """
+    x = concat_rows(x)
+    y = concat_rows(y)
+    if out is None:
+        device = 'cpu' if isinstance(x, MemmapGradients) else x.device
+        out = torch.empty((len(x), len(x) if y is None else len(y)), device=device)
+    for i, j, dist in _distance_tiles(x, y, exp, tile_size):
+        _write(out, i, j, dist)
+    release_pages(out)
+    return out
+
+
+def similarity_kernel(x, out=None, dtype=np.float32, tile_size=2048):
+    """
+    Similarity kernel :math:`s_{ij} = c - \\|x^i - x^j\\|^2` between the rows of `x`, where :math:`c` is the largest
+    squared distance, written tile by tile into `out` without any full size temporary.
+
+    With a float32 (or float64) output, the squared distances are written first, and turned into similarities in
+    place once :math:`c` is known. A float16 output cannot hold the squared distances of large gradients, so the
+    tiles are computed twice: once to find :math:`c`, and once to write the similarities scaled by :math:`1 / c`,
+    which lie in [0, 1]. Facility location and the CRAIG weights are invariant to this scaling.
+
+    Parameters
+    ----------
+    x: Tensor, FactoredGradients, MemmapGradients or list
+        Rows of shape (n, d), e.g., the inputs of the convex formulation or the gradients, or a list of row blocks
+    out: Tensor or np.ndarray, optional
+        Preallocated (n, n) output, e.g., an `np.memmap`. If None, an array of type `dtype` is allocated
+        (default: None)
+    dtype: np.dtype, optional
+        Data type of the output if `out` is None (default: np.float32)
+    tile_size: int, optional
+        Number of rows of a tile (default: 2048)
+
+    Returns
+    ----------
+    out: np.ndarray or Tensor
+        The similarities
+    const: float
+        The largest squared distance :math:`c`
+    """
+    x = concat_rows(x)
+    n = len(x)
+    if out is None:
+        out = np.empty((n, n), dtype=dtype)
+    half = out.dtype in (torch.float16, np.float16)
+    const = 0.0
+    for i, j, dist in _distance_tiles(x, None, 2, tile_size):
+        const = max(const, torch.max(dist).item())
+        if not half:
+            _write(out, i, j, dist)
+        if j + dist.shape[1] >= n:
+            release_pages(out)
+    if half:
+        scale = 1.0 / const if const > 0 else 1.0
+        for i, j, dist in _distance_tiles(x, None, 2, tile_size):
+            _write(out, i, j, (const - dist) * scale)
+            if j + dist.shape[1] >= n:
+                release_pages(out)
+    else:
+        for i in range(0, n, tile_size):
+            out[i:i + tile_size] = const - out[i:i + tile_size]
+            release_pages(out)
+    return out, const
+
+
+def nearest(x, y, tile_size=2048):
+    """
+    Index of the nearest row of `y`, in squared euclidean distance, of every row of `x`, computed tile by tile
+    without forming the n x m distance matrix.
+
+    Parameters
+    ----------
+    x: Tensor, FactoredGradients, MemmapGradients or list
+        Rows of shape (n, d), or a list of row blocks
+    y: Tensor, FactoredGradients, MemmapGradients or list
+        Rows of shape (m, d), or a list of row blocks
+    tile_size: int, optional
+        Number of rows of a tile (default: 2048)
+
+    Returns
+    ----------
+    idxs: LongTensor
+        Indices of shape (n,) into the rows of `y`
+    """
+    x = concat_rows(x)
+    y = concat_rows(y)
+    best = torch.full((len(x),), float('inf'))
+    idxs = torch.zeros(len(x), dtype=torch.long)
+    for i, j, dist in _distance_tiles(x, y, 2, tile_size):
+        tile_best, tile_idxs = torch.min(dist.cpu(), dim=1)
+        better = tile_best < best[i:i + len(tile_best)]
+        best[i:i + len(tile_best)][better] = tile_best[better]
+        idxs[i:i + len(tile_best)][better] = tile_idxs[better] + j
+    return idxs
+
+
+def block_similarity_kernel(x, labels, tile_size=2048):
+    """
+    Block diagonal similarity kernel :math:`s_{ij} = c - \\|x^i - x^j\\|^2` between the rows of `x` of the same
+    label, and zero between rows of different labels, where :math:`c` is the largest squared distance within a
+    label.
+
+    The kernel is written block by block and tile by tile straight into the arrays of a `csr_matrix`, so it takes
+    :math:`\\sum_l n_l^2` entries for labels of :math:`n_l` rows, instead of :math:`N^2`, and no coordinate arrays
+    or dense copies are formed.
+
+    Parameters
+    ----------
+    x: Tensor, FactoredGradients, MemmapGradients or list
+        Rows of shape (N, d), e.g., the inputs of the convex formulation or the gradients, or a list of row blocks
+    labels: Tensor or np.ndarray
+        Labels of the rows
+    tile_size: int, optional
+        Number of rows of a tile (default: 2048)
+
+    Returns
+    ----------
+    kernel: csr_matrix
+        float32 similarities of shape (N, N)
+    const: float
+        The largest squared distance :math:`c` within a label
+    """
+    x = concat_rows(x)
+    n = len(x)
+    labels = torch.as_tensor(np.asarray(labels)).view(-1)
+    groups = [torch.where(labels == c)[0].numpy() for c in torch.unique(labels)]
+    sizes = np.zeros(n, dtype=np.int64)
+    for group in groups:
+        sizes[group] = len(group)
+    index_dtype = np.int32 if sizes.sum() < 2 ** 31 else np.int64
+    indptr = np.zeros(n + 1, dtype=index_dtype)
+    np.cumsum(sizes, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=index_dtype)
+    data = np.empty(indptr[-1], dtype=np.float32)
+    const = 0.0
+    for group in groups:
+        x_g = x if len(groups) == 1 else x[torch.from_numpy(group)]
+        starts = indptr[group].astype(np.int64)
+        for i, j, dist in _distance_tiles(x_g, None, 2, tile_size):
+            const = max(const, torch.max(dist).item())
+            # row i of the group holds the whole group, in increasing order, from starts[i] on
+            entries = starts[i:i + dist.shape[0], None] + np.arange(j, j + dist.shape[1])
+            data[entries] = dist.cpu().numpy()
+            indices[entries] = group[j:j + dist.shape[1]]
+    np.subtract(const, data, out=data)
+    return csr_matrix((data, indices, indptr), shape=(n, n)), const
@@ -0,0 +1,74 @@
+import math
+import numpy as np
+import torch
+from .pairwise_distances import nearest
+
+
+def _kmeans_labels(x, n_clusters, n_iters, seed):
+    """
+    Cluster of every row of `x` after `n_iters` Lloyd iterations of k-means, started from k-means++ seeds.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    seeds = [torch.randint(len(x), (1,), generator=generator).item()]
+    sq_dists = ((x - x[seeds[0]]) ** 2).sum(dim=1)
+    for _ in range(1, min(n_clusters, len(x))):
+        # rows far from the seeds so far are more likely to be the next seed
+        if sq_dists.sum() > 0:
+            seeds.append(torch.multinomial(sq_dists, 1, generator=generator).item())
+        else:
+            seeds.append(torch.randint(len(x), (1,), generator=generator).item())
+        sq_dists = torch.minimum(sq_dists, ((x - x[seeds[-1]]) ** 2).sum(dim=1))
+    centers = x[seeds].clone()
+    for _ in range(n_iters):
+        labels = nearest(x, centers)
+        counts = torch.bincount(labels, minlength=len(centers))
+        sums = torch.zeros_like(centers).index_add_(0, labels, x)
+        # empty clusters keep their center
+        nonempty = counts > 0
+        centers[nonempty] = sums[nonempty] / counts[nonempty].view(-1, 1).to(x.dtype)
+    return nearest(x, centers)
+
+
+def partition_indices(x, max_size, method='random', seed=0, n_iters=10):
+    """
+    Partitions the rows of `x` into parts of at most `max_size` rows, e.g., the partitions of a distributed greedy.
+
+    Parameters
+    ----------
+    x: Tensor or np.ndarray
+        Rows of shape (N, d). Only 'cluster' reads them
+    max_size: int
+        Maximum number of rows of a part
+    method: str, optional
+        Partitioning of the rows:
+         - 'contiguous': consecutive blocks of `max_size` rows
+         - 'random': a random permutation cut into :math:`\\lceil N / max\\_size \\rceil` parts of equal size
+         - 'cluster': the :math:`\\lceil N / max\\_size \\rceil` clusters of k-means, whose parts larger than
+                      `max_size` are cut into consecutive blocks
+        (default: 'random')
+    seed: int, optional
+        Seed of the random permutation and of the k-means++ seeds (default: 0)
+    n_iters: int, optional
+        Number of k-means iterations (default: 10)
+
+    Returns
+    ----------
+    parts: list
+        Sorted row indices of every part, as np.ndarray
+    """
+    if method not in ['contiguous', 'random', 'cluster']:
+        raise ValueError("method must be one of 'contiguous', 'random' or 'cluster'")
+    n = len(x)
+    n_parts = max(1, math.ceil(n / max_size))
+    if method == 'contiguous':
+        return [np.arange(start, min(n, start + max_size)) for start in range(0, n, max_size)]
+    if method == 'random':
+        perm = np.random.RandomState(seed).permutation(n)
+        return [np.sort(part) for part in np.array_split(perm, n_parts)]
+    x = torch.as_tensor(x).cpu().float()
+    labels = _kmeans_labels(x, n_parts, n_iters, seed).numpy()
+    parts = []
+    for cluster in np.unique(labels):
+        members = np.where(labels == cluster)[0]
+        parts.extend(members[start:start + max_size] for start in range(0, len(members), max_size))
+    return parts
@@ -0,0 +1,230 @@
+import math
+import numpy as np
+import torch
+from .pairwise_distances import pairwise_distances
+from .submodular_greedy import facility_location_greedy
+
+
+class _Sieve(object):
+    """
+    Solution of one threshold of the sieve, with the squared euclidean distance of every evaluation element to its
+    closest exemplar (or to the phantom exemplar at the origin).
+    """
+
+    def __init__(self, threshold, cover):
+        self.threshold = threshold
+        self.cover = cover
+        self.slots = []
+
+
+class SieveStreaming(object):
+    """
+    One pass streaming maximization of the facility location function with Sieve-Streaming++ (Kazemi et al., 2019),
+    a variant of Sieve-Streaming (Badanidiyuru et al., 2014).
+
+    As in the exemplar based clustering of Badanidiyuru et al., the function is evaluated on a sample :math:`E` of
+    the stream, :math:`f(S) = \\frac{1}{|E|} \\sum_{e \\in E} (d(e, e_0) - \\min_{s \\in S \\cup \\{e_0\\}} d(e, s))`,
+    where :math:`d` is the squared euclidean distance and :math:`e_0` is a phantom exemplar at the origin, so that
+    :math:`f` is monotone with :math:`f(\\emptyset) = 0`. :math:`E` is a reservoir sample of the elements seen so
+    far, of at most `eval_size` elements.
+
+    Every sieve keeps the elements whose marginal gain is at least its threshold, until it holds `budget` elements.
+    The thresholds are the powers of :math:`1 + \\epsilon` between :math:`\\max(LB, \\Delta) / (2 budget)` and
+    :math:`\\Delta`, where :math:`\\Delta` is the largest gain of a single element and :math:`LB` the value of the
+    best sieve, so the sieves below the lower bound are dropped as the stream goes. If the stream fits in the
+    sample, the best sieve is a :math:`(1/2 - \\epsilon)` approximation of the best subset of `budget` elements.
+
+    The state is the sample and the features of the elements kept by the sieves, which are stored once however
+    many sieves keep them, i.e., :math:`O(eval\\_size + budget \\log(budget) / \\epsilon)` rows at most, whatever the
+    length of the stream.
+
+    Parameters
+    ----------
+    budget: int
+        Number of selected elements
+    eval_size: int, optional
+        Maximum number of elements of the evaluation sample (default: 4096)
+    epsilon: float, optional
+        Relative spacing of the thresholds (default: 0.1)
+    seed: int, optional
+        Seed of the reservoir sample and of the completion of the selection (default: 0)
+    """
+
+    def __init__(self, budget, eval_size=4096, epsilon=0.1, seed=0):
+        if epsilon <= 0:
+            raise ValueError("epsilon must be positive")
+        self.budget = budget
+        self.eval_size = eval_size
+        self.epsilon = epsilon
+        self.seed = seed
+        self.random = np.random.RandomState(seed)
+        self.n_seen = 0
+        self.max_gain = 0.
+        self.sieves = {}
+        # evaluation sample, with the positions of its elements in the stream and their distances to the origin
+        self.eval_x = None
+        self.eval_positions = np.empty(0, dtype=np.int64)
+        self.base = None
+        # rows of the elements kept by the sieves, with their positions in the stream and the number of sieves
+        # keeping them; the rows of the elements dropped by every sieve are reused
+        self.pool_x = None
+        self.pool_positions = np.empty(0, dtype=np.int64)
+        self.pool_refs = np.empty(0, dtype=np.int64)
+        self.free = []
+
+    def _value(self, sieve):
+        n_eval = len(self.eval_positions)
+        return (self.base[:n_eval] - sieve.cover[:n_eval]).mean().item()
+
+    def _sample(self, x, positions):
+        """
+        Reservoir sampling of the batch into the evaluation sample, updating the distances of the replaced
+        elements to the solution of every sieve.
+        """
+        ranks = self.n_seen + np.arange(len(x))
+        slots = np.where(ranks < self.eval_size, ranks,
+                         (self.random.random_sample(len(x)) * (ranks + 1)).astype(np.int64))
+        rows = np.where(slots < self.eval_size)[0]
+        if len(rows) == 0:
+            return
+        if self.eval_x is None:
+            self.eval_x = torch.zeros(self.eval_size, x.shape[1], dtype=x.dtype, device=x.device)
+            self.base = torch.zeros(self.eval_size, dtype=torch.float64, device=x.device)
+            self.eval_positions = np.empty(0, dtype=np.int64)
+        # a slot replaced twice within the batch holds the last of its elements
+        _, last = np.unique(slots[rows][::-1], return_index=True)
+        rows = rows[::-1][last]
+        slots = slots[rows]
+        n_eval = max(len(self.eval_positions), slots.max() + 1)
+        self.eval_positions = np.resize(self.eval_positions, n_eval)
+        self.eval_positions[slots] = positions[rows]
+        t_rows, t_slots = torch.from_numpy(rows).to(x.device), torch.from_numpy(slots).to(x.device)
+        self.eval_x[t_slots] = x[t_rows]
+        self.base[t_slots] = (x[t_rows].double() ** 2).sum(dim=1)
+        if len(self.sieves) > 0:
+            dist = None if self.pool_x is None else pairwise_distances(x[t_rows], self.pool_x).double()
+            for sieve in self.sieves.values():
+                cover = self.base[t_slots]
+                if len(sieve.slots) > 0:
+                    cover = torch.minimum(cover, dist[:, sieve.slots].min(dim=1)[0])
+                sieve.cover[t_slots] = cover
+
+    def _keep(self, x, position):
+        """
+        Row of the pool holding the element `x`, which is added to the pool if no sieve keeps it yet.
+        """
+        match = np.where((self.pool_positions == position) & (self.pool_refs > 0))[0]
+        if len(match) > 0:
+            slot = int(match[0])
+        elif len(self.free) > 0:
+            slot = self.free.pop()
+        else:
+            slot = len(self.pool_positions)
+            if self.pool_x is None:
+                self.pool_x = torch.zeros(max(1, self.budget), x.shape[0], dtype=x.dtype, device=x.device)
+            elif slot == len(self.pool_x):
+                self.pool_x = torch.cat((self.pool_x, torch.zeros_like(self.pool_x)), dim=0)
+            self.pool_positions = np.append(self.pool_positions, -1)
+            self.pool_refs = np.append(self.pool_refs, 0)
+        self.pool_x[slot] = x
+        self.pool_positions[slot] = position
+        self.pool_refs[slot] += 1
+        return slot
+
+    def _update_thresholds(self):
+        """
+        Drops the sieves below the lower bound, and opens the sieves of the new thresholds.
+        """
+        if self.max_gain <= 0:
+            return
+        lower_bound = max([self._value(sieve) for sieve in self.sieves.values()] + [0.])
+        low = max(lower_bound, self.max_gain) / (2 * max(1, self.budget))
+        log_base = math.log(1 + self.epsilon)
+        first = math.ceil(math.log(low) / log_base) - 1
+        last = math.floor(math.log(self.max_gain) / log_base)
+        for i in [i for i in self.sieves if i < first]:
+            for slot in self.sieves.pop(i).slots:
+                self.pool_refs[slot] -= 1
+                if self.pool_refs[slot] == 0:
+                    self.free.append(slot)
+        for i in range(first, last + 1):
+            if i not in self.sieves:
+                self.sieves[i] = _Sieve((1 + self.epsilon) ** i, self.base.clone())
+
+    def update(self, x, positions=None):
+        """
+        Consumes a batch of the stream.
+
+        Parameters
+        ----------
+        x: Tensor
+            Features of the batch, of shape (B, d)
+        positions: np.ndarray, optional
+            Positions of the batch elements in the stream, which are the following `B` positions if None
+        """
+        x = x.reshape(x.shape[0], -1)
+        if len(x) == 0:
+            return
+        if positions is None:
+            positions = self.n_seen + np.arange(len(x))
+        positions = np.asarray(positions, dtype=np.int64)
+        self._sample(x, positions)
+        self.n_seen += len(x)
+        n_eval = len(self.eval_positions)
+        dist = pairwise_distances(x, self.eval_x[:n_eval]).double()
+        base = self.base[:n_eval]
+        singletons = torch.clamp(base - dist, min=0).mean(dim=1)
+        self.max_gain = max(self.max_gain, singletons.max().item())
+        self._update_thresholds()
+        for sieve in self.sieves.values():
+            # by submodularity, the gain of an element is at most its gain on its own
+            candidates = torch.where(singletons >= sieve.threshold)[0]
+            while len(sieve.slots) < self.budget and len(candidates) > 0:
+                gains = torch.clamp(sieve.cover[:n_eval] - dist[candidates], min=0).mean(dim=1)
+                passing = torch.where(gains >= sieve.threshold)[0]
+                if len(passing) == 0:
+                    break
+                row = candidates[passing[0]].item()
+                sieve.slots.append(self._keep(x[row], positions[row]))
+                sieve.cover[:n_eval] = torch.minimum(sieve.cover[:n_eval], dist[row])
+                candidates = candidates[passing[0] + 1:]
+
+    def select(self):
+        """
+        Selection of the best sieve. If it holds less than `budget` elements, it is completed by a greedy over the
+        other elements kept by the sieves and the evaluation sample, and then by elements of the stream chosen
+        uniformly at random.
+
+        Returns
+        ----------
+        ranking: np.ndarray
+            Positions in the stream of the min(`budget`, number of elements seen) selected elements
+        """
+        budget = min(self.budget, self.n_seen)
+        if len(self.sieves) == 0:
+            slots, cover = [], self.base
+        else:
+            best = max(self.sieves.values(), key=self._value)
+            slots, cover = best.slots, best.cover
+        ranking = self.pool_positions[slots].tolist() if len(slots) > 0 else []
+        if len(ranking) < budget and self.eval_x is not None:
+            n_eval = len(self.eval_positions)
+            live = np.where(self.pool_refs > 0)[0]
+            positions = np.concatenate((self.pool_positions[live], self.eval_positions))
+            positions, first = np.unique(positions, return_index=True)
+            outside = ~np.isin(positions, ranking)
+            positions, first = positions[outside], first[outside]
+            if len(positions) > 0:
+                rows = torch.cat((self.pool_x[torch.from_numpy(live)], self.eval_x[:n_eval]), dim=0) if \
+                    len(live) > 0 else self.eval_x[:n_eval]
+                rows = rows[torch.from_numpy(first).to(rows.device)]
+                # the gains of the candidates are the facility location of their improvements over the best sieve
+                residual = torch.clamp(cover[:n_eval] - pairwise_distances(rows, self.eval_x[:n_eval]).double(),
+                                       min=0).float().cpu()
+                idxs, _ = facility_location_greedy(residual, budget - len(ranking))
+                ranking += positions[idxs.numpy()].tolist()
+        if len(ranking) < budget:
+            rest = np.setdiff1d(np.arange(self.n_seen), ranking)
+            random = np.random.RandomState(self.seed)
+            ranking += rest[random.choice(len(rest), budget - len(ranking), replace=False)].tolist()
+        return np.array(ranking, dtype=np.int64)
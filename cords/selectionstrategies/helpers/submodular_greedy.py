@@ -0,0 +1,273 @@
+import heapq
+import itertools
+import math
+import time
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
+
+
+class _Kernel(object):
+    """
+    Row access to an (N, M) similarity kernel, which is a dense tensor, a dense (possibly memory mapped) array or
+    a `csr_matrix`. Rows are read in panels of at most `tile_bytes` bytes in float64, so that a memory mapped kernel
+    is never loaded as a whole.
+    """
+
+    def __init__(self, kernel, tile_bytes):
+        self.kernel = kernel
+        self.sparse = isinstance(kernel, csr_matrix)
+        self.shape = kernel.shape
+        self.panel_rows = max(1, tile_bytes // (8 * max(1, self.shape[1])))
+        if self.sparse:
+            self.indptr = torch.from_numpy(kernel.indptr.astype(np.int64))
+            self.indices = torch.from_numpy(kernel.indices.astype(np.int64))
+            self.data = torch.from_numpy(kernel.data.astype(np.float64))
+
+    def dense_rows(self, idxs):
+        """
+        Rows `idxs` (a LongTensor) as a dense float64 tensor.
+        """
+        if isinstance(self.kernel, torch.Tensor):
+            return self.kernel[idxs.to(self.kernel.device)].cpu().double()
+        return torch.from_numpy(np.asarray(self.kernel[idxs.numpy()], dtype=np.float64))
+
+    def sparse_rows(self, idxs):
+        """
+        Rows `idxs` (a LongTensor) of a sparse kernel as ``(rows, cols, vals)``, where `rows` are positions in
+        `idxs`.
+        """
+        starts = self.indptr[idxs]
+        lengths = self.indptr[idxs + 1] - starts
+        rows = torch.repeat_interleave(torch.arange(len(idxs)), lengths)
+        offsets = torch.arange(len(rows)) - torch.repeat_interleave(torch.cumsum(lengths, 0) - lengths, lengths)
+        entries = torch.repeat_interleave(starts, lengths) + offsets
+        return rows, self.indices[entries], self.data[entries]
+
+    def panels(self, idxs):
+        """
+        Iterates over the rows `idxs` in panels, yielding the position of the first row of a panel in `idxs`
+        and the panel rows.
+        """
+        for start in range(0, len(idxs), self.panel_rows):
+            yield start, idxs[start:start + self.panel_rows]
+
+    def row_sums(self):
+        sums = torch.empty(self.shape[0], dtype=torch.float64)
+        for start, panel in self.panels(torch.arange(self.shape[0])):
+            if self.sparse:
+                rows, _, vals = self.sparse_rows(panel)
+                sums[start:start + len(panel)] = torch.zeros(len(panel), dtype=torch.float64).index_add_(0, rows,
+                                                                                                         vals)
+            else:
+                sums[start:start + len(panel)] = self.dense_rows(panel).sum(dim=1)
+        return sums
+
+    def diagonal(self):
+        if self.sparse:
+            return torch.from_numpy(self.kernel.diagonal().astype(np.float64))
+        if isinstance(self.kernel, torch.Tensor):
+            return torch.diagonal(self.kernel).cpu().double()
+        return torch.from_numpy(np.asarray(np.diagonal(self.kernel), dtype=np.float64))
+
+
+class _FacilityLocation(object):
+    """
+    :math:`f(S) = \\sum_i \\max_{j \\in S} K_{ji}`, with the current maximum similarity of every element.
+    """
+
+    def __init__(self, kernel):
+        self.kernel = kernel
+        self.current = torch.zeros(kernel.shape[1], dtype=torch.float64)
+
+    def gains(self, idxs):
+        gains = torch.empty(len(idxs), dtype=torch.float64)
+        for start, panel in self.kernel.panels(idxs):
+            if self.kernel.sparse:
+                rows, cols, vals = self.kernel.sparse_rows(panel)
+                gain = torch.clamp(vals - self.current[cols], min=0)
+                gains[start:start + len(panel)] = torch.zeros(len(panel), dtype=torch.float64).index_add_(0, rows,
+                                                                                                          gain)
+            else:
+                gains[start:start + len(panel)] = torch.clamp(self.kernel.dense_rows(panel) - self.current,
+                                                              min=0).sum(dim=1)
+        return gains
+
+    def add(self, idx):
+        idx = torch.tensor([idx])
+        if self.kernel.sparse:
+            _, cols, vals = self.kernel.sparse_rows(idx)
+            self.current[cols] = torch.maximum(self.current[cols], vals)
+        else:
+            self.current = torch.maximum(self.current, self.kernel.dense_rows(idx)[0])
+
+
+class _GraphCut(object):
+    """
+    :math:`f(S) = \\alpha \\sum_{i} \\sum_{j \\in S} K_{ji} - \\sum_{i, j \\in S} K_{ji}`, as in apricot, whose
+    gains only depend on the row sums and on the similarities to the selected elements.
+    """
+
+    def __init__(self, kernel, alpha):
+        self.kernel = kernel
+        self.row_sums = alpha * kernel.row_sums()
+        self.current = kernel.diagonal()
+
+    def gains(self, idxs):
+        return self.row_sums[idxs] - self.current[idxs]
+
+    def add(self, idx):
+        idx = torch.tensor([idx])
+        if self.kernel.sparse:
+            _, cols, vals = self.kernel.sparse_rows(idx)
+            self.current.index_add_(0, cols, 2 * vals)
+        else:
+            self.current += 2 * self.kernel.dense_rows(idx)[0]
+
+
+def _greedy(function, n, budget, optimizer, epsilon, n_naive, time_limit, seed):
+    """
+    Greedy maximization of `function` over the elements ``0, ..., n - 1`` under a cardinality constraint.
+    """
+    if optimizer not in ['naive', 'lazy', 'stochastic', 'two-stage']:
+        raise ValueError("optimizer must be one of 'naive', 'lazy', 'stochastic' or 'two-stage'")
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    budget = min(budget, n)
+    remaining = torch.ones(n, dtype=torch.bool)
+    idxs, gains = [], []
+    generator = torch.Generator().manual_seed(seed)
+    sample_size = max(1, math.ceil(n / max(1, budget) * math.log(1 / epsilon)))
+    heap = None
+    # ties between equal upper bounds are broken by the order of insertion into the priority queue, as in apricot
+    counter = itertools.count()
+    while len(idxs) < budget:
+        if len(idxs) > 0 and deadline is not None and time.perf_counter() > deadline:
+            break
+        if optimizer == 'naive' or (optimizer == 'two-stage' and len(idxs) < n_naive):
+            candidates = torch.where(remaining)[0]
+            candidate_gains = function.gains(candidates)
+            best = torch.argmax(candidate_gains).item()
+            idx, gain = candidates[best].item(), candidate_gains[best].item()
+            if optimizer == 'two-stage' and len(idxs) + 1 == n_naive:
+                # the last gains of the naive stage are the upper bounds of the lazy stage
+                heap = [(-g, next(counter), i) for i, g in zip(candidates.tolist(), candidate_gains.tolist())
+                        if i != idx]
+                heapq.heapify(heap)
+        elif optimizer == 'stochastic':
+            candidates = torch.where(remaining)[0]
+            if len(candidates) > sample_size:
+                candidates = candidates[torch.randperm(len(candidates), generator=generator)[:sample_size]]
+            candidate_gains = function.gains(candidates)
+            best = torch.argmax(candidate_gains).item()
+            idx, gain = candidates[best].item(), candidate_gains[best].item()
+        else:
+            if heap is None:
+                candidates = torch.arange(n)
+                heap = [(-g, next(counter), i) for i, g in zip(candidates.tolist(),
+                                                               function.gains(candidates).tolist())]
+                heapq.heapify(heap)
+            # priority queue of upper bounds: the gain of the top element is recomputed, and it is selected if it
+            # is still at least the upper bound of every other element
+            while True:
+                _, _, idx = heapq.heappop(heap)
+                gain = function.gains(torch.tensor([idx]))[0].item()
+                if len(heap) == 0 or gain >= -heap[0][0]:
+                    break
+                heapq.heappush(heap, (-gain, next(counter), idx))
+        function.add(idx)
+        remaining[idx] = False
+        idxs.append(idx)
+        gains.append(gain)
+    return torch.tensor(idxs, dtype=torch.long), torch.tensor(gains, dtype=torch.float64)
+
+
+def facility_location_greedy(kernel, budget, optimizer='lazy', epsilon=0.01, n_naive=10, time_limit=None, seed=0,
+                             tile_bytes=2 ** 26):
+    """
+    Greedy maximization of the facility location function :math:`f(S) = \\sum_i \\max_{j \\in S} K_{ji}` of a
+    nonnegative similarity kernel :math:`K`, selecting at most `budget` rows.
+
+    The current maximum similarity of every element is kept, so the gain of a candidate is one pass over its row.
+    The kernel is read in row panels, so a memory mapped kernel is never loaded as a whole, and sparse kernels
+    (e.g., knn graphs) only touch their stored entries.
+
+    Parameters
+    ----------
+    kernel: Tensor, np.ndarray or csr_matrix
+        Similarity kernel of shape (N, M), whose row :math:`j` holds the similarities of element :math:`j` to the
+        M elements to be covered, e.g., the output of :func:`similarity_kernel` or :func:`knn_graph`
+    budget: int
+        Maximum number of selected elements
+    optimizer: str, optional
+        Greedy algorithm:
+         - 'naive': the gains of all the candidates are computed at every step
+         - 'lazy': the candidates are kept in a priority queue of upper bounds of their gains, and only the
+                   gain of the top candidate is recomputed until it stays on top
+         - 'stochastic': the best of a random sample of :math:`(N / budget) \\log(1 / \\epsilon)` candidates is
+                         selected at every step
+         - 'two-stage': naive for the first `n_naive` steps, and lazy afterwards
+        (default: 'lazy')
+    epsilon: float, optional
+        Approximation parameter of the stochastic greedy (default: 0.01)
+    n_naive: int, optional
+        Number of naive steps of the two-stage greedy (default: 10)
+    time_limit: float, optional
+        Maximum time in seconds, after which the elements selected so far are returned; if None, there is no
+        limit (default: None)
+    seed: int, optional
+        Seed of the stochastic greedy (default: 0)
+    tile_bytes: int, optional
+        Maximum size in bytes of a float64 panel of kernel rows (default: 64 MiB)
+
+    Returns
+    ----------
+    idxs: LongTensor
+        Selected rows, in the order of selection
+    gains: Tensor
+        Marginal gain of every selected row
+    """
+    kernel = _Kernel(kernel, tile_bytes)
+    return _greedy(_FacilityLocation(kernel), kernel.shape[0], budget, optimizer, epsilon, n_naive, time_limit,
+                   seed)
+
+
+def graph_cut_greedy(kernel, budget, alpha=1, optimizer='lazy', epsilon=0.01, n_naive=10, time_limit=None, seed=0,
+                     tile_bytes=2 ** 26):
+    """
+    Greedy maximization of the graph cut function :math:`f(S) = \\alpha \\sum_{i} \\sum_{j \\in S} K_{ji} -
+    \\sum_{i, j \\in S} K_{ji}` of a symmetric nonnegative similarity kernel :math:`K`, selecting at most `budget`
+    rows. The row sums are computed once, and the similarities to the selected elements are accumulated
+    incrementally.
+
+    Parameters
+    ----------
+    kernel: Tensor, np.ndarray or csr_matrix
+        Symmetric similarity kernel of shape (N, N)
+    budget: int
+        Maximum number of selected elements
+    alpha: float, optional
+        Weight of the coverage term (default: 1)
+    optimizer: str, optional
+        Greedy algorithm - 'naive' | 'lazy' | 'stochastic' | 'two-stage', see :func:`facility_location_greedy`
+        (default: 'lazy')
+    epsilon: float, optional
+        Approximation parameter of the stochastic greedy (default: 0.01)
+    n_naive: int, optional
+        Number of naive steps of the two-stage greedy (default: 10)
+    time_limit: float, optional
+        Maximum time in seconds, after which the elements selected so far are returned; if None, there is no
+        limit (default: None)
+    seed: int, optional
+        Seed of the stochastic greedy (default: 0)
+    tile_bytes: int, optional
+        Maximum size in bytes of a float64 panel of kernel rows (default: 64 MiB)
+
+    Returns
+    ----------
+    idxs: LongTensor
+        Selected rows, in the order of selection
+    gains: Tensor
+        Marginal gain of every selected row
+    """
+    kernel = _Kernel(kernel, tile_bytes)
+    return _greedy(_GraphCut(kernel, alpha), kernel.shape[0], budget, optimizer, epsilon, n_naive, time_limit, seed)
@@ -33,13 +33,49 @@ class CRAIGDataLoader(AdaptiveDSSDataLoader):
         assert "selection_type" in dss_args.keys(), "'selection_type' is a compulsory argument for CRAIG. Include it as a key in dss_args"
         assert "optimizer" in dss_args.keys(), "'optimizer' is a compulsory argument for CRAIG. Include it as a key in dss_args"
         assert "if_convex" in dss_args.keys(), "'if_convex' is a compulsory argument for CRAIG. Include it as a key in dss_args"
+        if "factored_grads" not in dss_args.keys():
+            dss_args.factored_grads = False
+        if "sketch_dim" not in dss_args.keys():
+            dss_args.sketch_dim = None
+        if "sketch_type" not in dss_args.keys():
+            dss_args.sketch_type = 'gaussian'
+        if "sketch_seed" not in dss_args.keys():
+            dss_args.sketch_seed = 0
+        if "selection_batch_size" not in dss_args.keys():
+            dss_args.selection_batch_size = None
+        if "memmap_grads" not in dss_args.keys():
+            dss_args.memmap_grads = False
+        if "memmap_dir" not in dss_args.keys():
+            dss_args.memmap_dir = None
+        if "memmap_dtype" not in dss_args.keys():
+            dss_args.memmap_dtype = 'float32'
+        if "time_limit" not in dss_args.keys():
+            dss_args.time_limit = None
+        if "max_iters" not in dss_args.keys():
+            dss_args.max_iters = None
+        if "kernel_dtype" not in dss_args.keys():
+            dss_args.kernel_dtype = 'float32'
+        if "similarity" not in dss_args.keys():
+            dss_args.similarity = 'dense'
+        if "knn_k" not in dss_args.keys():
+            dss_args.knn_k = 10
+        if "knn_method" not in dss_args.keys():
+            dss_args.knn_method = 'exact'
 
         super(CRAIGDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                 logger, *args, **kwargs)
         
         self.strategy = CRAIGStrategy(train_loader, val_loader, copy.deepcopy(dss_args.model), dss_args.loss, 
                                      dss_args.device, dss_args.num_classes, dss_args.linear_layer,  
-                                     dss_args.if_convex, dss_args.selection_type, logger, dss_args.optimizer)
+                                     dss_args.if_convex, dss_args.selection_type, logger, dss_args.optimizer,
+                                     factored_grads=dss_args.factored_grads, sketch_dim=dss_args.sketch_dim,
+                                     sketch_type=dss_args.sketch_type, sketch_seed=dss_args.sketch_seed,
+                                     selection_batch_size=dss_args.selection_batch_size,
+                                     memmap_grads=dss_args.memmap_grads, memmap_dir=dss_args.memmap_dir,
+                                     memmap_dtype=dss_args.memmap_dtype, time_limit=dss_args.time_limit,
+                                     max_iters=dss_args.max_iters, kernel_dtype=dss_args.kernel_dtype,
+                                     similarity=dss_args.similarity, knn_k=dss_args.knn_k,
+                                     knn_method=dss_args.knn_method)
         self.train_model = dss_args.model        
         self.logger.info('CRAIG dataloader initialized. ')
 
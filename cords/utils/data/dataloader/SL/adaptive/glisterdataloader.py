@@ -39,12 +39,38 @@ class GLISTERDataLoader(AdaptiveDSSDataLoader):
             assert "r" in dss_args.keys(), "'r' is a compulsory argument for RGreedy version of GLISTER. Include it as a key in dss_args"
         else:
             dss_args.r = 0
+        if "factored_grads" not in dss_args.keys():
+            dss_args.factored_grads = False
+        if "sketch_dim" not in dss_args.keys():
+            dss_args.sketch_dim = None
+        if "sketch_type" not in dss_args.keys():
+            dss_args.sketch_type = 'gaussian'
+        if "sketch_seed" not in dss_args.keys():
+            dss_args.sketch_seed = 0
+        if "selection_batch_size" not in dss_args.keys():
+            dss_args.selection_batch_size = None
+        if "memmap_grads" not in dss_args.keys():
+            dss_args.memmap_grads = False
+        if "memmap_dir" not in dss_args.keys():
+            dss_args.memmap_dir = None
+        if "memmap_dtype" not in dss_args.keys():
+            dss_args.memmap_dtype = 'float32'
+        if "time_limit" not in dss_args.keys():
+            dss_args.time_limit = None
+        if "max_iters" not in dss_args.keys():
+            dss_args.max_iters = None
         
         super(GLISTERDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                 logger, *args, **kwargs)
         
         self.strategy = GLISTERStrategy(train_loader, val_loader, copy.deepcopy(dss_args.model), dss_args.loss, dss_args.eta, dss_args.device,
-                                        dss_args.num_classes, dss_args.linear_layer, dss_args.selection_type, dss_args.greedy, logger, r=dss_args.r)
+                                        dss_args.num_classes, dss_args.linear_layer, dss_args.selection_type, dss_args.greedy, logger, r=dss_args.r,
+                                        factored_grads=dss_args.factored_grads, sketch_dim=dss_args.sketch_dim,
+                                        sketch_type=dss_args.sketch_type, sketch_seed=dss_args.sketch_seed,
+                                        selection_batch_size=dss_args.selection_batch_size,
+                                        memmap_grads=dss_args.memmap_grads, memmap_dir=dss_args.memmap_dir,
+                                        memmap_dtype=dss_args.memmap_dtype, time_limit=dss_args.time_limit,
+                                        max_iters=dss_args.max_iters)
         self.train_model = dss_args.model    
         self.logger.debug('Glister dataloader initialized. ')
 
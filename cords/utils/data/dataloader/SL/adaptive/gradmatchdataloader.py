@@ -37,12 +37,45 @@ class GradMatchDataLoader(AdaptiveDSSDataLoader):
         assert "v1" in dss_args.keys(), "'v1' is a compulsory argument for GradMatch. Include it as a key in dss_args"
         assert "lam" in dss_args.keys(), "'lam' is a compulsory argument for GradMatch. Include it as a key in dss_args"
         assert "eps" in dss_args.keys(), "'eps' is a compulsory argument for GradMatch. Include it as a key in dss_args"
+        if "factored_grads" not in dss_args.keys():
+            dss_args.factored_grads = False
+        if "sketch_dim" not in dss_args.keys():
+            dss_args.sketch_dim = None
+        if "sketch_type" not in dss_args.keys():
+            dss_args.sketch_type = 'gaussian'
+        if "sketch_seed" not in dss_args.keys():
+            dss_args.sketch_seed = 0
+        if "selection_batch_size" not in dss_args.keys():
+            dss_args.selection_batch_size = None
+        if "memmap_grads" not in dss_args.keys():
+            dss_args.memmap_grads = False
+        if "memmap_dir" not in dss_args.keys():
+            dss_args.memmap_dir = None
+        if "memmap_dtype" not in dss_args.keys():
+            dss_args.memmap_dtype = 'float32'
+        if "omp_variant" not in dss_args.keys():
+            dss_args.omp_variant = 'cholesky'
+        if "warm_start" not in dss_args.keys():
+            dss_args.warm_start = False
+        if "omp_stage_size" not in dss_args.keys():
+            dss_args.omp_stage_size = 8
+        if "time_limit" not in dss_args.keys():
+            dss_args.time_limit = None
+        if "max_iters" not in dss_args.keys():
+            dss_args.max_iters = None
 
         super(GradMatchDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                   logger, *args, **kwargs)
         self.strategy = GradMatchStrategy(train_loader, val_loader, copy.deepcopy(dss_args.model), dss_args.loss, dss_args.eta,
                                           dss_args.device, dss_args.num_classes, dss_args.linear_layer, dss_args.selection_type,
-                                          logger, dss_args.valid, dss_args.v1, dss_args.lam, dss_args.eps)
+                                          logger, dss_args.valid, dss_args.v1, dss_args.lam, dss_args.eps,
+                                          factored_grads=dss_args.factored_grads, sketch_dim=dss_args.sketch_dim,
+                                          sketch_type=dss_args.sketch_type, sketch_seed=dss_args.sketch_seed,
+                                          selection_batch_size=dss_args.selection_batch_size,
+                                          memmap_grads=dss_args.memmap_grads, memmap_dir=dss_args.memmap_dir,
+                                          memmap_dtype=dss_args.memmap_dtype, omp_variant=dss_args.omp_variant,
+                                          warm_start=dss_args.warm_start, omp_stage_size=dss_args.omp_stage_size,
+                                          time_limit=dss_args.time_limit, max_iters=dss_args.max_iters)
         self.train_model = dss_args.model
         self.logger.debug('Grad-match dataloader initialized. ')
 
@@ -3,4 +3,5 @@ from .nonadaptivedataloader import NonAdaptiveDSSDataLoader
 from .submoddataloader import FacLocDataLoader
 from .submoddataloader import GraphCutDataLoader
 from .submoddataloader import SaturatedCoverageDataLoader
-from .submoddataloader import SumRedundancyDataLoader
\ No newline at end of file
+from .submoddataloader import SumRedundancyDataLoader
+from .streamingdataloader import StreamingFacLocDataLoader
@@ -1,6 +1,8 @@
 from .nonadaptivedataloader import NonAdaptiveDSSDataLoader
 from cords.selectionstrategies.SL import CRAIGStrategy
+import numpy as np
 import time, copy
+import torch
 
 
 # CRAIG
@@ -63,10 +65,21 @@ class CRAIGDataLoader(NonAdaptiveDSSDataLoader):
         """
         start = time.time()
         self.logger.debug('Epoch: {0:d}, requires subset selection. '.format(self.cur_epoch))
+        # the gradients are those of the initial model, so the selection depends on its parameters and loss
+        data_key = self._data_key([self.dss_args.model.state_dict(), type(self.dss_args.loss).__name__,
+                                   self.dss_args.loss.state_dict()])
+        if data_key is not None:
+            selection_key = self._selection_key(data_key)
+            cached = self.cache.load(selection_key)
+            if cached is not None:
+                self.logger.info('CRAIG subset loaded from {0}. '.format(self.cache.path(selection_key)))
+                return np.array(cached['indices']).tolist(), torch.from_numpy(np.array(cached['weights']))
         cached_state_dict = copy.deepcopy(self.train_model.state_dict())
         clone_dict = copy.deepcopy(self.train_model.state_dict())
         subset_indices, subset_weights = self.strategy.select(self.budget, clone_dict)
         self.train_model.load_state_dict(cached_state_dict)
+        if data_key is not None:
+            self.cache.save(selection_key, indices=np.array(subset_indices, dtype=np.int64), weights=subset_weights)
         end = time.time()
         self.logger.info('Epoch: {0:d}, CRAIG subset selection finished, takes {1:.4f}. '.format(self.cur_epoch, (end - start)))
         return subset_indices, subset_weights
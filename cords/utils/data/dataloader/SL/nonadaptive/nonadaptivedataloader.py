@@ -1,4 +1,5 @@
 from ..dssdataloader import DSSDataLoader
+from cords.selectionstrategies.helpers import KernelCache, dataset_fingerprint, fingerprint
 
 
 class NonAdaptiveDSSDataLoader(DSSDataLoader):
@@ -6,6 +7,13 @@ class NonAdaptiveDSSDataLoader(DSSDataLoader):
     Implementation of NonAdaptiveDSSDataLoader class which serves as base class for dataloaders of other
     nonadaptive subset selection strategies for supervised learning setting.
 
+    If `dss_args.cache_dir` is set, the selections, and the features and kernels they are computed from, are kept
+    in a :class:`cords.selectionstrategies.helpers.KernelCache` under this directory, so that later runs on the
+    same data, e.g., HPO trials, reuse them (default: None). The training data is keyed by its content, see
+    :func:`cords.selectionstrategies.helpers.dataset_fingerprint`, or by `dss_args.dataset_key` if it is set, e.g.,
+    for datasets whose content cannot be fingerprinted, without which their selections are not cached (default:
+    None).
+
     Parameters
     -----------
     train_loader: torch.utils.data.DataLoader class
@@ -17,6 +25,9 @@ class NonAdaptiveDSSDataLoader(DSSDataLoader):
     logger: class
         Logger for logging the information
     """
+    # arguments of `dss_args` that do not change the selection
+    cache_ignored_args = ['device', 'cache_dir', 'n_workers']
+
     def __init__(self, train_loader, val_loader, dss_args, logger, *args,
                  **kwargs):
         """
@@ -24,6 +35,12 @@ class NonAdaptiveDSSDataLoader(DSSDataLoader):
         """
         # Arguments assertion
         assert "device" in dss_args.keys(), "'device' is a compulsory argument. Include it as a key in dss_args"
+        if "cache_dir" not in dss_args.keys():
+            dss_args.cache_dir = None
+        if "dataset_key" not in dss_args.keys():
+            dss_args.dataset_key = None
+        self.cache = None if dss_args.cache_dir is None else KernelCache(dss_args.cache_dir)
+        self.dss_args = dss_args
         self.train_loader = train_loader
         self.val_loader = val_loader
         self.initialized = False
@@ -37,5 +54,29 @@ class NonAdaptiveDSSDataLoader(DSSDataLoader):
         """
         return self.subset_loader.__iter__()
 
+    def _data_key(self, extractor):
+        """
+        Cache key of the training data in the order of the training dataloader, seen through the feature
+        extractor `extractor` (e.g., a state dict or a name), or None if there is no cache or the training data
+        cannot be fingerprinted.
+        """
+        if self.cache is None:
+            return None
+        try:
+            if self.dss_args.dataset_key is not None:
+                dataset_key = self.dss_args.dataset_key
+            else:
+                dataset_key = dataset_fingerprint(self.train_loader.dataset)
+            return fingerprint(dataset_key, type(self.train_loader.sampler).__name__, extractor)
+        except TypeError as e:
+            self.logger.warning("The selection is not cached: %s", e)
+            return None
 
-
+    def _selection_key(self, data_key):
+        """
+        Cache key of the selection of `budget` elements from the data `data_key`, with the scalar arguments of
+        `dss_args`.
+        """
+        args = {key: value for key, value in self.dss_args.items()
+                if isinstance(value, (str, int, float, bool, type(None))) and key not in self.cache_ignored_args}
+        return fingerprint(data_key, type(self).__name__, self.budget, args)
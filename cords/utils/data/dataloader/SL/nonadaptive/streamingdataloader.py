@@ -0,0 +1,95 @@
+import numpy as np
+import time
+import torch
+from .nonadaptivedataloader import NonAdaptiveDSSDataLoader
+from cords.selectionstrategies.helpers import SieveStreaming
+
+
+class StreamingFacLocDataLoader(NonAdaptiveDSSDataLoader):
+    """
+    Implementation of StreamingFacLocDataLoader class for the nonadaptive facility location based subset selection
+    strategy for supervised learning setting, in one pass over the batches of the training dataloader.
+
+    Unlike :class:`FacLocDataLoader`, the features of the whole dataset are never concatenated: the batches are
+    consumed by Sieve-Streaming++, whose state is a sample of the dataset and the features of the elements kept
+    by its sieves, see :class:`cords.selectionstrategies.helpers.SieveStreaming`. The selected indices are the
+    positions of the elements in the order of the training dataloader, as with :class:`FacLocDataLoader`, so its
+    sampler should be sequential. The optional arguments of `dss_args` are:
+
+     - `eval_size`: maximum number of elements of the sample on which the facility location is evaluated
+       (default: 4096)
+     - `epsilon`: relative spacing of the thresholds of the sieves (default: 0.1)
+     - `stream_seed`: seed of the sample (default: 0)
+
+    Parameters
+    -----------
+    train_loader: torch.utils.data.DataLoader class
+        Dataloader of the training dataset
+    val_loader: torch.utils.data.DataLoader class
+        Dataloader of the validation dataset
+    dss_args: dict
+        Data subset selection arguments dictionary
+    logger: class
+        Logger for logging the information
+    """
+
+    def __init__(self, train_loader, val_loader, dss_args, logger, *args,
+                 **kwargs):
+        """
+        Constructor function
+        """
+        # Arguments assertion
+        if "eval_size" not in dss_args.keys():
+            dss_args.eval_size = 4096
+        if "epsilon" not in dss_args.keys():
+            dss_args.epsilon = 0.1
+        if "stream_seed" not in dss_args.keys():
+            dss_args.stream_seed = 0
+        self.dss_args = dss_args
+        super(StreamingFacLocDataLoader, self).__init__(train_loader, val_loader, dss_args,
+                                                        logger, *args, **kwargs)
+        self.logger.info("You are using a streaming facility location with eval_size: %s", dss_args.eval_size)
+
+    def _extractor(self):
+        """
+        Feature extractor of the cache keys, which is the embedding layer of the model for text, and the flattening
+        of the inputs otherwise.
+        """
+        if self.dss_args.data_type == 'text':
+            return self.dss_args.model.embedding.state_dict()
+        return 'flatten'
+
+    def _batch_features(self, x):
+        """
+        Features of a batch, which are the mean word embeddings of the model for text, and the flattened inputs
+        otherwise.
+        """
+        if self.dss_args.data_type == 'text':
+            with torch.no_grad():
+                x = self.dss_args.model.embedding(x.to(self.device))
+            x = x.mean(dim=1)
+        return x.reshape(x.shape[0], -1)
+
+    def _init_subset_indices(self):
+        """
+        Initializes the subset indices by streaming the features of the training batches through the sieves, or
+        loads them from the cache.
+        """
+        start_time = time.time()
+        data_key = self._data_key(self._extractor())
+        if data_key is not None:
+            selection_key = self._selection_key(data_key)
+            cached = self.cache.load(selection_key)
+            if cached is not None:
+                self.logger.info("Submodular subset loaded from %s", self.cache.path(selection_key))
+                return np.array(cached['ranking'])
+        sieve = SieveStreaming(self.budget, eval_size=self.dss_args.eval_size, epsilon=self.dss_args.epsilon,
+                               seed=self.dss_args.stream_seed)
+        for x, _ in self.train_loader:
+            sieve.update(self._batch_features(x).float())
+        sample_indices = sieve.select()
+        if data_key is not None:
+            self.cache.save(selection_key, ranking=sample_indices)
+        self.logger.info("Streaming facility location keeps %d sieves", len(sieve.sieves))
+        self.logger.info("Submodular subset selection time is %.4f", time.time() - start_time)
+        return np.array(sample_indices)
@@ -1,9 +1,71 @@
 import numpy as np
 import apricot
 import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from .nonadaptivedataloader import NonAdaptiveDSSDataLoader
 import torch
 import time
+from cords.selectionstrategies.helpers import facility_location_greedy, fingerprint, graph_cut_greedy, knn_graph, \
+    pairwise_distances, partition_indices, similarity_kernel
+
+
+def _chunk_kernel(chunk, metric):
+    """
+    Similarity kernel of a chunk, which is the knn graph itself, or the largest squared euclidean distance
+    minus the squared euclidean distances of a dense chunk of features, as apricot computes it with
+    ``metric='euclidean'``.
+    """
+    if metric == 'precomputed':
+        return chunk
+    return similarity_kernel(torch.from_numpy(chunk))[0]
+
+
+def _facility_location(chunk, n_samples, metric):
+    """
+    Ranking of the `n_samples` elements of a chunk selected by the facility location function.
+    """
+    return facility_location_greedy(_chunk_kernel(chunk, metric), n_samples)[0].tolist()
+
+
+def _graph_cut(chunk, n_samples, metric):
+    """
+    Ranking of the `n_samples` elements of a chunk selected by the graph cut function.
+    """
+    return graph_cut_greedy(_chunk_kernel(chunk, metric), n_samples)[0].tolist()
+
+
+def _sum_redundancy(chunk, n_samples, metric):
+    """
+    Ranking of the `n_samples` elements of a chunk selected by the sum redundancy function.
+    """
+    f = apricot.functions.sumRedundancy.SumRedundancySelection(n_samples=n_samples, metric=metric)
+    m = f.fit(chunk)
+    return list(m.ranking)
+
+
+def _saturated_coverage(chunk, n_samples, metric):
+    """
+    Ranking of the `n_samples` elements of a chunk selected by the saturated coverage function.
+    """
+    f = apricot.functions.facilityLocation.FacilityLocationSelection(n_samples=n_samples, metric=metric)
+    m = f.fit(chunk)
+    return list(m.ranking)
+
+
+def _facility_location_value(kernel, idxs):
+    return float(kernel[idxs].max(axis=0).astype(np.float64).sum())
+
+
+def _graph_cut_value(kernel, idxs):
+    return float(kernel[idxs].astype(np.float64).sum() - kernel[np.ix_(idxs, idxs)].astype(np.float64).sum())
+
+
+def _init_worker(n_threads):
+    torch.set_num_threads(n_threads)
+
 
 class SubmodDataLoader(NonAdaptiveDSSDataLoader):
     # Currently split dataset with size of |max_chunk| then proportionably select samples in every chunk
@@ -11,6 +73,23 @@ class SubmodDataLoader(NonAdaptiveDSSDataLoader):
     """
     Implementation of SubmodDataLoader class for the nonadaptive submodular subset selection strategies for supervised learning setting.
 
+    With a dense similarity, the dataset is split into partitions of at most `size_chunk` elements, whose
+    selections run serially, or in parallel in a pool of `n_workers` processes. The optional arguments of `dss_args` are:
+
+     - `partition`: 'contiguous' (blocks of consecutive indices), 'random' (a random permutation) or 'cluster'
+       (k-means clusters of the features), see :func:`cords.selectionstrategies.helpers.partition_indices`
+       (default: 'contiguous')
+     - `greedi`: if True, the selection is the two round distributed greedy of GreeDi (Mirzasoleiman et al.,
+       2013). Every partition selects up to `budget` elements, and the union of the local solutions is merged
+       by a final greedy of the same function, whose solution is compared with the best local solution. With
+       'random' partitions, this is RandGreeDi (Barbosa et al., 2015), whose solution is within a constant factor
+       of the optimum in expectation. Otherwise, every partition selects its share of the budget
+       (default: False)
+     - `n_workers`: number of processes of the pool, one per core if None, or no pool if at most 1. The workers
+       are spawned, so a script that selects from more than one partition with more than one worker must guard
+       its entry point with ``if __name__ == '__main__':`` (default: 1)
+     - `partition_seed`: seed of the 'random' and 'cluster' partitions (default: 0)
+
     Parameters
     -----------
     train_loader: torch.utils.data.DataLoader class
@@ -22,6 +101,11 @@ class SubmodDataLoader(NonAdaptiveDSSDataLoader):
     logger: class
         Logger for logging the information
     """
+    # ranking of a chunk, ``submod_function(chunk, n_samples, metric)``, and value of a selection on a similarity
+    # kernel, ``submod_value(kernel, idxs)``, which is None if it is not computed
+    submod_function = None
+    submod_value = None
+
     def __init__(self, train_loader, val_loader, dss_args, logger, *args,
                  **kwargs):
         
@@ -29,18 +113,52 @@ class SubmodDataLoader(NonAdaptiveDSSDataLoader):
         Constructor function
         """
         # Arguments assertion
-        assert "size_chunk" in dss_args.keys(), "'size_chunk' is a compulsory agument for submodular dataloader"
+        if "similarity" not in dss_args.keys():
+            dss_args.similarity = 'dense'
+        if "knn_k" not in dss_args.keys():
+            dss_args.knn_k = 10
+        if "knn_method" not in dss_args.keys():
+            dss_args.knn_method = 'exact'
+        if dss_args.similarity not in ['dense', 'knn']:
+            raise ValueError("similarity must be one of 'dense' or 'knn'")
+        if "partition" not in dss_args.keys():
+            dss_args.partition = 'contiguous'
+        if "greedi" not in dss_args.keys():
+            dss_args.greedi = False
+        if "n_workers" not in dss_args.keys():
+            dss_args.n_workers = 1
+        if "partition_seed" not in dss_args.keys():
+            dss_args.partition_seed = 0
+        if dss_args.partition not in ['contiguous', 'random', 'cluster']:
+            raise ValueError("partition must be one of 'contiguous', 'random' or 'cluster'")
+        if dss_args.similarity == 'dense':
+            assert "size_chunk" in dss_args.keys(), "'size_chunk' is a compulsory agument for submodular dataloader"
+        self.n_workers = dss_args.n_workers if dss_args.n_workers is not None else os.cpu_count()
         self.size_chunk = dss_args.size_chunk
         self.dss_args = dss_args
+        # apricot computes the similarities of a dense chunk itself, and takes the knn graph as precomputed
+        self.metric = 'precomputed' if dss_args.similarity == 'knn' else 'euclidean'
         super(SubmodDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                logger, *args, **kwargs)
-        self.logger.info("You are using max_chunk: %s", dss_args.size_chunk) 
+        if dss_args.similarity == 'knn':
+            self.logger.info("You are using a knn similarity graph with k: %s", dss_args.knn_k)
+        else:
+            self.logger.info("You are using max_chunk: %s", dss_args.size_chunk)
 
-    def _init_subset_indices(self): 
+    def _extractor(self):
         """
-        Initializes the subset indices and weights by calling the respective submodular function for data subset selection.
+        Feature extractor of the cache keys, which is the embedding layer of the model for text, and the flattening
+        of the inputs otherwise.
+        """
+        if self.dss_args.data_type == 'text':
+            return self.dss_args.model.embedding.state_dict()
+        return 'flatten'
+
+    def _features(self):
+        """
+        Features of the training dataset, which are the mean word embeddings of the model for text, and the
+        flattened inputs otherwise.
         """
-        start_time = time.time()
         for i, (x, y) in enumerate(self.train_loader):
             if i == 0:
                 if self.dss_args.data_type == 'text':
@@ -61,25 +179,135 @@ class SubmodDataLoader(NonAdaptiveDSSDataLoader):
                     X_b = x
                     X_b = X_b.reshape(X_b.shape[0], -1)
                 X = torch.cat((X, X_b), dim=0)
-        m = X.shape[0]
-        X = X.to(device='cpu').numpy()
-        # Chunking dataset to calculate pairwise distance with limited memory
-        sample_indices = []
-        size_chunk, budget = self.size_chunk, self.budget
-        n_chunks = math.ceil(m / self.size_chunk)
-        budget_chunk = math.ceil(budget / n_chunks)
-        for i_chunk in range(n_chunks):
-            l_idx = i_chunk * size_chunk
-            r_idx = min(m, (i_chunk + 1) * size_chunk)
-            n_samples = min(budget_chunk, budget - len(sample_indices))
-            chunk = X[l_idx: r_idx, :]
-            _sample_indices = self._chunk_select(chunk, n_samples)
-            _sample_indices = [_sample_indice + l_idx for _sample_indice in _sample_indices]
-            sample_indices += _sample_indices
+        return X
+
+    def _init_subset_indices(self): 
+        """
+        Initializes the subset indices and weights by calling the respective submodular function for data subset selection.
+        With a cache, the selection is loaded if it is cached, and the features and the knn graph it is computed
+        from are loaded or cached otherwise.
+        """
+        start_time = time.time()
+        data_key = self._data_key(self._extractor())
+        if data_key is None:
+            sample_indices = self._select(self._features())
+        else:
+            selection_key = self._selection_key(data_key)
+            cached = self.cache.load(selection_key)
+            if cached is not None:
+                self.logger.info("Submodular subset loaded from %s", self.cache.path(selection_key))
+                return np.array(cached['ranking'])
+            features_key = fingerprint(data_key, 'features')
+            cached = self.cache.load(features_key)
+            if cached is None:
+                cached = self.cache.save(features_key, features=self._features())
+            sample_indices = self._select(torch.from_numpy(cached['features']), data_key)
+            self.cache.save(selection_key, ranking=np.array(sample_indices, dtype=np.int64))
         time_taken = time.time() - start_time
         self.logger.info("Submodular subset selection time is %.4f", time_taken)
         return np.array(sample_indices)
 
+    def _select(self, X, data_key=None):
+        """
+        Ranking of the `budget` elements selected from the features `X`, with the knn graph of the cache entry of
+        `data_key` if it is not None.
+        """
+        m = X.shape[0]
+        if self.dss_args.similarity == 'knn':
+            # the sparse knn graph of the whole dataset takes O(m k) memory, so the dataset is not chunked
+            graph_key = None if data_key is None else fingerprint(data_key, 'knn', self.dss_args.knn_k,
+                                                                  self.dss_args.knn_method)
+            cached = None if graph_key is None else self.cache.load(graph_key)
+            if cached is not None:
+                graph = cached['graph']
+            else:
+                graph, _ = knn_graph(X, self.dss_args.knn_k, method=self.dss_args.knn_method)
+                if graph_key is not None:
+                    graph = self.cache.save(graph_key, graph=graph)['graph']
+            return self._chunk_select(graph, self.budget)
+        X = X.to(device='cpu').numpy()
+        # Chunking dataset to calculate pairwise distance with limited memory
+        budget = self.budget
+        parts = partition_indices(X, self.size_chunk, method=self.dss_args.partition,
+                                  seed=self.dss_args.partition_seed)
+        if self.dss_args.greedi:
+            sample_indices = self._greedi_select(X, parts)
+        else:
+            if self.dss_args.partition == 'contiguous':
+                budget_chunk = math.ceil(budget / len(parts))
+                n_samples = [max(0, min(budget_chunk, budget - i_chunk * budget_chunk))
+                             for i_chunk in range(len(parts))]
+            else:
+                # shares of the budget proportional to the sizes of the partitions, which sum up to the budget
+                shares = np.array([budget * len(part) / m for part in parts])
+                n_samples = np.floor(shares).astype(np.int64)
+                n_samples[np.argsort(n_samples - shares)[:budget - n_samples.sum()]] += 1
+                n_samples = n_samples.tolist()
+            rankings = self._select_chunks([X[part] for part in parts], n_samples)
+            sample_indices = [int(part[i]) for part, ranking in zip(parts, rankings) for i in ranking]
+        return sample_indices
+
+    def _select_chunks(self, chunks, n_samples):
+        """
+        Rankings of the `n_samples` elements selected from every chunk, serially if `n_workers` is at most 1, and
+        in a pool of `n_workers` processes otherwise if there is more than one chunk.
+        """
+        n_workers = min(self.n_workers, len(chunks))
+        if n_workers <= 1:
+            return [self._chunk_select(chunk, n) for chunk, n in zip(chunks, n_samples)]
+        # the workers are spawned rather than forked, as the threading layers of numba, which apricot uses, are not
+        # fork safe
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(max(1, os.cpu_count() // n_workers),)) as pool:
+            return list(pool.map(self.submod_function, chunks, n_samples, repeat(self.metric)))
+
+    def _greedi_select(self, X, parts):
+        """
+        Two round distributed greedy: every partition selects up to `budget` elements in parallel, and a final
+        greedy over the union of the local solutions selects `budget` elements. If the function has a
+        `submod_value`, the merged solution is replaced by a local solution of the same size with a higher value
+        on the union.
+        """
+        budget = self.budget
+        rankings = self._select_chunks([X[part] for part in parts], [min(budget, len(part)) for part in parts])
+        local = [part[np.array(ranking, dtype=np.int64)] for part, ranking in zip(parts, rankings)]
+        union = np.unique(np.concatenate(local))
+        self.logger.info("GreeDi merges %d local solutions of %d elements", len(local), len(union))
+        if self.submod_value is None:
+            return union[np.array(self._chunk_select(X[union], budget), dtype=np.int64)].tolist()
+        kernel = self._merge_kernel(X, union)
+        merged = np.array(self.submod_function(kernel, budget, 'precomputed'), dtype=np.int64)
+        for solution in local:
+            solution = np.searchsorted(union, solution)
+            if len(solution) == len(merged) and self.submod_value(kernel, solution) > self.submod_value(kernel,
+                                                                                                         merged):
+                merged = solution
+        return union[merged].tolist()
+
+    def _merge_kernel(self, X, union):
+        """
+        Similarity kernel of the final greedy of GreeDi, between the union of the local solutions and itself.
+        """
+        return _chunk_kernel(X[union], self.metric)
+
+    def _chunk_select(self, chunk, n_samples):
+        """
+        Function that selects the data samples by calling the submodular function `submod_function`.
+
+        Parameters
+        -----------
+        chunk: numpy array or csr_matrix
+            Chunk of the input data from which the subset needs to be selected, or the knn similarity graph of
+            the whole dataset
+        n_samples: int
+            Number of samples that needs to be selected from input chunk
+        Returns
+        --------
+        ranking: list
+            Ranking of the samples based on the gain of the submodular function
+        """
+        return self.submod_function(chunk, n_samples, self.metric)
+
 
 # Submodular optimization based
 class FacLocDataLoader(SubmodDataLoader):
@@ -98,30 +326,26 @@ class FacLocDataLoader(SubmodDataLoader):
     logger: class
         Logger for logging the information
     """
+    submod_function = staticmethod(_facility_location)
+    submod_value = staticmethod(_facility_location_value)
+
     def __init__(self, train_loader, val_loader, dss_args, logger, *args,
                  **kwargs):
         
         super(FacLocDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                logger, *args, **kwargs)
 
-    def _chunk_select(self, chunk, n_samples):
+    def _merge_kernel(self, X, union):
         """
-        Function that selects the data samples by calling the facility location function.
-
-        Parameters
-        -----------
-        chunk: numpy array
-            Chunk of the input data from which the subset needs to be selected
-        n_samples: int
-            Number of samples that needs to be selected from input chunk
-        Returns
-        --------
-        ranking: list
-            Ranking of the samples based on the facility location gain 
+        Similarity kernel of the final greedy of GreeDi, between the union of the local solutions and a random
+        sample of `size_chunk` elements of the whole dataset. Facility location is a sum over the covered elements,
+        so the sample estimates the coverage of the whole dataset, rather than of the union only.
         """
-        f = apricot.functions.facilityLocation.FacilityLocationSelection(n_samples=n_samples)
-        m = f.fit(chunk)
-        return list(m.ranking)
+        m = X.shape[0]
+        sample = np.sort(np.random.RandomState(self.dss_args.partition_seed).choice(m, min(m, self.size_chunk),
+                                                                                    replace=False))
+        dist = pairwise_distances(torch.from_numpy(X[union]), torch.from_numpy(X[sample]))
+        return (torch.max(dist) - dist).numpy()
 
 
 class GraphCutDataLoader(SubmodDataLoader):
@@ -140,6 +364,8 @@ class GraphCutDataLoader(SubmodDataLoader):
     logger: class
         Logger for logging the information
     """
+    submod_function = staticmethod(_graph_cut)
+    submod_value = staticmethod(_graph_cut_value)
 
     def __init__(self, train_loader, val_loader, dss_args, logger, *args,
                  **kwargs):
@@ -147,25 +373,6 @@ class GraphCutDataLoader(SubmodDataLoader):
         super(GraphCutDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                logger, *args, **kwargs)
 
-    def _chunk_select(self, chunk, n_samples):
-        """
-        Function that selects the data samples by calling the graphcut function.
-
-        Parameters
-        -----------
-        chunk: numpy array
-            Chunk of the input data from which the subset needs to be selected
-        n_samples: int
-            Number of samples that needs to be selected from input chunk
-        Returns
-        --------
-        ranking: list
-            Ranking of the samples based on the graphcut gain 
-        """
-        f = apricot.functions.graphCut.GraphCutSelection(n_samples=n_samples)
-        m = f.fit(chunk)
-        return list(m.ranking)
-
 
 class SumRedundancyDataLoader(SubmodDataLoader):
     """
@@ -183,31 +390,14 @@ class SumRedundancyDataLoader(SubmodDataLoader):
     logger: class
         Logger for logging the information
     """
+    submod_function = staticmethod(_sum_redundancy)
+
     def __init__(self, train_loader, val_loader, dss_args, logger, *args,
                  **kwargs):
         
         super(SumRedundancyDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                logger, *args, **kwargs)
 
-    def _chunk_select(self, chunk, n_samples):
-        """
-        Function that selects the data samples by calling the sum redundancy function.
-
-        Parameters
-        -----------
-        chunk: numpy array
-            Chunk of the input data from which the subset needs to be selected
-        n_samples: int
-            Number of samples that needs to be selected from input chunk
-        Returns
-        --------
-        ranking: list
-            Ranking of the samples based on the sum redundancy gain 
-        """
-        f = apricot.functions.sumRedundancy.SumRedundancySelection(n_samples=n_samples)
-        m = f.fit(chunk)
-        return list(m.ranking)
-
 
 class SaturatedCoverageDataLoader(SubmodDataLoader):
     """
@@ -225,27 +415,10 @@ class SaturatedCoverageDataLoader(SubmodDataLoader):
     logger: class
         Logger for logging the information
     """
+    submod_function = staticmethod(_saturated_coverage)
+
     def __init__(self, train_loader, val_loader, dss_args, logger, *args,
                  **kwargs):
         
         super(SaturatedCoverageDataLoader, self).__init__(train_loader, val_loader, dss_args,
                                                logger, *args, **kwargs)
-
-    def _chunk_select(self, chunk, n_samples):
-        """
-        Function that selects the data samples by calling the saturated coverage function.
-
-        Parameters
-        -----------
-        chunk: numpy array
-            Chunk of the input data from which the subset needs to be selected
-        n_samples: int
-            Number of samples that needs to be selected from input chunk
-        Returns
-        --------
-        ranking: list
-            Ranking of the samples based on the saturated coverage gain 
-        """
-        f = apricot.functions.facilityLocation.FacilityLocationSelection(n_samples=n_samples)
-        m = f.fit(chunk)
-        return list(m.ranking)
@@ -0,0 +1,31 @@
+# Sanity checks for the factored last layer gradients
+import torch
+from cords.selectionstrategies.helpers import FactoredGradients, OrthogonalMP_REG_Parallel_V1
+
+
+def _factored(n=200, num_classes=5, embDim=8):
+    g = torch.Generator().manual_seed(0)
+    l0 = torch.randn(n, num_classes, generator=g)
+    l1 = torch.relu(torch.randn(n, embDim, generator=g))
+    return FactoredGradients(l0, l1)
+
+
+def test_factored_matches_dense():
+    grads = _factored()
+    dense = grads.dense()
+    v = torch.randn(dense.shape[1])
+    assert grads.shape == dense.shape
+    assert torch.allclose(grads.inner(), dense @ dense.t(), atol=1e-4)
+    assert torch.allclose(grads.sq_norms(), (dense ** 2).sum(dim=1), atol=1e-4)
+    assert torch.allclose(grads.sum(dim=0), dense.sum(dim=0), atol=1e-4)
+    assert torch.allclose(grads.matmul(v), dense @ v, atol=1e-4)
+
+
+def test_factored_omp():
+    grads = _factored()
+    dense = grads.dense()
+    b = dense[:100].sum(dim=0)
+    x_dense = OrthogonalMP_REG_Parallel_V1(dense.t(), b, nnz=20, positive=True, lam=0.5)
+    x_factored = OrthogonalMP_REG_Parallel_V1(grads.t(), b, nnz=20, positive=True, lam=0.5)
+    assert torch.equal(torch.nonzero(x_dense), torch.nonzero(x_factored))
+    assert torch.allclose(x_dense, x_factored, atol=1e-4)
@@ -0,0 +1,18 @@
+# Sanity checks for gradient sketching
+import torch
+from cords.selectionstrategies.helpers import GradientSketch
+
+
+def test_sketch_is_seeded():
+    grads = torch.randn(16, 300)
+    for sketch_type in ['gaussian', 'sparse', 'srht']:
+        first = GradientSketch(300, 64, sketch_type=sketch_type, seed=1).project(grads)
+        second = GradientSketch(300, 64, sketch_type=sketch_type, seed=1).project(grads)
+        assert first.shape == (16, 64)
+        assert torch.equal(first, second)
+
+
+def test_full_srht_preserves_inner_products():
+    grads = torch.randn(16, 300)
+    sketches = GradientSketch(300, 512, sketch_type='srht').project(grads)
+    assert torch.allclose(sketches @ sketches.t(), grads @ grads.t(), atol=1e-3)
@@ -0,0 +1,94 @@
+# Sanity checks for the content addressed cache of the nonadaptive selections
+import os
+import numpy as np
+import pytest
+import torch
+from scipy.sparse import csr_matrix
+from torch.utils.data import Dataset, Subset, TensorDataset
+from cords.selectionstrategies.helpers import KernelCache, dataset_fingerprint, fingerprint, knn_graph
+
+
+def _mapped(array):
+    # an array is memory mapped if one of its bases is
+    while array is not None and not isinstance(array, np.memmap):
+        array = getattr(array, 'base', None)
+    return array is not None
+
+
+def test_fingerprint():
+    x = torch.arange(12.).view(3, 4)
+    assert fingerprint(x, 'euclidean') == fingerprint(x.numpy().copy(), 'euclidean')
+    assert fingerprint(x, 'euclidean') != fingerprint(x, 'knn')
+    assert fingerprint(x) != fingerprint(x.view(4, 3)) != fingerprint(x.double())
+    assert fingerprint({'b': 1, 'a': x}) == fingerprint({'a': x, 'b': 1})
+    dataset = TensorDataset(torch.randn(100, 3), torch.arange(100))
+    assert dataset_fingerprint(dataset) == dataset_fingerprint(TensorDataset(*dataset.tensors))
+    changed = dataset.tensors[0].clone()
+    changed[37] += 1
+    assert dataset_fingerprint(dataset) != dataset_fingerprint(TensorDataset(changed, dataset.tensors[1]))
+    assert dataset_fingerprint(Subset(dataset, [1, 2])) != dataset_fingerprint(Subset(dataset, [2, 1]))
+    # objects without a stable content, e.g., whose repr holds their address, are not fingerprinted
+    with pytest.raises(TypeError):
+        fingerprint(object())
+
+
+class _Augmented(Dataset):
+    # a dataset whose items go through a random transform, as the training sets of cords do
+    def __init__(self, data, targets):
+        self.data, self.targets = data, targets
+
+    def __getitem__(self, idx):
+        return self.data[idx] + torch.randn(self.data.shape[1:]), self.targets[idx]
+
+    def __len__(self):
+        return len(self.data)
+
+
+def test_dataset_fingerprint_skips_transforms():
+    data, targets = torch.randn(100, 3), list(range(100))
+    assert dataset_fingerprint(_Augmented(data, targets)) == dataset_fingerprint(_Augmented(data.clone(), targets))
+    assert dataset_fingerprint(_Augmented(data, targets)) != dataset_fingerprint(_Augmented(data, targets[::-1]))
+
+
+class _Text(Dataset):
+    # a dataset holding token indices of varying lengths, as the text datasets of cords do
+    def __init__(self, phrase_vec, labels):
+        self.phrase_vec, self.labels, self.name = phrase_vec, labels, 'train'
+
+    def __getitem__(self, idx):
+        return self.phrase_vec[idx], self.labels[idx]
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def test_dataset_fingerprint_of_held_tensors():
+    phrase_vec, labels = [torch.randint(100, (n,)) for n in range(1, 20)], torch.randint(2, (19,))
+    key = dataset_fingerprint(_Text(phrase_vec, labels))
+    assert key == dataset_fingerprint(_Text([p.clone() for p in phrase_vec], labels.clone()))
+    assert key != dataset_fingerprint(_Text(phrase_vec, 1 - labels))
+    assert key != dataset_fingerprint(_Text(phrase_vec[::-1], labels))
+    # a dataset holding no tensor has no content to fingerprint
+    with pytest.raises(TypeError):
+        dataset_fingerprint(_Text([], []))
+
+
+def test_kernel_cache(tmp_path):
+    cache = KernelCache(str(tmp_path))
+    x = torch.randn(50, 4)
+    graph, _ = knn_graph(x, 5)
+    key = fingerprint('knn', x)
+    assert cache.load(key) is None
+    cache.save(key, graph=graph, features=x, ranking=np.arange(7))
+    # entries are opened as memory maps, without copies
+    entry = KernelCache(str(tmp_path)).load(key)
+    assert _mapped(entry['features']) and np.array_equal(entry['features'], x.numpy())
+    assert isinstance(entry['graph'], csr_matrix) and _mapped(entry['graph'].data)
+    assert (entry['graph'] != graph).nnz == 0
+    assert np.array_equal(entry['ranking'], np.arange(7))
+    # copy on write arrays leave the files untouched
+    entry['features'][:] = 0
+    assert np.array_equal(cache.load(key)['features'], x.numpy())
+    # an existing entry is kept
+    assert np.array_equal(cache.save(key, ranking=np.arange(3))['ranking'], np.arange(7))
+    assert [name for name in os.listdir(str(tmp_path)) if name.startswith('.tmp')] == []
@@ -0,0 +1,54 @@
+# Sanity checks for the sparse knn similarity graphs
+import numpy as np
+import torch
+from cords.selectionstrategies.helpers import knn_graph, nearest, FactoredGradients
+
+
+def _rows(n=400, d=8, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    # well separated clusters, so that the approximate search finds the exact neighbours
+    centers = 10 * torch.randn(20, d, generator=g)
+    return centers[torch.arange(n) % 20] + torch.randn(n, d, generator=g)
+
+
+def _knn(x, k):
+    return torch.topk(torch.cdist(x.double(), x.double()), k, largest=False).indices
+
+
+def test_exact_knn_graph():
+    x = _rows()
+    graph, const = knn_graph(x, 5, tile_size=64)
+    dense = graph.toarray()
+    assert np.array_equal(dense, dense.T)
+    assert graph.nnz <= 2 * 5 * len(x)
+    true = _knn(x, 5)
+    for i in range(len(x)):
+        assert set(true[i].tolist()) <= set(graph[i].indices.tolist())
+        assert np.isclose(dense[i, i], const)
+    i, j = graph.nonzero()
+    assert np.allclose(dense[i, j], const - ((x[i] - x[j]) ** 2).sum(1).numpy(), rtol=1e-4, atol=1e-2)
+
+
+def test_rp_tree_knn_graph():
+    x = _rows()
+    graph, _ = knn_graph(x, 5, method='rp_tree', leaf_size=64, n_trees=8)
+    true = _knn(x, 5)
+    recall = np.mean([len(set(true[i].tolist()) & set(graph[i].indices.tolist())) / 5 for i in range(len(x))])
+    assert recall > 0.9
+
+
+def test_knn_graph_labels_and_factored():
+    g = torch.Generator().manual_seed(0)
+    grads = FactoredGradients(torch.randn(300, 4, generator=g), torch.randn(300, 6, generator=g))
+    labels = torch.randint(0, 3, (300,), generator=g)
+    graph, _ = knn_graph(grads, 4, labels=labels, tile_size=64)
+    dense, _ = knn_graph(grads.dense(), 4, labels=labels, tile_size=64)
+    i, j = graph.nonzero()
+    assert torch.all(labels[i] == labels[j])
+    assert np.array_equal(graph.indices, dense.indices)
+
+
+def test_nearest():
+    x = _rows()
+    y = x[:30] + 0.1
+    assert torch.equal(nearest(x, y, tile_size=64), torch.argmin(torch.cdist(x, y), dim=1))
@@ -0,0 +1,30 @@
+# Sanity checks for the label index
+import torch
+from torch.utils.data import DataLoader, Dataset, TensorDataset, random_split
+from cords.selectionstrategies.helpers import LabelIndex
+
+
+class LabeledDataset(Dataset):
+    def __init__(self, targets):
+        self.targets = targets
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        return torch.zeros(2), self.targets[idx]
+
+
+def loader_labels(loader):
+    return torch.cat([targets for _, targets in loader])
+
+
+def test_labels_match_loader_order():
+    dataset = LabeledDataset(torch.randint(0, 4, (50,)).tolist())
+    train, _ = random_split(dataset, [30, 20], generator=torch.Generator().manual_seed(0))
+    for ds in [dataset, train, TensorDataset(torch.zeros(50, 2), torch.randint(0, 4, (50,)))]:
+        loader = DataLoader(ds, batch_size=8, shuffle=False)
+        label_index = LabelIndex.from_loader(loader)
+        assert torch.equal(label_index.labels, loader_labels(loader))
+        assert LabelIndex.from_loader(loader) is label_index
+        assert torch.equal(label_index.class_indices(1), torch.where(loader_labels(loader) == 1)[0])
@@ -0,0 +1,47 @@
+# Sanity checks for the memory mapped gradient store
+import torch
+from cords.selectionstrategies.helpers import GradientStore, MemmapGradients, MemmapGradientStore, \
+    OrthogonalMP_REG_Parallel_V1
+
+
+def _stores(n=200, num_classes=5, embDim=8, batch_size=32, dtype=torch.float32):
+    g = torch.Generator().manual_seed(0)
+    dense = GradientStore(n, num_classes, embDim, True, 'cpu')
+    memmap = MemmapGradientStore(n, num_classes, embDim, True, 'cpu', dtype=dtype)
+    for start in range(0, n, batch_size):
+        l0 = torch.randn(min(batch_size, n - start), num_classes, generator=g)
+        l1 = torch.relu(torch.randn(l0.shape[0], embDim, generator=g))
+        dense.append(l0, l1)
+        memmap.append(l0, l1)
+    # Small tiles, so that every operation runs over several of them
+    grads = memmap.gradients()
+    return dense.gradients(), MemmapGradients(grads.data, tile_bytes=16 * 4 * grads.shape[1])
+
+
+def test_memmap_matches_dense():
+    dense, grads = _stores()
+    v = torch.randn(dense.shape[1])
+    w = torch.rand(dense.shape[0])
+    assert grads.shape == dense.shape
+    assert torch.equal(grads.dense(), dense)
+    assert torch.allclose(grads.matmul(v), dense @ v, atol=1e-4)
+    assert torch.allclose(grads.sum(dim=0), dense.sum(dim=0), atol=1e-4)
+    assert torch.allclose(grads.weighted_sum(w), w @ dense, atol=1e-4)
+    assert torch.allclose(grads[[3, 7]].inner(), dense[[3, 7]] @ dense[[3, 7]].t(), atol=1e-4)
+    assert torch.allclose(grads.sq_norms(), (dense ** 2).sum(dim=1), atol=1e-4)
+    assert torch.equal(grads.columns([0, 9]), dense[:, [0, 9]])
+
+
+def test_memmap_float16():
+    dense, grads = _stores(dtype=torch.float16)
+    assert grads.data.dtype.itemsize == 2
+    assert torch.allclose(grads.dense(), dense, atol=1e-2, rtol=1e-3)
+
+
+def test_memmap_omp():
+    dense, grads = _stores()
+    b = dense[:100].sum(dim=0)
+    x_dense = OrthogonalMP_REG_Parallel_V1(dense.t(), b, nnz=20, positive=True, lam=0.5)
+    x_memmap = OrthogonalMP_REG_Parallel_V1(grads.t(), b, nnz=20, positive=True, lam=0.5)
+    assert torch.equal(torch.nonzero(x_dense), torch.nonzero(x_memmap))
+    assert torch.allclose(x_dense, x_memmap, atol=1e-4)
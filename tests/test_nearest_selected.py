@@ -0,0 +1,42 @@
+# Sanity checks for the tiled assignment of elements to their most similar selected element
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
+from cords.selectionstrategies.helpers import nearest_selected
+from cords.selectionstrategies.helpers.memmap_gradients import memmap_array
+
+
+def _kernel(n=150, m=120, seed=0):
+    rng = np.random.RandomState(seed)
+    # few distinct values, so that there are ties
+    return rng.randint(0, 5, size=(n, m)).astype(np.float32)
+
+
+def test_nearest_selected_dense():
+    kernel = _kernel()
+    idxs = [7, 3, 50, 99, 103]
+    expected = np.argmax(kernel[idxs], axis=0)
+    # tiles of a few columns
+    for k in [kernel, torch.from_numpy(kernel)]:
+        rep, best = nearest_selected(k, idxs, tile_bytes=4 * len(idxs) * 7)
+        assert np.array_equal(rep, expected)
+        assert np.array_equal(best, kernel[idxs].max(axis=0))
+    mm = memmap_array(kernel.shape)
+    mm[:] = kernel
+    assert np.array_equal(nearest_selected(mm, np.array(idxs), tile_bytes=64)[0], expected)
+
+
+def test_nearest_selected_sparse():
+    kernel = _kernel()
+    kernel[kernel < 3] = 0
+    sparse = csr_matrix(kernel)
+    idxs = torch.tensor([10, 20, 30, 40, 140])
+    dense = kernel[idxs.numpy()]
+    stored = (sparse[idxs.numpy()].toarray() != 0).any(axis=0)
+    # panels of a few rows, with the first largest entry kept across panels
+    rep, best = nearest_selected(sparse, idxs, tile_bytes=8 * 40)
+    assert np.array_equal(rep[stored], np.argmax(dense, axis=0)[stored])
+    assert np.array_equal(best[stored], dense.max(axis=0)[stored])
+    assert np.all(rep[~stored] == -1) and np.all(np.isneginf(best[~stored]))
+    gamma = np.bincount(rep[rep >= 0], minlength=len(idxs))
+    assert gamma.sum() == stored.sum()
@@ -0,0 +1,139 @@
+# Sanity checks for the OMP solvers
+import numpy as np
+import torch
+from scipy.optimize import nnls
+from cords.selectionstrategies.helpers import OrthogonalMP_REG, OrthogonalMP_REG_Cholesky, OrthogonalMP_REG_Batched, \
+    OrthogonalMP_REG_Parallel_V1, NonnegativeLS
+from cords.selectionstrategies.helpers.omp_solvers import _batched_cholesky, _cholesky_delete
+
+
+def _problem(d=100, n=400):
+    g = torch.Generator().manual_seed(0)
+    A = torch.relu(torch.randn(d, n, generator=g))
+    A[:d // 2] -= 0.3
+    return A, A[:, :n // 2].sum(dim=1)
+
+
+def test_cholesky_delete():
+    g = torch.Generator().manual_seed(0)
+    M = torch.randn(8, 20, generator=g, dtype=torch.float64)
+    G = M @ M.t() + 0.1 * torch.eye(8, dtype=torch.float64)
+    L = torch.zeros(8, 8, dtype=torch.float64)
+    L[:, :] = torch.linalg.cholesky(G)
+    _cholesky_delete(L, 8, 3)
+    keep = [0, 1, 2, 4, 5, 6, 7]
+    assert torch.allclose(L[:7, :7], torch.linalg.cholesky(G[keep][:, keep]))
+    assert torch.all(L[7] == 0)
+
+
+def test_cholesky_omp_matches_lstsq():
+    A, b = _problem()
+    x_lstsq = OrthogonalMP_REG(A.numpy(), b.numpy(), nnz=40, positive=True, lam=0)
+    x_chol = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0)
+    assert np.nonzero(x_lstsq)[0].tolist() == torch.nonzero(x_chol).view(-1).tolist()
+    assert np.allclose(x_lstsq, x_chol.numpy(), atol=1e-4)
+
+
+def test_cholesky_omp_regularized():
+    A, b = _problem()
+    lam = 0.5
+    x = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=lam)
+    support = torch.nonzero(x).view(-1)
+    A_i = A[:, support].double()
+    x_i = torch.linalg.solve(A_i.t() @ A_i + lam * torch.eye(len(support), dtype=torch.float64), A_i.t() @ b.double())
+    assert torch.all(x >= 0)
+    assert torch.allclose(x[support].double(), x_i, atol=1e-4)
+
+
+def test_batched_omp_matches_single():
+    problems = [_problem(d=60, n=n) for n in [150, 220, 90]]
+    nnzs = [20, 30, 10]
+    xs = OrthogonalMP_REG_Batched([A for A, _ in problems], [b for _, b in problems], nnzs, positive=True, lam=0.5)
+    for (A, b), nnz, x in zip(problems, nnzs, xs):
+        x_single = OrthogonalMP_REG_Cholesky(A, b, nnz=nnz, positive=True, lam=0.5)
+        assert x.shape == x_single.shape
+        assert torch.equal(torch.nonzero(x), torch.nonzero(x_single))
+        assert torch.allclose(x, x_single, atol=1e-4)
+
+
+def test_gram_omp_matches_direct():
+    A, b = _problem(d=400, n=150)
+    for solver in [OrthogonalMP_REG_Parallel_V1, OrthogonalMP_REG_Cholesky]:
+        x_direct = solver(A, b, nnz=30, positive=True, lam=0.5, gram=False)
+        x_gram = solver(A, b, nnz=30, positive=True, lam=0.5, gram=True)
+        assert torch.equal(torch.nonzero(x_direct), torch.nonzero(x_gram))
+        assert torch.allclose(x_direct, x_gram, atol=1e-4)
+    x_direct = OrthogonalMP_REG(A.numpy(), b.numpy(), nnz=30, positive=True, lam=0.5, gram=False)
+    x_gram = OrthogonalMP_REG(A.numpy(), b.numpy(), nnz=30, positive=True, lam=0.5, gram=True)
+    assert np.nonzero(x_direct)[0].tolist() == np.nonzero(x_gram)[0].tolist()
+    assert np.allclose(x_direct, x_gram, atol=1e-4)
+
+
+def test_cholesky_omp_warm_start():
+    A, b = _problem()
+    A[:, -1] = -A[:, -1]
+    x_cold = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0.5)
+    support = torch.nonzero(x_cold).view(-1)
+    init = support[torch.argsort(x_cold[support], descending=True)].tolist()
+    # the last atom does not correlate positively with b and is pruned from the warm start
+    assert torch.dot(A[:, -1], b) < 0
+    x_warm = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0.5, init=[A.shape[1] - 1] + init)
+    assert x_warm[-1] == 0
+    # the atoms of the warm start are kept, and free atoms of the budget are filled greedily
+    assert set(init) <= set(torch.nonzero(x_warm).view(-1).tolist())
+    assert (b - torch.matmul(A, x_warm)).norm() <= (b - torch.matmul(A, x_cold)).norm() + 1e-4
+
+
+def test_nonnegative_ls_matches_scipy():
+    g = torch.Generator().manual_seed(0)
+    for d, n in [(200, 80), (60, 120)]:
+        A = torch.randn(d, n, generator=g, dtype=torch.float64)
+        bs = [torch.matmul(A, torch.relu(torch.randn(n, generator=g, dtype=torch.float64))) +
+              0.1 * torch.randn(d, generator=g, dtype=torch.float64) for _ in range(3)]
+        Q, c = torch.matmul(A.t(), A), torch.stack([torch.matmul(A.t(), b) for b in bs])
+        x_batch = NonnegativeLS(Q.expand(3, n, n), c)
+        for b, x in zip(bs, x_batch):
+            x_scipy, resid = nnls(A.numpy(), b.numpy())
+            assert torch.all(x >= 0)
+            assert np.isclose((b - torch.matmul(A, x)).norm().item(), resid, atol=1e-6)
+        assert torch.allclose(NonnegativeLS(Q, c[0]), x_batch[0])
+        # the solution of a perturbed problem is a warm start
+        x_warm = NonnegativeLS(Q, c[1], x0=x_batch[0])
+        assert torch.allclose(torch.matmul(A, x_warm), torch.matmul(A, x_batch[1]), atol=1e-6)
+
+
+def test_batched_cholesky_flags_failures():
+    G = torch.randn(5, 5, dtype=torch.float64)
+    H = torch.stack([G @ G.t() + torch.eye(5, dtype=torch.float64), -torch.eye(5, dtype=torch.float64)])
+    L, info = _batched_cholesky(H)
+    assert info.tolist() == [0, 1]
+    assert torch.allclose(L[0] @ L[0].t(), H[0])
+    assert torch.equal(L[1], torch.eye(5, dtype=torch.float64))
+
+
+def test_stagewise_omp():
+    A, b = _problem()
+    x_omp = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0)
+    x_stage = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0, stage_size=4)
+    support = torch.nonzero(x_stage).view(-1)
+    assert 0 < len(support) <= 40
+    assert torch.all(x_stage >= 0)
+    # the weights are the least squares fit of the selected support
+    x_i = torch.linalg.lstsq(A[:, support].double(), b.double().view(-1, 1)).solution.view(-1)
+    assert torch.allclose(x_stage[support].double(), x_i, atol=1e-4)
+    assert (b - torch.matmul(A, x_stage)).norm() <= 1.5 * (b - torch.matmul(A, x_omp)).norm()
+
+
+def test_omp_time_limit():
+    A, b = _problem()
+    x_full = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0)
+    # an expired time limit stops after the first iteration, with the fit of the current support
+    for x in [OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0, time_limit=0),
+              OrthogonalMP_REG_Parallel_V1(A, b, nnz=40, positive=True, lam=0, time_limit=0),
+              OrthogonalMP_REG_Batched([A], [b], [40], positive=True, lam=0, time_limit=0)[0],
+              torch.from_numpy(OrthogonalMP_REG(A.numpy(), b.numpy(), nnz=40, positive=True, lam=0, time_limit=0))]:
+        assert len(torch.nonzero(x)) == 1
+        assert torch.all(x >= 0)
+        assert torch.nonzero(x).item() in torch.nonzero(x_full).view(-1).tolist()
+    x = OrthogonalMP_REG_Cholesky(A, b, nnz=40, positive=True, lam=0, time_limit=60)
+    assert torch.equal(x, x_full)
@@ -0,0 +1,36 @@
+# Sanity checks for the fixed weight greedy selection
+import torch
+from cords.selectionstrategies.helpers import OptimalWeights
+
+
+def _reference(A, b, nnz):
+    # recomputes the distances of all the remaining rows on every step
+    sum_sel_grad = torch.zeros_like(b)
+    w = 1.0
+    remaining = list(range(A.shape[0]))
+    indices = []
+    for _ in range(nnz):
+        dist = (A[remaining] + sum_sel_grad - w * b).norm(dim=1)
+        index = remaining.pop(torch.argmin(dist).item())
+        sum_sel_grad += A[index]
+        w = (torch.dot(A[index], sum_sel_grad) / b.norm()).item()
+        indices.append(index)
+    return indices, w
+
+
+def test_optimal_weights_matches_reference():
+    g = torch.Generator().manual_seed(0)
+    A = torch.randn(300, 40, generator=g, dtype=torch.float64)
+    b = 10 * A[:100].mean(dim=0)
+    indices, weights = OptimalWeights(A, b, nnz=30)
+    ref_indices, ref_w = _reference(A, b, 30)
+    assert indices == ref_indices
+    assert len(set(indices)) == 30
+    assert all(abs(w - ref_w) < 1e-9 for w in weights)
+
+
+def test_optimal_weights_budget_larger_than_rows():
+    A = torch.randn(5, 3)
+    indices, weights = OptimalWeights(A, A.sum(dim=0), nnz=10)
+    assert sorted(indices) == list(range(5))
+    assert len(weights) == 5
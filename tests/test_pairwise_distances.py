@@ -0,0 +1,65 @@
+# Sanity checks for the tiled pairwise distances and similarity kernels
+import numpy as np
+import torch
+from cords.selectionstrategies.helpers import pairwise_distances, similarity_kernel, block_similarity_kernel, \
+    FactoredGradients, MemmapGradients
+from cords.selectionstrategies.helpers.memmap_gradients import memmap_array
+
+
+def _rows(n=300, d=40, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return torch.randn(n, d, generator=g, dtype=torch.float64).float()
+
+
+def test_pairwise_distances_match_cdist():
+    x, y = _rows(), _rows(n=170, seed=1)
+    expected = torch.cdist(x.double(), y.double()) ** 2
+    assert torch.allclose(pairwise_distances(x, y, tile_size=64).double(), expected, rtol=1e-4, atol=1e-3)
+    # a list of row blocks is concatenated, and the distances to itself have an exact zero diagonal
+    dist = pairwise_distances([x[:100], x[100:]], tile_size=64)
+    assert torch.all(torch.diagonal(dist) == 0)
+    assert torch.allclose(dist.double(), torch.cdist(x.double(), x.double()) ** 2, rtol=1e-4, atol=1e-3)
+    # other exponents keep the elementwise definition
+    dist = pairwise_distances(x, y, exp=4, tile_size=64)
+    assert torch.allclose(dist, torch.pow(x.unsqueeze(1) - y.unsqueeze(0), 4).sum(2), rtol=1e-5)
+
+
+def test_pairwise_distances_factored():
+    g = torch.Generator().manual_seed(0)
+    grads = FactoredGradients(torch.randn(120, 5, generator=g), torch.randn(120, 8, generator=g))
+    dense = grads.dense()
+    assert torch.allclose(pairwise_distances(grads, tile_size=50),
+                          pairwise_distances(dense, tile_size=50), rtol=1e-4, atol=1e-3)
+
+
+def test_similarity_kernel():
+    x = _rows()
+    dist = (torch.cdist(x.double(), x.double()) ** 2).numpy()
+    kernel, const = similarity_kernel(x, tile_size=64)
+    assert kernel.dtype == np.float32
+    assert np.isclose(const, dist.max(), rtol=1e-5)
+    assert np.allclose(kernel, const - dist, rtol=1e-4, atol=1e-3)
+    # the float16 kernel is scaled by 1 / const
+    half, const_half = similarity_kernel(x, dtype=np.float16, tile_size=64)
+    assert half.dtype == np.float16 and const_half == const
+    assert np.allclose(half, (const - dist) / const, atol=1e-3)
+    # memory mapped gradients are written into a memory mapped kernel
+    data = memmap_array(x.shape)
+    data[:] = x.numpy()
+    out = memmap_array((len(x), len(x)))
+    kernel_mm, const_mm = similarity_kernel(MemmapGradients(data, tile_bytes=64 * 40 * 4), out=out)
+    assert kernel_mm is out
+    assert np.isclose(const_mm, const) and np.allclose(kernel_mm, kernel, atol=1e-3)
+
+
+def test_block_similarity_kernel():
+    x = _rows(n=200)
+    labels = torch.randint(0, 3, (200,), generator=torch.Generator().manual_seed(0))
+    kernel, const = block_similarity_kernel([x[:90], x[90:]], labels, tile_size=32)
+    assert kernel.dtype == np.float32 and kernel.nnz == sum(int((labels == c).sum()) ** 2 for c in range(3))
+    # the dense kernel restricted to the pairs of the same label, with the largest distance within a label
+    same = (labels.view(-1, 1) == labels.view(1, -1)).numpy()
+    dist = (torch.cdist(x.double(), x.double()) ** 2).numpy()
+    assert np.isclose(const, dist[same].max(), rtol=1e-5)
+    assert np.allclose(kernel.toarray(), np.where(same, const - dist, 0), rtol=1e-4, atol=1e-3)
+    assert kernel.has_sorted_indices
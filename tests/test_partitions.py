@@ -0,0 +1,31 @@
+# Sanity checks for the partitions of the distributed submodular selection
+import numpy as np
+import torch
+from cords.selectionstrategies.helpers import partition_indices
+
+
+def _rows(n=500, d=4, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    # three well separated clusters of different sizes
+    labels = torch.tensor([0] * 300 + [1] * 150 + [2] * 50)[torch.randperm(n, generator=g)]
+    return 20 * torch.eye(d)[labels] + torch.randn(n, d, generator=g), labels
+
+
+def test_partition_indices_cover_the_rows():
+    x, _ = _rows()
+    for method in ['contiguous', 'random', 'cluster']:
+        parts = partition_indices(x, 120, method=method)
+        assert all(0 < len(part) <= 120 for part in parts)
+        assert np.array_equal(np.sort(np.concatenate(parts)), np.arange(len(x)))
+    assert [len(part) for part in partition_indices(x, 120, method='random')] == [100] * 5
+    # the random partitions depend on the seed only
+    assert all(np.array_equal(a, b) for a, b in zip(partition_indices(x, 120, seed=1),
+                                                    partition_indices(x.numpy(), 120, seed=1)))
+
+
+def test_partition_indices_cluster():
+    x, labels = _rows()
+    # every part lies within a single cluster, and the large clusters are cut into parts of at most 200 rows
+    parts = partition_indices(x, 200, method='cluster')
+    assert all(len(torch.unique(labels[torch.from_numpy(part)])) == 1 for part in parts)
+    assert sorted(len(part) for part in parts) == [50, 100, 150, 200]
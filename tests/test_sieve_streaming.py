@@ -0,0 +1,51 @@
+# Sanity checks for the one pass streaming facility location
+import numpy as np
+import torch
+from cords.selectionstrategies.helpers import SieveStreaming, facility_location_greedy, pairwise_distances
+
+
+def _rows(n=400, d=6, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    centers = 3 * torch.randn(10, d, generator=g)
+    return centers[torch.randint(10, (n,), generator=g)] + torch.randn(n, d, generator=g)
+
+
+def _value(x, idxs):
+    # exemplar based clustering with a phantom exemplar at the origin, on the whole dataset
+    base = (x.double() ** 2).sum(dim=1)
+    dist = pairwise_distances(x, x[torch.as_tensor(idxs)]).double().min(dim=1)[0]
+    return (base - torch.minimum(base, dist)).mean().item()
+
+
+def _stream(x, sieve, batch_size=32):
+    for start in range(0, len(x), batch_size):
+        sieve.update(x[start:start + batch_size])
+    return sieve.select()
+
+
+def test_sieve_streaming_approximation():
+    x = _rows()
+    base = (x.double() ** 2).sum(dim=1)
+    kernel = torch.clamp(base.view(1, -1) - pairwise_distances(x).double(), min=0).float()
+    for budget in [3, 10, 40]:
+        # the whole stream fits in the evaluation sample
+        ranking = _stream(x, SieveStreaming(budget, eval_size=len(x), epsilon=0.1))
+        assert len(np.unique(ranking)) == len(ranking) == budget
+        greedy, _ = facility_location_greedy(kernel, budget)
+        assert _value(x, ranking) >= (0.5 - 0.1) * _value(x, greedy)
+
+
+def test_sieve_streaming_completion():
+    x = _rows()
+    # a small evaluation sample saturates before the budget is met, and the selection is completed
+    for budget in [60, 300, 500]:
+        sieve = SieveStreaming(budget, eval_size=50, seed=1)
+        ranking = _stream(x, sieve)
+        assert len(np.unique(ranking)) == len(ranking) == min(budget, len(x))
+        assert ranking.min() >= 0 and ranking.max() < len(x)
+        assert len(sieve.eval_positions) == 50
+    # positions of the batch elements in the stream
+    sieve = SieveStreaming(5, eval_size=len(x))
+    for start in range(0, len(x), 100):
+        sieve.update(x[start:start + 100], positions=1000 + np.arange(start, start + 100))
+    assert np.all(sieve.select() >= 1000)
@@ -0,0 +1,65 @@
+# Sanity checks for the torch facility location and graph cut greedy
+import numpy as np
+import torch
+from scipy.sparse import csr_matrix
+from cords.selectionstrategies.helpers import facility_location_greedy, graph_cut_greedy, similarity_kernel, \
+    knn_graph
+from cords.selectionstrategies.helpers.memmap_gradients import memmap_array
+
+
+def _kernel(n=300, seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return similarity_kernel(torch.randn(n, 6, generator=g))[0]
+
+
+def _reference_greedy(gain, n, budget):
+    selected, gains = [], []
+    for _ in range(budget):
+        candidate_gains = [gain(selected, j) if j not in selected else -np.inf for j in range(n)]
+        selected.append(int(np.argmax(candidate_gains)))
+        gains.append(max(candidate_gains))
+    return selected, gains
+
+
+def _facility_location_gain(K):
+    return lambda S, j: np.maximum(K[S + [j]].max(axis=0) - (K[S].max(axis=0) if S else 0), 0).sum()
+
+
+def _graph_cut_gain(K):
+    return lambda S, j: K[j].sum() - K[j, j] - 2 * K[S, j].sum()
+
+
+def test_facility_location_greedy():
+    K = _kernel()
+    expected, expected_gains = _reference_greedy(_facility_location_gain(K.astype(np.float64)), len(K), 15)
+    for optimizer in ['naive', 'lazy', 'two-stage']:
+        for kernel in [K, torch.from_numpy(K), csr_matrix(K)]:
+            idxs, gains = facility_location_greedy(kernel, 15, optimizer=optimizer, n_naive=5, tile_bytes=2 ** 12)
+            assert idxs.tolist() == expected
+            assert np.allclose(gains.numpy(), expected_gains)
+    # the rows of a memory mapped kernel are read in panels
+    out = memmap_array(K.shape)
+    out[:] = K
+    assert facility_location_greedy(out, 15, tile_bytes=2 ** 12)[0].tolist() == expected
+    idxs, gains = facility_location_greedy(K, 15, optimizer='stochastic', epsilon=0.1)
+    assert len(set(idxs.tolist())) == 15
+    assert gains.sum() >= 0.9 * sum(expected_gains)
+
+
+def test_graph_cut_greedy():
+    K = _kernel()
+    expected, expected_gains = _reference_greedy(_graph_cut_gain(K.astype(np.float64)), len(K), 15)
+    for optimizer in ['naive', 'lazy']:
+        for kernel in [K, csr_matrix(K)]:
+            idxs, gains = graph_cut_greedy(kernel, 15, optimizer=optimizer)
+            assert idxs.tolist() == expected
+            assert np.allclose(gains.numpy(), expected_gains)
+
+
+def test_sparse_facility_location_greedy():
+    g = torch.Generator().manual_seed(0)
+    graph, _ = knn_graph(torch.randn(300, 6, generator=g), 8)
+    expected, _ = _reference_greedy(_facility_location_gain(graph.toarray().astype(np.float64)), 300, 15)
+    assert facility_location_greedy(graph, 15)[0].tolist() == expected
+    # the selection stops once the time limit is over, after the first element
+    assert len(facility_location_greedy(graph, 15, time_limit=0)[0]) == 1